@@ -1,11 +1,19 @@
-from typing import Tuple, List, Union, Optional, Dict, Callable, Iterable
+from typing import (Tuple, List, Union, Optional, Dict, Callable, Iterable,
+                    Any)
+from collections import OrderedDict
+import hashlib
 import os
+import threading
 
 from mongoengine import *
 from datetime import datetime
 import sympy
 from sympy.parsing.latex import parse_latex
 import mason
+import rational
+import kernels
+import sweep
+import stability
 import math
 import cmath
 import numpy as np
@@ -18,6 +26,7 @@ from dpi import remove_dead_branches
 from dpi import simplify_whole_graph
 import ltspice2svg
 import networkx as nx
+from pymongo.errors import PyMongoError
 
 
 if 'DB_URI' in os.environ:
@@ -29,11 +38,339 @@ else:
     connect('capstone')
 
 
+# Number of worker processes Mason's formula is evaluated across; 0 evaluates
+# it in the request's own process.
+MASON_PROCESSES = int(os.environ.get('MASON_PROCESSES', 0))
+
+# Memory allowed for the responses of a chunk of a multi-parameter sweep, in
+# bytes, and an estimate of the bytes used per point and frequency by the
+# response and the scan of its margins.
+SWEEP_MEMORY_LIMIT = int(os.environ.get('SWEEP_MEMORY_LIMIT', 64 * 2 ** 20))
+SWEEP_BYTES_PER_SAMPLE = 256
+
+
+# Guards the in-memory caches below, which are shared by the request threads.
+CACHE_LOCK = threading.Lock()
+
+
+def _recall(cache: OrderedDict, key) -> Any:
+    """Returns a cached value and marks it as most recently used, or None if
+    the key is not cached."""
+    with CACHE_LOCK:
+        value = cache.get(key)
+        if value is not None:
+            cache.move_to_end(key)
+        return value
+
+
+def _remember(cache: OrderedDict, limit: int, key, value):
+    with CACHE_LOCK:
+        cache[key] = value
+        cache.move_to_end(key)
+        if len(cache) > limit:
+            cache.popitem(last=False)
+
+
+# Mason contexts of recently used SFG revisions, most recently used last.
+MASON_CONTEXTS = OrderedDict()
+MASON_CONTEXT_LIMIT = 32
+
+
+def load_mason_context(sfg: bytes) -> mason.MasonContext:
+    """Returns the Mason context of a serialized SFG.
+
+    Contexts are cached by the serialized SFG, so every revision of an SFG
+    finds the cycles of each component and its determinant once per process,
+    no matter how many (input_node, output_node) pairs are requested. The
+    context enumerates components as they are needed, under the budget of
+    the request that needs them; a component whose enumeration exceeds its
+    budget is left for a later request.
+
+    Args:
+        sfg: A dill-serialized SFG.
+
+    Returns:
+        The Mason context of the SFG.
+    """
+    context = _recall(MASON_CONTEXTS, sfg)
+    if context is not None:
+        return context
+
+    context = mason.MasonContext(dill.loads(sfg), processes=MASON_PROCESSES)
+    _remember(MASON_CONTEXTS, MASON_CONTEXT_LIMIT, sfg, context)
+    return context
+
+
+# Results that depend on parameter values, such as substituted rational
+# functions and pole/zero analyses, keyed by the expression hash of the
+# symbolic function, the parameter hash, and the kind of result.
+NUMERIC_RESULTS = OrderedDict()
+NUMERIC_RESULT_LIMIT = 256
+
+
+def parameter_hash(parameters: Dict[str, float]) -> str:
+    """Finds a stable hash of parameter values.
+
+    Args:
+        parameters: Maps symbol names to their numerical values.
+
+    Returns:
+        A hexadecimal SHA-256 digest of the parameters.
+    """
+    text = repr(sorted((k, float(v)) for k, v in parameters.items()))
+    return hashlib.sha256(text.encode()).hexdigest()
+
+
+def load_numeric_result(
+    rational_function: rational.RationalFunction,
+    parameters: Dict[str, float],
+    kind: str,
+    compute: Callable[[rational.RationalFunction, Dict[str, float]], Any]
+) -> Any:
+    """Returns a cached result of a function for some parameter values.
+
+    Args:
+        rational_function: The symbolic function.
+        parameters: Maps symbol names to their numerical values.
+        kind: The name of the kind of result.
+        compute: Computes the result from the function and parameters, if
+            it is not cached.
+
+    Returns:
+        The result.
+    """
+    key = (kernels.expression_hash(rational_function),
+           parameter_hash(parameters), kind)
+
+    result = _recall(NUMERIC_RESULTS, key)
+    if result is not None:
+        return result
+
+    result = compute(rational_function, parameters)
+    _remember(NUMERIC_RESULTS, NUMERIC_RESULT_LIMIT, key, result)
+    return result
+
+
+def _complex_dict(value: complex) -> Dict[str, float]:
+    return {'real': float(value.real), 'imag': float(value.imag)}
+
+
+def analyze_poles_zeros(rational_function: rational.RationalFunction,
+                        parameters: Dict[str, float]) -> Dict:
+    """Finds the poles, zeros, DC gain and dominant pole of a function.
+
+    Args:
+        rational_function: The rational form of the function.
+        parameters: Maps symbol names to their numerical values.
+
+    Returns:
+        A dictionary of 'poles' and 'zeros', each in increasing magnitude,
+        'dc_gain', which is None if it is infinite, and the 'dominant_pole'
+        and its 'dominant_pole_estimate' from the two lowest-order
+        denominator coefficients. Roots are in rad/s, as dictionaries of
+        'real' and 'imag' parts; dominant poles also have their 'frequency'
+        magnitude in hertz.
+    """
+    poles = rational_function.poles(parameters)
+    zeros = rational_function.zeros(parameters)
+    dc_gain = rational_function.dc_gain(parameters)
+
+    def dominant(pole: Optional[complex]) -> Optional[Dict[str, float]]:
+        if pole is None:
+            return None
+        return {**_complex_dict(pole), 'frequency': abs(pole) / (2 * math.pi)}
+
+    return {
+        'poles': [_complex_dict(pole) for pole in poles],
+        'zeros': [_complex_dict(zero) for zero in zeros],
+        'dc_gain': None if cmath.isinf(dc_gain) else float(dc_gain.real),
+        'dominant_pole': dominant(poles[0] if len(poles) else None),
+        'dominant_pole_estimate': dominant(
+            rational_function.dominant_pole_estimate(parameters))
+    }
+
+
+class CompiledKernel(Document):
+    """The source text of a compiled kernel, keyed by its expression hash.
+
+    Kernels expire a day after they are stored, like circuits, and are
+    compiled again on their next use.
+    """
+    key = StringField(primary_key=True)
+    source = StringField()
+    arguments = ListField(StringField())
+    created = DateTimeField(default=datetime.utcnow)
+    meta = {
+        'indexes': [
+            {'fields': ['created'], 'expireAfterSeconds': 86400}
+        ]
+    }
+
+
+# Kernels in memory, backed by the private directory KERNEL_CACHE_DIR if it is
+# set, and then by the database, which is the only tier shared between users.
+KERNELS = kernels.KernelCache(os.environ.get('KERNEL_CACHE_DIR'))
+
+
+def load_kernel(rational_function: rational.RationalFunction) \
+        -> kernels.Kernel:
+    """Returns the kernel of a rational function.
+
+    Kernels are looked up by expression hash in memory, then in the local
+    directory, then in the database, and are only compiled if none has them.
+    Newly found kernels are written back to every tier.
+
+    Args:
+        rational_function: A rational function.
+
+    Returns:
+        The kernel of the rational function.
+    """
+    key = kernels.expression_hash(rational_function)
+
+    kernel = KERNELS.get(key)
+    if kernel is not None:
+        return kernel
+
+    # The database is only a cache tier, so kernels are still compiled when
+    # it is unreachable.
+    try:
+        document = CompiledKernel.objects(key=key).first()
+        reachable = True
+    except PyMongoError:
+        document = None
+        reachable = False
+
+    if document:
+        kernel = kernels.Kernel(document.source, document.arguments)
+    else:
+        kernel = kernels.compile_kernel(rational_function)
+        if reachable:
+            try:
+                CompiledKernel(key=key, source=kernel.source,
+                               arguments=kernel.arguments).save()
+            except PyMongoError:
+                pass
+
+    KERNELS.put(key, kernel)
+    return kernel
+
+
+class SymbolicResult(Document):
+    """A symbolic transfer function or loop gain of an SFG structure.
+
+    Results are keyed by the SFG fingerprint and the function, so they are
+    shared by every circuit of the same topology and component names. They
+    expire a day after they are stored, like circuits.
+    """
+    key = StringField(primary_key=True)
+    sympy_expression = BinaryField()
+    rational_function = BinaryField()
+    # The engine that derived the result, or None for results stored before
+    # it was recorded.
+    engine = StringField()
+    created = DateTimeField(default=datetime.utcnow)
+    meta = {
+        'indexes': [
+            {'fields': ['created'], 'expireAfterSeconds': 86400}
+        ]
+    }
+
+
+# Symbolic results of recently used SFG structures, most recently used last.
+SYMBOLIC_RESULTS = OrderedDict()
+SYMBOLIC_RESULT_LIMIT = 256
+
+# Fingerprints of recently used serialized SFGs.
+FINGERPRINTS = OrderedDict()
+FINGERPRINT_LIMIT = 256
+
+
+def sfg_fingerprint(sfg: bytes) -> str:
+    """Returns the fingerprint of a serialized SFG.
+
+    Args:
+        sfg: A dill-serialized SFG.
+
+    Returns:
+        The structural fingerprint of the SFG.
+    """
+    fingerprint = _recall(FINGERPRINTS, sfg)
+    if fingerprint is not None:
+        return fingerprint
+
+    fingerprint = mason.sfg_fingerprint(dill.loads(sfg))
+    _remember(FINGERPRINTS, FINGERPRINT_LIMIT, sfg, fingerprint)
+    return fingerprint
+
+
+def load_symbolic_result(key: str) \
+        -> Optional[Tuple[sympy.Expr, rational.RationalFunction,
+                          Optional[str]]]:
+    """Finds a symbolic result in memory, or else in the database.
+
+    Args:
+        key: The key of the result.
+
+    Returns:
+        A (sympy_expression, rational_function, engine) tuple, or None if the
+        result is not cached. The engine is None if it was not recorded.
+    """
+    result = _recall(SYMBOLIC_RESULTS, key)
+    if result is not None:
+        return result
+
+    try:
+        document = SymbolicResult.objects(key=key).first()
+    except PyMongoError:
+        # The database is only a cache tier.
+        return None
+
+    if not document:
+        return None
+
+    result = (dill.loads(document.sympy_expression),
+              dill.loads(document.rational_function), document.engine)
+    _remember(SYMBOLIC_RESULTS, SYMBOLIC_RESULT_LIMIT, key, result)
+    return result
+
+
+def store_symbolic_result(key: str, sympy_expression: sympy.Expr,
+                          rational_function: rational.RationalFunction,
+                          engine: str):
+    """Caches a symbolic result in memory and in the database.
+
+    Args:
+        key: The key of the result.
+        sympy_expression: The symbolic expression.
+        rational_function: Its rational form.
+        engine: The engine that derived it.
+    """
+    _remember(SYMBOLIC_RESULTS, SYMBOLIC_RESULT_LIMIT, key,
+              (sympy_expression, rational_function, engine))
+
+    try:
+        SymbolicResult(
+            key=key,
+            sympy_expression=dill.dumps(sympy_expression),
+            rational_function=dill.dumps(rational_function),
+            engine=engine
+        ).save()
+    except PyMongoError:
+        pass
+
+
 class TransferFunction(EmbeddedDocument):
     input_node = StringField()
     output_node = StringField()
     sympy_expression = BinaryField()
+    # Unused; kept so that documents cached with pickled lambda functions
+    # still load.
     lambda_function = BinaryField()
+    rational_function = BinaryField()
+    # The engine that derived the function, or None for functions cached
+    # before it was recorded.
+    engine = StringField()
 
     meta = {
         'indexes': [
@@ -47,7 +384,13 @@ class TransferFunction(EmbeddedDocument):
 
 class LoopGainFunction(EmbeddedDocument):
     sympy_expression = BinaryField()
+    # Unused; kept so that documents cached with pickled lambda functions
+    # still load.
     lambda_function = BinaryField()
+    rational_function = BinaryField()
+    # The engine that derived the function, or None for functions cached
+    # before it was recorded.
+    engine = StringField()
 
 
 class Circuit(Document):
@@ -68,6 +411,12 @@ class Circuit(Document):
     }
     sfg_stack = []
     redo_stack = []
+    # The plan of the last symbolic result, or None if none was requested.
+    # Its 'estimate' is None unless the result was just planned by the 'auto'
+    # engine, and its 'engine' is the one that derived the result, even if it
+    # was cached, or 'cached' if that was not recorded. See
+    # plan_transfer_function.
+    engine_plan = None
 
     def to_dict(self, fields: Optional[Iterable[str]] = None) -> Dict:
         """Returns a dictionary representation of the Circuit document.
@@ -202,59 +551,203 @@ class Circuit(Document):
 
         self.parameters.update(update_dict)
 
+        # Symbolic results do not depend on parameter values, so they are
+        # kept; numeric results are cached by the parameter hash instead.
+
+    def evaluation_parameters(self, overrides: Optional[Dict] = None) \
+            -> Dict:
+        """Finds the parameter values to evaluate the circuit with.
+
+        Overrides apply to this evaluation only; the circuit parameters are
+        not modified.
+
+        Args:
+            overrides: Optional; Maps parameter names to the values to use
+                instead of the circuit's. Values may be arrays.
+
+        Returns:
+            The parameters, without the frequency 'f'.
+
+        Raises:
+            ValueError: If an override is not a parameter of the circuit.
+        """
+        overrides = overrides or {}
+        if not overrides.keys() <= self.parameters.keys() - {'f'}:
+            raise ValueError('Invalid parameters.')
+
+        parameters = {k: v for k, v in self.parameters.items() if k != 'f'}
+        parameters.update(overrides)
+        return parameters
+
+    def _cached_rational_function(
+        self,
+        input_node: Optional[str] = None,
+        output_node: Optional[str] = None
+    ) -> Optional[rational.RationalFunction]:
+        """Finds the rational form of a transfer function or loop gain,
+            if it was already derived for this circuit or its structure.
+
+        Args:
+            input_node: The name of the input node. If input_node or
+                output_node is None, finds the loop gain instead.
+            output_node: The name of the output node.
+
+        Returns:
+            The rational function, or None if it was never derived.
+        """
+        if input_node is None or output_node is None:
+            document = self.loop_gain
+            key = '%s:loop_gain' % sfg_fingerprint(self.sfg)
+        else:
+            document = self.transfer_functions. \
+                filter(input_node=input_node, output_node=output_node).first()
+            key = '%s:transfer_function:%s:%s' % (
+                sfg_fingerprint(self.sfg), input_node, output_node)
+
+        if document and document.rational_function:
+            return dill.loads(document.rational_function)
+
+        result = load_symbolic_result(key)
+        return result[1] if result else None
+
+    def _invalidate_symbolic_results(self):
+        """Discards the cached symbolic results of the circuit.
+
+        Called whenever the SFG changes.
+        """
         self.transfer_functions.delete()
         self.loop_gain = None
 
+    def _plan_cached(self, engine: Optional[str]):
+        """Records the plan of a cached symbolic result, which reports the
+        engine that derived it."""
+        self.engine_plan = {'engine': engine or 'cached', 'estimate': None}
+
+    def plan_transfer_function(
+        self,
+        input_node: Optional[str] = None,
+        output_node: Optional[str] = None,
+        budget: Optional[mason.Budget] = None
+    ) -> Dict:
+        """Estimates the cost of a symbolic transfer function or loop gain,
+            and picks the engine to compute it with.
+
+        Symbolic results are derived with the 'auto' engine only if they are
+        not cached, and planned then, so this is only needed to inspect the
+        plan beforehand.
+
+        Args:
+            input_node: The name of the input node. If input_node or
+                output_node is None, plans for the loop gain instead.
+            output_node: The name of the output node.
+            budget: Optional; The budget of the request, whose time is
+                checked while estimating.
+
+        Returns:
+            A dictionary with the chosen 'engine' and the cost 'estimate'.
+
+        Raises:
+            BudgetExceeded: If the estimate runs out of time, or the
+                expression is estimated to be too large for either engine.
+        """
+        estimate = mason.estimate_cost(
+            dill.loads(self.sfg), input_node, output_node, budget=budget
+        )
+        return {'engine': mason.plan_engine(estimate), 'estimate': estimate}
+
     def _compute_transfer_function(
         self,
         input_node: str,
         output_node: str,
-        cache_result: bool
-    ) -> Tuple[sympy.Expr, Callable]:
+        cache_result: bool,
+        engine: str = 'auto',
+        budget: Optional[mason.Budget] = None
+    ) -> Tuple[sympy.Expr, rational.RationalFunction, kernels.Kernel]:
 
         # Finds the transfer function sub-document by (input_node, output_node).
         transfer_function = self.transfer_functions. \
             filter(input_node=input_node, output_node=output_node).first()
 
-        if transfer_function:
+        if transfer_function and transfer_function.rational_function:
             # The transfer function was previously computed and cached.
 
             # De-serialize
             sympy_expression = dill.loads(transfer_function.sympy_expression)
-            lambda_function = dill.loads(transfer_function.lambda_function)
-            return sympy_expression, lambda_function
-
-        # De-serialize the signal-flow graph.
-        sfg = dill.loads(self.sfg)
-
-        # Compute the transfer function.
-        sympy_expression, _ = mason.transfer_function(
-            sfg, input_node, output_node
-        )
-
-        # Substitute all terms for their numerical values except the frequency.
-        lambda_function = sympy_expression.subs(
-            {k: v for k, v in self.parameters.items() if k != 'f'}
-        )
+            rational_function = dill.loads(
+                transfer_function.rational_function)
+            self._plan_cached(transfer_function.engine)
+            return sympy_expression, rational_function, \
+                load_kernel(rational_function)
+
+        # Circuits of the same structure share their symbolic results.
+        key = '%s:transfer_function:%s:%s' % (
+            sfg_fingerprint(self.sfg), input_node, output_node)
+        result = load_symbolic_result(key)
+
+        if result:
+            sympy_expression, rational_function, engine = result
+            self._plan_cached(engine)
+        else:
+            sympy_expression, rational_function, engine = \
+                self._derive_transfer_function(
+                    input_node, output_node, engine, budget)
+            store_symbolic_result(key, sympy_expression, rational_function,
+                                  engine)
 
-        # Compile symbolic expression into lambda function for numerical
-        # computations.
-        lambda_function = sympy.lambdify('s', lambda_function, 'numpy')
+        kernel = load_kernel(rational_function)
 
         if cache_result:
-            # Cache the newly computed sympy expression and lambda function for
-            # re-use.
+            # Cache the expression and rational form for re-use; kernels are
+            # cached separately by expression hash. Entries cached before
+            # the rational form was stored are replaced, not duplicated.
+            self.transfer_functions. \
+                filter(input_node=input_node, output_node=output_node). \
+                delete()
             self.transfer_functions.append(
                 TransferFunction(
                     input_node=input_node,
                     output_node=output_node,
-                    # Serialize expression and function objects.
+                    # Serialize expression objects.
                     sympy_expression=dill.dumps(sympy_expression),
-                    lambda_function=dill.dumps(lambda_function, recurse=True)
+                    rational_function=dill.dumps(rational_function),
+                    engine=engine
                 )
             )
 
-        return sympy_expression, lambda_function
+        return sympy_expression, rational_function, kernel
+
+    def _derive_transfer_function(
+        self,
+        input_node: str,
+        output_node: str,
+        engine: str,
+        budget: Optional[mason.Budget]
+    ) -> Tuple[sympy.Expr, rational.RationalFunction, str]:
+
+        if engine == 'auto':
+            self.engine_plan = self.plan_transfer_function(
+                input_node, output_node, budget)
+            engine = self.engine_plan['engine']
+        else:
+            self.engine_plan = {'engine': engine, 'estimate': None}
+
+        if engine == 'mason':
+            # Compute the transfer function, re-using the cycles and
+            # determinant of this SFG revision.
+            sympy_expression, _ = load_mason_context(self.sfg). \
+                transfer_function(input_node, output_node, budget,
+                                  with_loop_gain=False)
+        elif engine == 'elimination':
+            sympy_expression, _ = mason.elimination_transfer_function(
+                dill.loads(self.sfg), input_node, output_node, budget,
+                with_loop_gain=False
+            )
+        else:
+            raise ValueError('Invalid engine.')
+
+        # Collect the numerator and denominator by powers of s.
+        return sympy_expression, \
+            rational.RationalFunction.from_expr(sympy_expression), engine
 
     def compute_transfer_function(
         self,
@@ -263,7 +756,9 @@ class Circuit(Document):
         latex: bool = True,
         factor: bool = True,
         numerical: bool = False,
-        cache_result: bool = False
+        cache_result: bool = False,
+        engine: str = 'auto',
+        budget: Optional[mason.Budget] = None
     ) -> str:
         """Computes the transfer function between a pair of input and output nodes.
 
@@ -272,31 +767,42 @@ class Circuit(Document):
             output_node: The name of the output node.
             latex: If True, formats the transfer function in latex. Defaults to
                 True.
-            factor: If True, factors the expression. Defaults to True.
+            factor: If True, pulls common factors out of the coefficient of
+                each power of s. Defaults to True.
             numerical: If True, substitutes all symbols for numerical values,
                 except 's'. Defaults to False.
             cache_result: If True, caches the computed transfer function;
                 save() should be called to propagate changes to the cache.
+            engine: The symbolic engine. Can be 'mason' for Mason's gain
+                formula, 'elimination' for node elimination, which
+                scales better to SFGs with many loops, or 'auto' to pick one
+                by estimated cost. Defaults to 'auto'.
+            budget: Optional; The time and term budget of the symbolic engine.
 
         Returns:
             The transfer function.
+
+        Raises:
+            mason.BudgetExceeded: If the evaluation exceeds its budget.
         """
-        sympy_expression, _ = self._compute_transfer_function(
+        _, rational_function, _ = self._compute_transfer_function(
             input_node,
             output_node,
-            cache_result=cache_result
+            cache_result=cache_result,
+            engine=engine,
+            budget=budget
         )
 
         if numerical:
-            sympy_expression = sympy_expression.subs(
-                {k: v for k, v in self.parameters.items() if k != 'f'}
+            rational_function = load_numeric_result(
+                rational_function,
+                {k: v for k, v in self.parameters.items() if k != 'f'},
+                'substitute',
+                rational.RationalFunction.substitute
             )
 
-        if factor:
-            sympy_expression = sympy_expression.factor()
-
-        return sympy.latex(sympy_expression) if latex \
-            else str(sympy_expression)
+        return rational_function.latex(factor) if latex \
+            else rational_function.to_string(factor)
 
     def eval_transfer_function(
         self,
@@ -308,7 +814,9 @@ class Circuit(Document):
         frequency_unit: str = 'hz',
         gain_unit: Union[str, None] = 'db',
         phase_unit: str = 'deg',
-        cache_result: bool = False
+        cache_result: bool = False,
+        parameters: Optional[Dict] = None,
+        adaptive: bool = False
     ) -> Tuple[List[float], List[float], List[float]]:
         """Given a frequency range, evaluates the gain and phase of the
             transfer function over that range.
@@ -325,124 +833,154 @@ class Circuit(Document):
                 '' for dimensionless, or 'db' for decibels.
             phase_unit: The unit for the phase output. Can be 'deg' for degrees,
                 or 'rad' for radians.
-            cache_result: If True, caches the computed transfer function;
-                save() should be called to propagate changes to the cache.
+            cache_result: Unused; the response is evaluated from a cached
+                kernel if there is one, and numerically without
+                deriving a symbolic transfer function otherwise.
+            parameters: Optional; Parameter values to use instead of the
+                circuit's for this evaluation only. The circuit is not
+                modified.
+            adaptive: If True, samples the frequency range adaptively,
+                starting from points_per_decade and refining where the gain
+                or phase curves, and at the poles and zeros if they are
+                known. See sweep.adaptive_frequencies.
 
         Returns:
             A (frequency_list, gain_list, phase_list) tuple.
-        """
-        _, lambda_function = self._compute_transfer_function(
-            input_node,
-            output_node,
-            cache_result=cache_result
-        )
 
-        num_decades = math.log10(end_freq / start_freq)
-        num_points = round(points_per_decade * num_decades)
-        # Note that transfer function is expressed in terms of s.
-        freq = np.logspace(math.log10(start_freq),
-                           math.log10(end_freq),
-                           num_points)
-
-        if frequency_unit == 'hz':
-            # Must scale by 2 * pi to get s.
-            s = 1j * 2 * np.pi * freq
-        elif frequency_unit == 'rad/s':
-            s = 1j * freq
-            pass
-        else:
-            raise ValueError('Invalid frequency unit.')
+        Raises:
+            ValueError: If an override is not a parameter of the circuit.
+        """
+        parameters = self.evaluation_parameters(parameters)
 
-        output = lambda_function(s)
+        rational_function = self._cached_rational_function(input_node,
+                                                           output_node)
 
-        # If the output is not the same length as the frequency array, then
-        # it does not depend on the input, in which case we must pad it.
-        if not isinstance(output, np.ndarray):
-            output = np.repeat(output, len(freq))
+        if rational_function:
+            # Evaluate the kernel of the cached rational form, which takes
+            # every parameter as an argument.
+            kernel = load_kernel(rational_function)
 
-        # Get the magnitude of complex output,
-        # and convert to the correct units.
-        if gain_unit in (None, ''):
-            gain = np.abs(output)
-        elif gain_unit == 'db':
-            gain = 20 * np.log10(np.abs(output))
+            def evaluate(s):
+                return kernel(s, parameters)
         else:
-            raise ValueError('Invalid gain unit.')
+            # Only numbers are needed, so solve the SFG directly at each
+            # frequency instead of deriving the symbolic transfer function.
+            sfg = dill.loads(self.sfg)
 
-        # Get the phase of complex output,
-        # and convert to correct units.
-        if phase_unit == 'rad':
-            phase = np.angle(output, deg=False)
-        elif phase_unit == 'deg':
-            phase = np.angle(output, deg=True)
-        else:
-            raise ValueError('Invalid phase unit.')
+            def evaluate(s):
+                return mason.numeric_transfer_function(
+                    sfg, input_node, output_node, s, parameters)
 
-        # Convert numpy arrays to plain python lists.
-        return freq.tolist(), gain.tolist(), phase.tolist()
+        freq, output = self._sample_response(
+            evaluate, start_freq, end_freq, points_per_decade,
+            frequency_unit, adaptive, rational_function, parameters)
+
+        return self._frequency_response(freq, output, gain_unit, phase_unit)
 
-    def _compute_loop_gain(self, cache_result: bool) \
-            -> Tuple[sympy.Expr, Callable]:
+    def _compute_loop_gain(self, cache_result: bool, engine: str = 'auto',
+                           budget: Optional[mason.Budget] = None) \
+            -> Tuple[sympy.Expr, rational.RationalFunction, kernels.Kernel]:
 
-        if self.loop_gain:
+        if self.loop_gain and self.loop_gain.rational_function:
             sympy_expression = dill.loads(self.loop_gain.sympy_expression)
-            lambda_function = dill.loads(self.loop_gain.lambda_function)
-            return sympy_expression, lambda_function
+            rational_function = dill.loads(self.loop_gain.rational_function)
+            self._plan_cached(self.loop_gain.engine)
+            return sympy_expression, rational_function, \
+                load_kernel(rational_function)
 
-        # De-serialize the signal-flow graph.
-        sfg = dill.loads(self.sfg)
+        key = '%s:loop_gain' % sfg_fingerprint(self.sfg)
+        result = load_symbolic_result(key)
 
-        # Compute the loop gain function.
-        sympy_expression = mason.loop_gain(sfg)
-
-        # Substitute all terms for their numerical values except the frequency.
-        lambda_function = sympy_expression.subs(
-            {k: v for k, v in self.parameters.items() if k != 'f'}
-        )
+        if result:
+            sympy_expression, rational_function, engine = result
+            self._plan_cached(engine)
+        else:
+            sympy_expression, rational_function, engine = \
+                self._derive_loop_gain(engine, budget)
+            store_symbolic_result(key, sympy_expression, rational_function,
+                                  engine)
 
-        # Compile symbolic expression into lambda function for numerical
-        # computations.
-        lambda_function = sympy.lambdify('s', lambda_function, 'numpy')
+        kernel = load_kernel(rational_function)
 
         if cache_result:
             self.loop_gain = LoopGainFunction(
                 sympy_expression=dill.dumps(sympy_expression),
-                lambda_function=dill.dumps(lambda_function, recurse=True)
+                rational_function=dill.dumps(rational_function),
+                engine=engine
             )
 
-        return sympy_expression, lambda_function
+        return sympy_expression, rational_function, kernel
+
+    def _derive_loop_gain(self, engine: str,
+                          budget: Optional[mason.Budget]) \
+            -> Tuple[sympy.Expr, rational.RationalFunction, str]:
+
+        if engine == 'auto':
+            self.engine_plan = self.plan_transfer_function(budget=budget)
+            engine = self.engine_plan['engine']
+        else:
+            self.engine_plan = {'engine': engine, 'estimate': None}
+
+        # Compute the loop gain function.
+        if engine == 'mason':
+            sympy_expression = load_mason_context(self.sfg).loop_gain(
+                budget)
+        elif engine == 'elimination':
+            sympy_expression = mason.elimination_loop_gain(
+                dill.loads(self.sfg), budget
+            )
+        else:
+            raise ValueError('Invalid engine.')
+
+        # Collect the numerator and denominator by powers of s.
+        return sympy_expression, \
+            rational.RationalFunction.from_expr(sympy_expression), engine
 
     def compute_loop_gain(
         self,
         latex: bool = False,
         factor: bool = True,
         numerical: bool = False,
-        cache_result: bool = False
+        cache_result: bool = False,
+        engine: str = 'auto',
+        budget: Optional[mason.Budget] = None
     ):
         """Computes the loop gain function of a circuit.
 
         Args:
             latex: If True, formats the function in latex.
-            factor: If True, factors the expression. Defaults to True.
+            factor: If True, pulls common factors out of the coefficient of
+                each power of s. Defaults to True.
             numerical: If True, substitutes all symbols for numerical values,
                 except 's'. Defaults to False.
             cache_result: If True, caches the computed loop gain function;
                 save() should be called to propagate changes to the cache.
+            engine: The symbolic engine. Can be 'mason', 'elimination', or
+                'auto'. Defaults to 'auto'.
+            budget: Optional; The time and term budget of the symbolic engine.
 
         Returns:
             The loop gain function.
+
+        Raises:
+            mason.BudgetExceeded: If the evaluation exceeds its budget.
         """
-        sympy_expression, _ = self._compute_loop_gain(cache_result=cache_result)
+        _, rational_function, _ = self._compute_loop_gain(
+            cache_result=cache_result,
+            engine=engine,
+            budget=budget
+        )
 
         if numerical:
-            sympy_expression = sympy_expression.subs(
-                {k: v for k, v in self.parameters.items() if k != 'f'}
+            rational_function = load_numeric_result(
+                rational_function,
+                {k: v for k, v in self.parameters.items() if k != 'f'},
+                'substitute',
+                rational.RationalFunction.substitute
             )
 
-        if factor:
-            sympy_expression = sympy_expression.factor()
-
-        return sympy.latex(sympy_expression) if latex else str(sympy_expression)
+        return rational_function.latex(factor) if latex \
+            else rational_function.to_string(factor)
 
     def eval_loop_gain(
             self,
@@ -452,7 +990,9 @@ class Circuit(Document):
             frequency_unit: str = 'hz',
             gain_unit: Union[str, None] = 'db',
             phase_unit: str = 'deg',
-            cache_result: bool = False
+            cache_result: bool = False,
+            parameters: Optional[Dict] = None,
+            adaptive: bool = False
     ) -> Tuple[List[float], List[float], List[float]]:
         """Given a frequency range, evaluates the gain and phase of the
             loop gain function over that range.
@@ -467,14 +1007,221 @@ class Circuit(Document):
                 '' for dimensionless, or 'db' for decibels.
             phase_unit: The unit for the phase output. Can be 'deg' for degrees,
                 or 'rad' for radians.
-            cache_result: If True, caches the computed loop gain function;
-                save() should be called to propagate changes to the cache.
+            cache_result: Unused; the response is evaluated from a cached
+                kernel if there is one, and numerically without
+                deriving a symbolic loop gain otherwise.
+            parameters: Optional; Parameter values to use instead of the
+                circuit's for this evaluation only. The circuit is not
+                modified.
+            adaptive: If True, samples the frequency range adaptively. See
+                eval_transfer_function.
 
         Returns:
             A (frequency_list, gain_list, phase_list) tuple.
+
+        Raises:
+            ValueError: If an override is not a parameter of the circuit.
         """
-        _, lambda_function = self._compute_loop_gain(cache_result=cache_result)
+        parameters = self.evaluation_parameters(parameters)
+
+        rational_function = self._cached_rational_function()
+
+        if rational_function:
+            kernel = load_kernel(rational_function)
+
+            def evaluate(s):
+                return kernel(s, parameters)
+        else:
+            sfg = dill.loads(self.sfg)
+
+            def evaluate(s):
+                return mason.numeric_loop_gain(sfg, s, parameters)
+
+        freq, output = self._sample_response(
+            evaluate, start_freq, end_freq, points_per_decade,
+            frequency_unit, adaptive, rational_function, parameters)
+
+        return self._frequency_response(freq, output, gain_unit, phase_unit)
+
+    def compute_transfer_function_poles_zeros(
+        self,
+        input_node: str,
+        output_node: str,
+        engine: str = 'auto',
+        budget: Optional[mason.Budget] = None
+    ) -> Dict:
+        """Finds the poles, zeros, DC gain and dominant pole of the transfer
+            function between a pair of input and output nodes.
+
+        The roots are found numerically from the coefficients of the
+        rational form for the current parameters, and cached by the
+        function and the parameter hash.
+
+        Args:
+            input_node: The name of the input node.
+            output_node: The name of the output node.
+            engine: The symbolic engine. Can be 'mason', 'elimination', or
+                'auto'. Defaults to 'auto'.
+            budget: Optional; The time and term budget of the symbolic engine.
 
+        Returns:
+            The analysis, as returned by analyze_poles_zeros.
+        """
+        _, rational_function, _ = self._compute_transfer_function(
+            input_node,
+            output_node,
+            cache_result=False,
+            engine=engine,
+            budget=budget
+        )
+        return load_numeric_result(
+            rational_function,
+            {k: v for k, v in self.parameters.items() if k != 'f'},
+            'poles_zeros',
+            analyze_poles_zeros
+        )
+
+    def compute_loop_gain_poles_zeros(
+        self,
+        engine: str = 'auto',
+        budget: Optional[mason.Budget] = None
+    ) -> Dict:
+        """Finds the poles, zeros, DC gain and dominant pole of the loop gain.
+
+        Args:
+            engine: The symbolic engine. Can be 'mason', 'elimination', or
+                'auto'. Defaults to 'auto'.
+            budget: Optional; The time and term budget of the symbolic engine.
+
+        Returns:
+            The analysis, as returned by analyze_poles_zeros.
+        """
+        _, rational_function, _ = self._compute_loop_gain(
+            cache_result=False,
+            engine=engine,
+            budget=budget
+        )
+        return load_numeric_result(
+            rational_function,
+            {k: v for k, v in self.parameters.items() if k != 'f'},
+            'poles_zeros',
+            analyze_poles_zeros
+        )
+
+    def compute_transfer_matrix(
+        self,
+        input_nodes: List[str],
+        output_nodes: List[str],
+        latex: bool = True,
+        factor: bool = True,
+        numerical: bool = False,
+        budget: Optional[mason.Budget] = None
+    ) -> List[List[str]]:
+        """Computes the transfer functions between every pair of input and
+            output nodes, from a single elimination of the SFG.
+
+        Args:
+            input_nodes: The names of the input nodes.
+            output_nodes: The names of the output nodes.
+            latex: If True, formats the transfer functions in latex. Defaults
+                to True.
+            factor: If True, pulls common factors out of the coefficient of
+                each power of s. Defaults to True.
+            numerical: If True, substitutes all symbols for numerical values,
+                except 's'. Defaults to False.
+            budget: Optional; The time and term budget of the elimination.
+
+        Returns:
+            The transfer functions, as a list with one row for each output
+            node and one column for each input node.
+
+        Raises:
+            mason.BudgetExceeded: If the elimination exceeds its budget.
+        """
+        matrix = mason.elimination_transfer_matrix(
+            dill.loads(self.sfg), input_nodes, output_nodes, budget
+        )
+        parameters = {k: v for k, v in self.parameters.items() if k != 'f'}
+
+        result = []
+        for j in range(matrix.rows):
+            row = []
+            for entry in matrix.row(j):
+                rational_function = rational.RationalFunction.from_expr(entry)
+                if numerical:
+                    rational_function = rational_function.substitute(
+                        parameters)
+                row.append(rational_function.latex(factor) if latex
+                           else rational_function.to_string(factor))
+            result.append(row)
+
+        return result
+
+    def eval_transfer_matrix(
+        self,
+        input_nodes: List[str],
+        output_nodes: List[str],
+        start_freq: float,
+        end_freq: float,
+        points_per_decade: int,
+        frequency_unit: str = 'hz',
+        gain_unit: Union[str, None] = 'db',
+        phase_unit: str = 'deg'
+    ) -> Tuple[List[float], List[List[List[float]]], List[List[List[float]]]]:
+        """Given a frequency range, evaluates the gain and phase of the
+            transfer functions between every pair of input and output nodes.
+
+        Args:
+            input_nodes: The names of the input nodes.
+            output_nodes: The names of the output nodes.
+            start_freq: The starting frequency.
+            end_freq: The ending frequency.
+            points_per_decade: The number of points to plot per decade.
+            frequency_unit: The unit for the input frequency range. Can be 'hz'
+                or 'rad/s'.
+            gain_unit: The unit for the gain output. Can be None or
+                '' for dimensionless, or 'db' for decibels.
+            phase_unit: The unit for the phase output. Can be 'deg' for degrees,
+                or 'rad' for radians.
+
+        Returns:
+            A (frequency_list, gain_lists, phase_lists) tuple, where
+            gain_lists[j][i] and phase_lists[j][i] are the responses from
+            input_nodes[i] to output_nodes[j].
+        """
+        freq, s = self._frequency_grid(start_freq, end_freq,
+                                       points_per_decade, frequency_unit)
+
+        # Every pair is solved in the same batched solve of (I - A).
+        output = mason.numeric_transfer_matrix(
+            dill.loads(self.sfg),
+            input_nodes,
+            output_nodes,
+            s,
+            {k: v for k, v in self.parameters.items() if k != 'f'}
+        )
+
+        gain = [[None] * len(input_nodes) for _ in output_nodes]
+        phase = [[None] * len(input_nodes) for _ in output_nodes]
+        for j in range(len(output_nodes)):
+            for i in range(len(input_nodes)):
+                _, gain[j][i], phase[j][i] = self._frequency_response(
+                    freq, output[:, j, i], gain_unit, phase_unit)
+
+        return freq.tolist(), gain, phase
+
+    @staticmethod
+    def _frequency_grid(
+        start_freq: float,
+        end_freq: float,
+        points_per_decade: int,
+        frequency_unit: str
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """Builds a logarithmic frequency grid.
+
+        Returns:
+            A (frequency, s) tuple of arrays.
+        """
         num_decades = math.log10(end_freq / start_freq)
         num_points = round(points_per_decade * num_decades)
         # Note that transfer function is expressed in terms of s.
@@ -487,12 +1234,65 @@ class Circuit(Document):
             s = 1j * 2 * np.pi * freq
         elif frequency_unit == 'rad/s':
             s = 1j * freq
-            pass
         else:
             raise ValueError('Invalid frequency unit.')
 
-        output = lambda_function(s)
+        return freq, s
+
+    @classmethod
+    def _sample_response(
+        cls,
+        evaluate: Callable[[np.ndarray], np.ndarray],
+        start_freq: float,
+        end_freq: float,
+        points_per_decade: int,
+        frequency_unit: str,
+        adaptive: bool,
+        rational_function: Optional[rational.RationalFunction],
+        parameters: Dict
+    ) -> Tuple[np.ndarray, Union[np.ndarray, complex]]:
+        """Samples a function of s over a frequency range, on a logarithmic
+            grid or adaptively.
 
+        Returns:
+            A (frequency, output) tuple.
+        """
+        if not adaptive:
+            freq, s = cls._frequency_grid(start_freq, end_freq,
+                                          points_per_decade, frequency_unit)
+            return freq, evaluate(s)
+
+        if frequency_unit == 'hz':
+            scale = 2 * np.pi
+        elif frequency_unit == 'rad/s':
+            scale = 1
+        else:
+            raise ValueError('Invalid frequency unit.')
+
+        # Sample the poles and zeros from the start, so that narrow peaks
+        # and notches are never stepped over.
+        hints = None
+        if rational_function:
+            roots = np.concatenate([rational_function.poles(parameters),
+                                    rational_function.zeros(parameters)])
+            hints = np.abs(roots) / scale
+
+        return sweep.adaptive_frequencies(
+            lambda freq: evaluate(1j * scale * freq),
+            start_freq, end_freq, points_per_decade, hints)
+
+    @staticmethod
+    def _frequency_response(
+        freq: np.ndarray,
+        output: Union[np.ndarray, complex],
+        gain_unit: Union[str, None],
+        phase_unit: str
+    ) -> Tuple[List[float], List[float], List[float]]:
+        """Converts complex function values into gain and phase lists.
+
+        Returns:
+            A (frequency_list, gain_list, phase_list) tuple.
+        """
         # If the output is not the same length as the frequency array, then
         # it does not depend on the input, in which case we must pad it.
         if not isinstance(output, np.ndarray):
@@ -543,6 +1343,7 @@ class Circuit(Document):
         if not sfg or sfg == "Path is too short":
             raise Exception('The selected branch does not exist')
         self.sfg = dill.dumps(sfg)
+        self._invalidate_symbolic_results()
 
     def simplify_sfg(self, source, target ):
         """Simplify the sfg.
@@ -569,6 +1370,7 @@ class Circuit(Document):
             raise Exception('The selected path is too short') 
 
         self.sfg = dill.dumps(sfg)
+        self._invalidate_symbolic_results()
 
 
     # STARTED HERE 
@@ -597,6 +1399,7 @@ class Circuit(Document):
 
             # Update the SFG state with the simplified graph
             self.sfg = dill.dumps(sfg)
+            self._invalidate_symbolic_results()
 
         except Exception as e:
             # Handle any errors (like bad deserialization or invalid graph)
@@ -608,6 +1411,44 @@ class Circuit(Document):
         return self.sfg  # Returning updated SFG
 
 
+    def reduce_sfg(self, keep: Optional[Iterable[str]] = None) \
+            -> Dict[str, Tuple[str, str]]:
+        """Collapses series nodes of the SFG.
+
+        Transfer functions between remaining nodes are unchanged. Self-loops
+        are not folded, since the stored SFG has no room for the determinant
+        scale that folding introduces, so the loop gain is unchanged too.
+        See mason.reduce_sfg for details.
+
+        Args:
+            keep: The nodes that must not be reduced. Every node that will
+                still be queried, such as the output node, must be kept,
+                since interior nodes are absorbed. Sources and sinks are
+                never reduced.
+
+        Returns:
+            A dictionary that maps each absorbed node to the (source, target)
+            edge it was folded into.
+        """
+        # Save current SFG state for undo functionality
+        self.sfg_stack.append(self.sfg)
+        self.redo_stack.clear()
+
+        if len(self.sfg_stack) > 5:
+            self.sfg_stack = self.sfg_stack[-5:]
+
+        sfg = dill.loads(self.sfg)
+
+        if not set(keep or ()) <= sfg.nodes.keys():
+            self.sfg_stack.pop()
+            raise ValueError('Node does not exist.')
+
+        reduction = mason.reduce_sfg(sfg, keep or (), fold_self_loops=False)
+        self.sfg = dill.dumps(reduction.sfg)
+        self._invalidate_symbolic_results()
+
+        return reduction.absorbed
+
     # def simplify_whole_graph(self, sfg):
     #     """Simplify the entire SFG by iterating over node pairs."""
     #     for source in list(sfg.nodes):
@@ -636,6 +1477,7 @@ class Circuit(Document):
 
             # Update the SFG state with the simplified graph
             self.sfg = dill.dumps(sfg)
+            self._invalidate_symbolic_results()
 
         except Exception as e:
             # Handle any errors (like bad deserialization or invalid graph)
@@ -658,11 +1500,13 @@ class Circuit(Document):
         if len(self.sfg_stack) > 0:
             self.redo_stack.append(self.sfg)
             self.sfg = self.sfg_stack.pop()
+            self._invalidate_symbolic_results()
 
     def redo_sfg(self):
         if len(self.redo_stack) > 0:
             self.sfg_stack.append(self.sfg)
             self.sfg = self.redo_stack.pop()
+            self._invalidate_symbolic_results()
 
     def get_current_sfg(self):
         return self.deserialize_sfg()
@@ -701,6 +1545,7 @@ class Circuit(Document):
                 sfg.edges[src, dst]['weight'] = editSymbolic
                 # print("edge data after edit:", sfg.edges[src, dst])
                 self.sfg = dill.dumps(sfg)
+                self._invalidate_symbolic_results()
                 # return sfg.edges[src, dst]['weight']
                 break
         # self.sfg = dill.dumps(sfg)
@@ -766,6 +1611,9 @@ class Circuit(Document):
         except Exception as e:
             raise RuntimeError(f"Failed to serialize the updated SFG: {e}")
 
+        # Symbolic results of the previous SFG no longer apply.
+        self._invalidate_symbolic_results()
+
         # Return the updated SFG for further use or confirmation
         return sfg
 
@@ -817,185 +1665,604 @@ class Circuit(Document):
         self.sfg_stack = new_circuit.sfg_stack
         self.redo_stack = new_circuit.redo_stack
 
+    def compute_stability_margins(
+        self,
+        input_node: Optional[str] = None,
+        output_node: Optional[str] = None,
+        start_freq: float = 1e3,
+        end_freq: float = 1e12,
+        parameters: Optional[Dict] = None,
+        engine: str = 'auto',
+        budget: Optional[mason.Budget] = None
+    ) -> Dict[str, Optional[float]]:
+        """Finds the phase margin, gain margin and crossover frequencies of
+            the loop gain, or of a transfer function.
+
+        Crossovers are bracketed on a coarse scan and refined by root
+        finding on the compiled kernel. See stability.stability_margins.
+
+        Args:
+            input_node: The name of the input node. If input_node or
+                output_node is None, finds the margins of the loop gain.
+            output_node: The name of the output node.
+            start_freq: The lowest frequency to search, in hertz.
+            end_freq: The highest frequency to search, in hertz.
+            parameters: Optional; Parameter values to use instead of the
+                circuit's for this evaluation only.
+            engine: The symbolic engine. Can be 'mason', 'elimination', or
+                'auto'. Defaults to 'auto'.
+            budget: Optional; The time and term budget of the symbolic engine.
+
+        Returns:
+            A dictionary of the 'phase_margin' in degrees, the 'gain_margin'
+            in decibels, the 'gain_crossover' and 'phase_crossover'
+            frequencies in hertz, and the number of 'evaluations'. Margins
+            and crossovers are None if there is no crossover.
+        """
+        parameters = self.evaluation_parameters(parameters)
+
+        if input_node is None or output_node is None:
+            _, _, kernel = self._compute_loop_gain(
+                cache_result=True, engine=engine, budget=budget)
+
+            # Closed loops of an SFG are 1 / (1 - L), so the loop is
+            # unstable where -L, rather than L, is -1.
+            def response(s):
+                return -kernel(s, parameters)
+        else:
+            _, _, kernel = self._compute_transfer_function(
+                input_node, output_node, cache_result=True, engine=engine,
+                budget=budget)
+
+            def response(s):
+                return kernel(s, parameters)
+
+        margins = stability.stability_margins(response, start_freq, end_freq)
+
+        result = {
+            name: None if np.isnan(margins[name][0])
+            else float(margins[name][0])
+            for name in ('phase_margin', 'gain_margin', 'gain_crossover',
+                         'phase_crossover')
+        }
+        result['evaluations'] = int(margins['evaluations'][0])
+        return result
+
+    def solve_design_target(
+        self,
+        param_name: str,
+        metric: str,
+        target: float,
+        min_value: float,
+        max_value: float,
+        input_node: Optional[str] = None,
+        output_node: Optional[str] = None,
+        scale: str = 'log',
+        drop: float = 3.0,
+        start_freq: float = 1e3,
+        end_freq: float = 1e12,
+        parameters: Optional[Dict] = None,
+        engine: str = 'auto',
+        budget: Optional[mason.Budget] = None
+    ) -> Dict:
+        """Finds the value of a parameter at which a metric reaches a target.
+
+        The metric is evaluated on the compiled kernel, or the rational form
+        for the bandwidth, and the value is found by Brent's method between
+        the bounds. See stability.solve_target.
+
+        Args:
+            param_name: Name of the parameter to solve for.
+            metric: Can be 'phase_margin' or 'gain_margin', of the loop gain
+                or of a transfer function as in compute_stability_margins,
+                or 'bandwidth', of a transfer function as in
+                compute_bandwidth.
+            target: The target value of the metric, in degrees, decibels or
+                hertz.
+            min_value: The lower bound of the parameter.
+            max_value: The upper bound of the parameter.
+            input_node: The name of the input node.
+            output_node: The name of the output node.
+            scale: Can be 'log' or 'linear'. Defaults to 'log'.
+            drop: The drop in gain from the peak at the corners of the
+                bandwidth, in decibels. Defaults to 3.
+            start_freq: The lowest frequency to search for crossovers, in
+                hertz.
+            end_freq: The highest frequency to search for crossovers, in
+                hertz.
+            parameters: Optional; Values of the other parameters to use
+                instead of the circuit's.
+            engine: The symbolic engine. Can be 'mason', 'elimination', or
+                'auto'. Defaults to 'auto'.
+            budget: Optional; The time and term budget of the symbolic engine.
+
+        Returns:
+            A dictionary of the parameter 'value', the 'metric' there, and
+            the 'history' of evaluations, a list of dictionaries of the
+            'value' and 'metric', where the metric is None if undefined.
+
+        Raises:
+            ValueError: If the metric is invalid, or does not cross the
+                target between the bounds.
+        """
+        overrides = dict(parameters or {})
+        nodes = input_node is not None and output_node is not None
+
+        if metric == 'bandwidth':
+            if not nodes:
+                raise ValueError('Invalid nodes.')
+            _, rational_function, _ = self._compute_transfer_function(
+                input_node, output_node, cache_result=True, engine=engine,
+                budget=budget)
+
+            def evaluate(values):
+                overrides[param_name] = values
+                return rational_function.bandwidth(
+                    self.evaluation_parameters(overrides), drop)['bandwidth']
+
+        elif metric in ('phase_margin', 'gain_margin'):
+            if nodes:
+                _, _, kernel = self._compute_transfer_function(
+                    input_node, output_node, cache_result=True,
+                    engine=engine, budget=budget)
+                sign = 1
+            else:
+                _, _, kernel = self._compute_loop_gain(
+                    cache_result=True, engine=engine, budget=budget)
+                # See compute_stability_margins.
+                sign = -1
+
+            def evaluate(values):
+                overrides[param_name] = values[:, None]
+                evaluation = self.evaluation_parameters(overrides)
+                return stability.stability_margins(
+                    lambda s: sign * kernel(s, evaluation), start_freq,
+                    end_freq)[metric]
+
+        else:
+            raise ValueError('Invalid metric.')
+
+        solution = stability.solve_target(
+            lambda values: np.broadcast_to(evaluate(values), values.shape),
+            target, min_value, max_value, scale)
+
+        return {
+            'value': solution['value'],
+            'metric': solution['metric'],
+            'history': [{'value': value,
+                         'metric': None if np.isnan(reached) else reached}
+                        for value, reached in solution['history']]
+        }
+
     def compute_phase_margin(
             self,
             gain: List[float],
             phase: List[float]
     ) -> Optional[float]:
-        
-        # Find the index where the gain is closest to 0 dB
-        zero_db_index = min(range(len(gain)), key=lambda i: abs(gain[i]))
-        
-        # Check if the gain at the closest index is within a reasonable threshold of 0 dB
-        #if abs(gain[zero_db_index]) > 0.1:  # Adjust threshold as needed
-        #    return None  # or raise an exception if preferred
+        """Finds the phase margin of a sampled frequency response.
 
-        # Get the phase at this index
-        phase_at_zero_db = phase[zero_db_index]
-        
-        # Calculate the phase margin
-        phase_margin = 180 - abs(phase_at_zero_db)
+        The phase is interpolated linearly between the samples either side
+        of the highest unity gain crossover, and the margin is 180 degrees
+        less the magnitude of the wrapped phase there, as in
+        sweep_params_for_phase_margin.
 
-        #print ("The phase margin is: "+phase_margin) # Temporarily adding print statement for BOL
-        
-        return phase_margin
+        Args:
+            gain: The gain at each frequency in decibels, in order of
+                increasing frequency.
+            phase: The phase at each frequency in degrees.
 
-    def sweep_params_for_phase_margin(
+        Returns:
+            The phase margin in degrees, or None if the gain does not cross
+            0 dB.
+        """
+        gain = np.asarray(gain, dtype=float)
+        phase = np.unwrap(np.asarray(phase, dtype=float), period=360)
+
+        crossings = np.flatnonzero((gain[:-1] >= 0) != (gain[1:] >= 0))
+        if not crossings.size:
+            return None
+
+        i = crossings[-1]
+        fraction = gain[i] / (gain[i] - gain[i + 1])
+        crossover_phase = phase[i] + fraction * (phase[i + 1] - phase[i])
+        return float(180 - abs(stability.wrap_phase(crossover_phase)))
+
+    def sweep_transfer_function(
         self,
         input_node: str,
         output_node: str,
-        param_name: str,  
-        min_value: float,
-        max_value: float,
-        step: float
-    ) -> Tuple[List[float], List[float]]:
-        """Sweeps capacitance values and plots capacitance vs. phase margin.
+        param_name: str,
+        values: np.ndarray,
+        start_freq: float,
+        end_freq: float,
+        points_per_decade: int,
+        frequency_unit: str = 'hz',
+        engine: str = 'auto',
+        budget: Optional[mason.Budget] = None
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """Evaluates the transfer function over a grid of parameter values
+            and frequencies.
+
+        The transfer function is derived and compiled once, with the swept
+        parameter as an argument, and the whole grid is evaluated in one
+        broadcast. The circuit parameters are not modified.
 
         Args:
-            param_name: Name of the capacitor parameter to update.
-            min_value: Minimum capacitance value to test.
-            max_value: Maximum capacitance value to test.
-            step: Increment step for capacitance.
-            freq, gain, phase: Frequency, gain, and phase lists to compute phase margin.
+            input_node: The name of the input node.
+            output_node: The name of the output node.
+            param_name: The name of the swept parameter.
+            values: The values of the swept parameter.
+            start_freq: The starting frequency.
+            end_freq: The ending frequency.
+            points_per_decade: The number of points per decade.
+            frequency_unit: The unit for the input frequency range. Can be 'hz'
+                or 'rad/s'.
+            engine: The symbolic engine. Can be 'mason', 'elimination', or
+                'auto'. Defaults to 'auto'.
+            budget: Optional; The time and term budget of the symbolic
+                engine.
 
         Returns:
-            A tuple of two lists: capacitances and their corresponding phase margins.
-        """
-        param_values = []
-        phase_margins = []
-
-        original_param = self.parameters[param_name]
-        # Parameters for eval_loop_gain
-        start_freq = 1e3
-        end_freq = 1e12
-        points_per_decade = 30
-
-        # Sweep capacitance values
-        current_value = min_value
-        while current_value <= max_value:
-            # Update the specified capacitance in the circuit
-            self.update_parameters({param_name: current_value})
-            freq_list, gain_list, phase_list= self.eval_transfer_function(input_node=input_node,
-                                                                        output_node=output_node,
-                                                                        start_freq=start_freq,
-                                                                        end_freq=end_freq,
-                                                                        points_per_decade=points_per_decade)
-
-            # Compute the phase margin for the current capacitance
-            phase_margin = self.compute_phase_margin(gain_list, phase_list)
-            
-            # Store results
-            param_values.append(current_value)
-            phase_margins.append(phase_margin)
+            A (frequency, output) tuple of arrays, where output has one row
+            per parameter value and one column per frequency.
 
-            print("Testing: "+str(current_value)+" F")
-            print("Phase margin: "+str(phase_margin)+" deg")
-            
-            # Increment capacitance
-            current_value += step
-            current_value = round(current_value,max(0, -int(math.floor(math.log10(abs(step))))))
-        
-        self.update_parameters({param_name: original_param})
+        Raises:
+            ValueError: If the parameter is not a parameter of the circuit.
+            mason.BudgetExceeded: If the evaluation exceeds its budget.
+        """
+        values = np.asarray(values, dtype=float)
+        parameters = self.evaluation_parameters({param_name: values[:, None]})
+        freq, s = self._frequency_grid(start_freq, end_freq,
+                                       points_per_decade, frequency_unit)
+
+        # The symbolic result is cached on the circuit, so later sweeps of
+        # any parameter re-use it.
+        _, _, kernel = self._compute_transfer_function(
+            input_node, output_node, cache_result=True, engine=engine,
+            budget=budget)
+        output = kernel(s, parameters)
+
+        # The output does not depend on the parameter if it was not
+        # broadcast against the values.
+        return freq, np.broadcast_to(output, (len(values), len(freq)))
 
-        return param_values, phase_margins
+    def sweep_params_for_phase_margin(
+        self,
+        input_node: str,
+        output_node: str,
+        param_name: str,
+        min_value: Optional[float] = None,
+        max_value: Optional[float] = None,
+        step: Optional[float] = None,
+        scale: str = 'linear',
+        points: Optional[int] = None,
+        values: Optional[List[float]] = None,
+        engine: str = 'auto',
+        budget: Optional[mason.Budget] = None
+    ) -> Tuple[List[float], List[float]]:
+        """Sweeps a parameter, and finds the phase margin of the transfer
+            function at each value.
 
-    def calculate_bandwidth(
-            self,
-            frequencies: List[float],
-            magnitudes: List[float]
-    ) -> Optional[float]:
-        """
-        Calculate the bandwidth frequency where the gain is closest to max_gain - 3 dB.
+        The transfer function is compiled once, and the unity gain
+        crossovers of every value are found together by root finding. See
+        stability.stability_margins. The phase margin is 180 degrees less
+        the magnitude of the wrapped phase at the crossover.
 
         Args:
-            frequencies: List of frequency values.
-            magnitudes: List of corresponding gain values in dB.
+            input_node: The name of the input node.
+            output_node: The name of the output node.
+            param_name: Name of the parameter to sweep.
+            min_value: Minimum parameter value to test.
+            max_value: Maximum parameter value to test.
+            step: Increment step of a linear sweep.
+            scale: Can be 'linear', 'log' or 'list'. See
+                sweep.sweep_values. Defaults to 'linear'.
+            points: The number of values of a logarithmic sweep, or of a
+                linear sweep without a step.
+            values: The explicit values of a 'list' sweep.
+            engine: The symbolic engine. Can be 'mason', 'elimination', or
+                'auto'. Defaults to 'auto'.
+            budget: Optional; The time and term budget of the symbolic
+                engine.
 
         Returns:
-            float: Frequency at the closest -3 dB point (bandwidth).
-            None: If no such point is found.
+            A tuple of two lists: parameter values and their corresponding
+            phase margins.
+
+        Raises:
+            mason.BudgetExceeded: If the evaluation exceeds its budget.
         """
-        # Determine the max gain and -3 dB threshold
-        max_gain_db = np.max(magnitudes)
-        threshold_db = max_gain_db - 3
+        param_values = sweep.sweep_values(min_value, max_value, step, scale,
+                                          points, values)
+        parameters = self.evaluation_parameters(
+            {param_name: param_values[:, None]})
+
+        _, _, kernel = self._compute_transfer_function(
+            input_node, output_node, cache_result=True, engine=engine,
+            budget=budget)
+        margins = stability.stability_margins(
+            lambda s: kernel(s, parameters), start_freq=1e3, end_freq=1e12)
+
+        # Keeps the symmetric 180 - |phase| convention of this sweep, unlike
+        # stability.stability_margins.
+        phase = stability.wrap_phase(margins['gain_crossover_phase'])
+        phase_margins = np.broadcast_to(180 - np.abs(phase),
+                                        param_values.shape)
+        return param_values.tolist(), \
+            [None if np.isnan(pm) else float(pm) for pm in phase_margins]
+
+    def compute_bandwidth(
+        self,
+        input_node: str,
+        output_node: str,
+        drop: float = 3.0,
+        parameters: Optional[Dict] = None,
+        engine: str = 'auto',
+        budget: Optional[mason.Budget] = None
+    ) -> Dict[str, Optional[float]]:
+        """Finds the bandwidth of the transfer function between a pair of
+            input and output nodes, analytically from its rational form.
 
-        # Find the index of the peak gain
-        max_index = np.argmax(magnitudes)
+        See rational.bandwidth for details.
 
-        # Extract the part of the frequency and magnitude arrays after the peak
-        post_peak_frequencies = frequencies[max_index + 1:]
-        post_peak_magnitudes = magnitudes[max_index + 1:]
+        Args:
+            input_node: The name of the input node.
+            output_node: The name of the output node.
+            drop: The drop in gain from the peak at the corners, in decibels.
+                Defaults to 3.
+            parameters: Optional; Parameter values to use instead of the
+                circuit's for this evaluation only.
+            engine: The symbolic engine. Can be 'mason', 'elimination', or
+                'auto'. Defaults to 'auto'.
+            budget: Optional; The time and term budget of the symbolic engine.
 
-        if not post_peak_frequencies:
-            return None  # Return None if there are no points after the peak
+        Returns:
+            A dictionary of the 'lower' and 'upper' corners and the
+            'bandwidth' in hertz, the 'peak_gain' in decibels, and the
+            'peak_frequency' in hertz. Values that do not exist are None.
+        """
+        _, rational_function, _ = self._compute_transfer_function(
+            input_node, output_node, cache_result=True, engine=engine,
+            budget=budget)
+        result = rational_function.bandwidth(
+            self.evaluation_parameters(parameters), drop)
 
-        # Find the index of the magnitude closest to the threshold
-        closest_index = np.argmin(np.abs(np.array(post_peak_magnitudes) - threshold_db))
+        return {name: None if np.isnan(value) else float(value)
+                for name, value in result.items()}
 
-        # Return the corresponding frequency
-        return post_peak_frequencies[closest_index]
-    
     def sweep_params_for_bandwidth(
         self,
         input_node: str,
         output_node: str,
-        param_name: str,  
-        min_val: float,
-        max_val: float,
-        step: float
-    ) -> Tuple[List[float], List[float]]:
-        """Sweeps inputted parameter values and plots inputted parameter vs. bandwidth.
+        param_name: str,
+        min_val: Optional[float] = None,
+        max_val: Optional[float] = None,
+        step: Optional[float] = None,
+        scale: str = 'linear',
+        points: Optional[int] = None,
+        values: Optional[List[float]] = None,
+        engine: str = 'auto',
+        budget: Optional[mason.Budget] = None
+    ) -> Tuple[List[float], List[Optional[float]]]:
+        """Sweeps a parameter, and finds the bandwidth of the transfer
+            function at each value.
+
+        Bandwidths are found analytically from the rational form, with one
+        polynomial root solve per value. See rational.bandwidth.
 
         Args:
-            input_node:
-            output_node
-            param_name: Name of the parameter to update.
+            input_node: The name of the input node.
+            output_node: The name of the output node.
+            param_name: Name of the parameter to sweep.
             min_val: Minimum value to test.
             max_val: Maximum value to test.
-            step: Increment step for capacitance.
-            freq, gain, phase: Frequency, gain, and phase lists to compute phase margin.
+            step: Increment step of a linear sweep.
+            scale: Can be 'linear', 'log' or 'list'. See
+                sweep.sweep_values. Defaults to 'linear'.
+            points: The number of values of a logarithmic sweep, or of a
+                linear sweep without a step.
+            values: The explicit values of a 'list' sweep.
+            engine: The symbolic engine. Can be 'mason', 'elimination', or
+                'auto'. Defaults to 'auto'.
+            budget: Optional; The time and term budget of the symbolic
+                engine.
 
         Returns:
-            
+            A tuple of two lists: parameter values and their corresponding
+            bandwidths in hertz, which are the upper corner of low-pass
+            responses and the distance between the corners of band-pass
+            responses, or None if there is no upper corner.
+
+        Raises:
+            mason.BudgetExceeded: If the evaluation exceeds its budget.
         """
-        param_values = []
-        bandwidths = []
-
-        original_param = self.parameters[param_name]
-        # Parameters for eval_loop_gain
-        start_freq = 1e3
-        end_freq = 1e12
-        points_per_decade = 30
-
-        # Sweep capacitance values
-        current_val = min_val
-        while current_val <= max_val:
-            # Update the specified capacitance in the circuit
-            self.update_parameters({param_name: current_val})
-            freq_list, gain_list, phase_list= self.eval_transfer_function(input_node=input_node,
-                                                                        output_node=output_node,
-                                                                        start_freq=start_freq,
-                                                                        end_freq=end_freq,
-                                                                        points_per_decade=points_per_decade)
-
-            # Compute the phase margin for the current capacitance
-            bandwidth = self.calculate_bandwidth(freq_list, gain_list)
-            
-            # Store results
-            param_values.append(current_val)
-            bandwidths.append(bandwidth)
+        param_values = sweep.sweep_values(min_val, max_val, step, scale,
+                                          points, values)
 
-            print("Testing: "+str(current_val))
-            print("Bandwidth: "+str(bandwidth)+" hz")
-            
-            # Increment capacitance
-            current_val += step
-            current_val = round(current_val,max(0, -int(math.floor(math.log10(abs(step))))))
-        
-        self.update_parameters({param_name: original_param})
+        _, rational_function, _ = self._compute_transfer_function(
+            input_node, output_node, cache_result=True, engine=engine,
+            budget=budget)
+        bandwidths = np.broadcast_to(
+            rational_function.bandwidth(self.evaluation_parameters(
+                {param_name: param_values}))['bandwidth'],
+            param_values.shape)
+
+        return param_values.tolist(), \
+            [None if np.isnan(bw) else float(bw) for bw in bandwidths]
+
+    def calculate_bandwidth(
+            self,
+            frequencies: List[float],
+            magnitudes: List[float],
+            drop: float = 3.0
+    ) -> Optional[float]:
+        """Finds the upper corner of a sampled frequency response.
+
+        The corner is where the gain first falls the drop below its peak,
+        above the peak frequency, as the 'upper' corner of
+        compute_bandwidth. It is interpolated linearly in log frequency
+        between the samples either side.
+
+        Args:
+            frequencies: The frequencies in hertz, in increasing order.
+            magnitudes: The gain at each frequency in decibels.
+            drop: The drop in gain from the peak at the corner, in decibels.
+                Defaults to 3.
+
+        Returns:
+            The frequency of the corner in hertz, or None if the gain does
+            not fall that far after its peak.
+
+        Raises:
+            ValueError: If the drop is not positive.
+        """
+        if drop <= 0:
+            raise ValueError('Invalid drop.')
+
+        frequencies = np.asarray(frequencies, dtype=float)
+        magnitudes = np.asarray(magnitudes, dtype=float)
+        if not magnitudes.size:
+            return None
+
+        peak = int(np.argmax(magnitudes))
+        threshold = magnitudes[peak] - drop
+        below = np.flatnonzero(magnitudes[peak + 1:] <= threshold)
+        if not below.size:
+            return None
+
+        i = peak + 1 + below[0]
+        x = np.log10(frequencies[i - 1:i + 1])
+        y = magnitudes[i - 1:i + 1]
+        return float(10 ** (x[0] + (threshold - y[0]) / (y[1] - y[0])
+                            * (x[1] - x[0])))
+
+    def sweep_parameters(
+        self,
+        spec: Dict[str, Union[List[float], Dict]],
+        input_node: Optional[str] = None,
+        output_node: Optional[str] = None,
+        mode: str = 'grid',
+        samples: Optional[int] = None,
+        scale: str = 'linear',
+        seed: Optional[int] = None,
+        metrics: Iterable[str] = ('phase_margin', 'gain_margin', 'bandwidth',
+                                  'dc_gain'),
+        drop: float = 3.0,
+        start_freq: float = 1e3,
+        end_freq: float = 1e12,
+        parameters: Optional[Dict] = None,
+        memory_limit: int = SWEEP_MEMORY_LIMIT,
+        engine: str = 'auto',
+        budget: Optional[mason.Budget] = None
+    ) -> Dict:
+        """Sweeps several parameters at once, and finds metrics of the loop
+            gain or a transfer function at every point.
+
+        The points are evaluated in chunks, each in a single vectorised call
+        of the compiled kernel or the rational form, and the chunks are
+        sized so that their responses fit within the memory limit.
+
+        Args:
+            spec: Maps each parameter name to its sweep. See
+                sweep.sample_parameters.
+            input_node: The name of the input node. If input_node or
+                output_node is None, the metrics are those of the loop gain.
+            output_node: The name of the output node.
+            mode: Can be 'grid', 'latin_hypercube' or 'points'. Defaults to
+                'grid'.
+            samples: The number of points of a Latin hypercube sample.
+            scale: Can be 'linear' or 'log', for a Latin hypercube sample.
+            seed: Optional; The seed of a Latin hypercube sample.
+            metrics: The metrics to find, of 'phase_margin' and
+                'gain_margin' as in compute_stability_margins, 'bandwidth'
+                as in compute_bandwidth, and 'dc_gain', in decibels.
+                Defaults to all of them.
+            drop: The drop in gain from the peak at the corners of the
+                bandwidth, in decibels. Defaults to 3.
+            start_freq: The lowest frequency to search for crossovers, in
+                hertz.
+            end_freq: The highest frequency to search for crossovers, in
+                hertz.
+            parameters: Optional; Values of the other parameters to use
+                instead of the circuit's.
+            memory_limit: The memory allowed for the responses of a chunk, in
+                bytes.
+            engine: The symbolic engine. Can be 'mason', 'elimination', or
+                'auto'. Defaults to 'auto'.
+            budget: Optional; The time and term budget of the symbolic engine.
+
+        Returns:
+            A dictionary of the 'shape' of the sweep, the 'values' of each
+            parameter at every point, and each metric at every point, as
+            nested lists of that shape. Metrics are None where they are
+            undefined.
+
+        Raises:
+            ValueError: If the sweep or a metric is invalid.
+        """
+        metrics = list(metrics)
+        if not set(metrics) <= {'phase_margin', 'gain_margin', 'bandwidth',
+                                'dc_gain'}:
+            raise ValueError('Invalid metric.')
+
+        shape, values = sweep.sample_parameters(spec, mode, samples, scale,
+                                                seed)
+        base = dict(parameters or {})
+        # Validates the parameter names.
+        self.evaluation_parameters(dict(base, **values))
+
+        if input_node is None or output_node is None:
+            _, rational_function, kernel = self._compute_loop_gain(
+                cache_result=True, engine=engine, budget=budget)
+            # See compute_stability_margins.
+            sign = -1
+        else:
+            _, rational_function, kernel = self._compute_transfer_function(
+                input_node, output_node, cache_result=True, engine=engine,
+                budget=budget)
+            sign = 1
+
+        count = int(np.prod(shape))
+        results = {metric: np.full(count, np.nan) for metric in metrics}
+
+        # The margins scan at 5 points per decade; see stability_margins.
+        num_freqs = round(5 * np.log10(end_freq / start_freq)) + 1
+        size = memory_limit // (num_freqs * SWEEP_BYTES_PER_SAMPLE)
+
+        for chunk in sweep.chunks(count, size):
+            overrides = {name: v[chunk] for name, v in values.items()}
+
+            if 'phase_margin' in metrics or 'gain_margin' in metrics:
+                columns = self.evaluation_parameters(dict(
+                    base, **{name: v[:, None] for name, v in
+                             overrides.items()}))
+                margins = stability.stability_margins(
+                    lambda s: sign * kernel(s, columns), start_freq,
+                    end_freq)
+                for metric in ('phase_margin', 'gain_margin'):
+                    if metric in metrics:
+                        results[metric][chunk] = margins[metric]
+
+            evaluation = self.evaluation_parameters(dict(base, **overrides))
+            if 'bandwidth' in metrics:
+                results['bandwidth'][chunk] = rational_function.bandwidth(
+                    evaluation, drop)['bandwidth']
+            if 'dc_gain' in metrics:
+                numerator, denominator = rational_function.coefficients(
+                    evaluation)
+                with np.errstate(divide='ignore', invalid='ignore'):
+                    results['dc_gain'][chunk] = 20 * np.log10(
+                        np.abs(numerator[0] / denominator[0]))
+
+        def tensor(array):
+            array = np.asarray(array, dtype=float).reshape(shape)
+            return np.where(np.isfinite(array), array, None).tolist()
+
+        result = {'shape': list(shape),
+                  'values': {name: tensor(v) for name, v in values.items()}}
+        result.update((metric, tensor(results[metric])) for metric in metrics)
+        return result
 
-        return param_values, bandwidths
-    
     def is_device_valid(self, device_name: str) -> bool:
         """
         Check if a given device exists in the circuit parameters.
@@ -0,0 +1,270 @@
+from typing import List, Dict, Optional
+from collections import OrderedDict
+import json
+import os
+import stat
+import tempfile
+import threading
+import warnings
+
+import numpy as np
+import sympy
+from sympy.printing.numpy import NumPyPrinter
+
+from rational import RationalFunction, S
+
+
+class Kernel:
+    """A compiled numpy function of s and the circuit parameters.
+
+    Kernels are generated as Python source text, so they can be stored and
+    re-compiled anywhere without pickling functions.
+
+    Args:
+        source: The source text of a function named 'kernel', whose first
+            argument is s, followed by one argument for each parameter.
+        arguments: The parameter names, in the order of the function
+            arguments after s.
+
+    Attributes:
+        source: The source text of the kernel.
+        arguments: The parameter names.
+    """
+
+    def __init__(self, source: str, arguments: List[str]):
+        self.source = source
+        self.arguments = list(arguments)
+
+        namespace = {'numpy': np}
+        exec(compile(source, '<kernel>', 'exec'), namespace)
+        self._function = namespace['kernel']
+
+    def __getstate__(self):
+        return {'source': self.source, 'arguments': self.arguments}
+
+    def __setstate__(self, state):
+        self.__init__(state['source'], state['arguments'])
+
+    def __call__(self, s: np.ndarray,
+                 parameters: Optional[Dict[str, float]] = None) -> np.ndarray:
+        """Evaluates the kernel.
+
+        Args:
+            s: An array of complex frequencies.
+            parameters: Optional; Maps parameter names to their numerical
+                values, which may be arrays that broadcast against s.
+
+        Returns:
+            A complex array of function values.
+
+        Raises:
+            ValueError: If a parameter is not given a value.
+        """
+        parameters = parameters or {}
+
+        missing = [name for name in self.arguments if name not in parameters]
+        if missing:
+            raise ValueError('Missing values for symbols: ' +
+                             ', '.join(missing))
+
+        s = np.asarray(s, dtype=complex)
+        output = self._function(s, *(parameters[name]
+                                     for name in self.arguments))
+        return np.broadcast_to(output, np.broadcast(s, output).shape)
+
+
+def kernel_source(rational_function: RationalFunction) -> str:
+    """Generates the source text of a kernel for a rational function.
+
+    Subexpressions shared between coefficients are computed once, and each
+    polynomial is evaluated in Horner form, so a kernel costs one
+    multiply-add per power of s on top of its coefficients.
+
+    Args:
+        rational_function: The function to compile.
+
+    Returns:
+        The source text of a function named 'kernel'. Its arguments are s,
+        followed by one argument for each symbol of the coefficients, sorted
+        by name.
+    """
+    symbols = sorted(rational_function.free_symbols(), key=str)
+
+    # Parameter names are not always valid identifiers, so every argument is
+    # renamed.
+    arguments = [sympy.Symbol(f'_p{i}') for i in range(len(symbols))]
+    renamed = dict(zip(symbols, arguments))
+
+    coefficients = [c.xreplace(renamed) for c in
+                    rational_function.numerator + rational_function.denominator]
+    subexpressions, coefficients = sympy.cse(
+        coefficients, symbols=sympy.numbered_symbols('_x'))
+
+    printer = NumPyPrinter({'fully_qualified_modules': True})
+    lines = ['def kernel(%s):' % ', '.join(
+        [str(S)] + [str(argument) for argument in arguments])]
+
+    for symbol, expr in subexpressions:
+        lines.append(f'    {symbol} = {printer.doprint(expr)}')
+
+    degree = len(rational_function.numerator)
+    for name, polynomial in (('numerator', coefficients[:degree]),
+                             ('denominator', coefficients[degree:])):
+        lines.append(f'    {name} = {printer.doprint(polynomial[-1])}')
+        for c in reversed(polynomial[:-1]):
+            if c == 0:
+                lines.append(f'    {name} = {name} * s')
+            else:
+                lines.append(
+                    f'    {name} = {name} * s + {printer.doprint(c)}')
+
+    lines.append('    return numerator / denominator')
+    return '\n'.join(lines) + '\n'
+
+
+def compile_kernel(rational_function: RationalFunction) -> Kernel:
+    """Compiles a rational function into a kernel.
+
+    Args:
+        rational_function: The function to compile.
+
+    Returns:
+        The kernel.
+    """
+    return Kernel(kernel_source(rational_function),
+                  sorted(map(str, rational_function.free_symbols())))
+
+
+def expression_hash(rational_function: RationalFunction) -> str:
+    """Finds a stable hash of a rational function.
+
+    The hash is the same in every process, so it can key kernels stored
+    outside the process.
+
+    Args:
+        rational_function: A rational function.
+
+    Returns:
+        A hexadecimal SHA-256 digest of the coefficients.
+    """
+    return rational_function.digest()
+
+
+class KernelCache:
+    """An in-process LRU cache of kernels, optionally backed by a directory.
+
+    Kernels are written to the directory as their source text and
+    arguments, so other processes load them without re-deriving the
+    expression or unpickling a function. Since loading a kernel executes
+    its source, the directory must be private to the user running the
+    server: it is created with mode 0700, and kernels are only loaded from
+    it while it and the kernel file are owned by that user and writable by
+    no one else. The cache may be shared by threads.
+
+    Args:
+        directory: Optional; The directory of stored kernels. If None,
+            kernels are only cached in memory.
+        limit: Optional; The number of kernels kept in memory.
+    """
+
+    def __init__(self, directory: Optional[str] = None, limit: int = 256):
+        self.directory = directory
+        self.limit = limit
+        self._kernels = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key + '.json')
+
+    def _private(self) -> bool:
+        """Checks that the directory is owned by this user and writable by
+        no one else, and warns if it is not."""
+        try:
+            status = os.lstat(self.directory)
+        except OSError:
+            return False
+
+        if not stat.S_ISDIR(status.st_mode) or \
+                status.st_uid != os.geteuid() or \
+                status.st_mode & (stat.S_IWGRP | stat.S_IWOTH):
+            warnings.warn('Ignoring kernel cache directory %s, which is not '
+                          'private to this user.' % self.directory)
+            return False
+        return True
+
+    def get(self, key: str) -> Optional[Kernel]:
+        """Finds a kernel in memory, or else in the directory.
+
+        Args:
+            key: The expression hash of the kernel.
+
+        Returns:
+            The kernel, or None if it is not cached.
+        """
+        with self._lock:
+            kernel = self._kernels.get(key)
+            if kernel is not None:
+                self._kernels.move_to_end(key)
+                return kernel
+
+        if self.directory is None or not self._private():
+            return None
+
+        try:
+            fd = os.open(self._path(key), os.O_RDONLY | os.O_NOFOLLOW)
+        except OSError:
+            return None
+
+        with os.fdopen(fd, 'r') as f:
+            # Check the file that was opened, not the path, which may have
+            # been replaced since.
+            status = os.fstat(fd)
+            if status.st_uid != os.geteuid() or \
+                    status.st_mode & (stat.S_IWGRP | stat.S_IWOTH):
+                warnings.warn('Ignoring kernel %s, which is not private to '
+                              'this user.' % self._path(key))
+                return None
+            try:
+                stored = json.load(f)
+            except ValueError:
+                return None
+
+        kernel = Kernel(stored['source'], stored['arguments'])
+        self._remember(key, kernel)
+        return kernel
+
+    def put(self, key: str, kernel: Kernel):
+        """Caches a kernel in memory and in the directory.
+
+        Args:
+            key: The expression hash of the kernel.
+            kernel: The kernel.
+        """
+        self._remember(key, kernel)
+
+        if self.directory is None:
+            return
+
+        try:
+            os.makedirs(self.directory, mode=0o700, exist_ok=True)
+            if not self._private():
+                return
+
+            # Write to a temporary file first, so that other processes never
+            # read a partially written kernel. mkstemp creates it with mode
+            # 0600.
+            fd, path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+            with os.fdopen(fd, 'w') as f:
+                json.dump({'source': kernel.source,
+                           'arguments': kernel.arguments}, f)
+            os.replace(path, self._path(key))
+        except OSError as e:
+            # The directory is only a cache; kernels are still kept in memory.
+            warnings.warn('Could not store kernel %s: %s' % (key, e))
+
+    def _remember(self, key: str, kernel: Kernel):
+        with self._lock:
+            self._kernels[key] = kernel
+            self._kernels.move_to_end(key)
+            if len(self._kernels) > self.limit:
+                self._kernels.popitem(last=False)
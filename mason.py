@@ -1,10 +1,49 @@
-from itertools import tee, zip_longest, groupby
-from typing import List, Set, Tuple, Any, Callable, Iterator, Optional
+import concurrent.futures
+import hashlib
+import threading
+import time
 from collections import OrderedDict
+from itertools import chain, tee, zip_longest, islice
+from typing import (List, Set, Tuple, Iterable, Iterator, Optional, Dict, Any,
+                    NamedTuple)
 
+import numpy as np
 import sympy
 import networkx as nx
-from networkx.algorithms import all_simple_paths, simple_cycles
+from networkx.algorithms import all_simple_paths
+
+
+# Counts made by estimate_cost stop at this limit.
+ESTIMATE_LIMIT = 10000
+
+# Mason's formula is only planned while its estimated number of terms stays
+# below this limit; larger symbolic requests are planned for elimination.
+MASON_TERM_LIMIT = 20000
+
+# Elimination is only planned while the estimated size of its expression
+# stays below this limit, in operations. Larger symbolic requests are refused
+# with BudgetExceeded, as converting them to rational form takes too long.
+ELIMINATION_SIZE_LIMIT = 5000
+
+# Sums of fewer forward paths or cycle combination terms are evaluated in the
+# calling process even in parallel mode, as pickling them costs more than it
+# saves.
+PARALLEL_MIN_TERMS = 1024
+
+# Worker process pools by number of workers, created on first use and shared
+# by every evaluation.
+PROCESS_POOLS = {}
+PROCESS_POOL_LOCK = threading.Lock()
+
+# How often the budget is checked while waiting for worker processes, in
+# seconds.
+PARALLEL_POLL_SECONDS = 0.1
+
+# Compiled edge weights of recently evaluated SFGs, by fingerprint, most
+# recently used last.
+EDGE_FUNCTIONS = OrderedDict()
+EDGE_FUNCTION_LIMIT = 64
+EDGE_FUNCTION_LOCK = threading.Lock()
 
 
 def pairwise(iterable):
@@ -21,158 +60,1620 @@ def pairwise_circular(iterable):
     return zip_longest(a, b, fillvalue=first)
 
 
-def disjoint_combinations(items: List, key: Callable[[Any], Set]) \
-        -> Iterator[Tuple]:
-    """Iterates over combinations of disjoint items.
+def iter_bits(bits: int) -> Iterator[int]:
+    """Iterates over the indices of the set bits of an integer."""
+    while bits:
+        low = bits & -bits
+        yield low.bit_length() - 1
+        bits ^= low
+
+
+def non_touching_combinations(masks: List[int]) -> Iterator[Tuple[int, ...]]:
+    """Iterates over combinations of non-touching cycles.
+
+    Each cycle is encoded as a bitmask of its nodes, so two cycles touch if
+    their masks intersect. Combinations are enumerated as the cliques of a
+    precomputed compatibility structure, in which every cycle lists the
+    later cycles it does not touch.
+
+    Args:
+        masks: The node bitmask of each cycle.
+
+    Yields:
+        A combination, as a tuple of cycle indices in increasing order.
+    """
+    # compatible[i] has bit j set if j > i and cycles i and j do not touch.
+    compatible = [
+        sum(1 << j for j in range(i + 1, len(masks))
+            if not masks[i] & masks[j])
+        for i in range(len(masks))
+    ]
+
+    # A depth-first walk with an explicit stack, since combinations of many
+    # disjoint cycles are deeper than the recursion limit. Each entry holds
+    # the candidates of one level and an iterator over them.
+    comb = []
+    candidates = (1 << len(masks)) - 1
+    stack = [(candidates, iter_bits(candidates))]
+
+    while stack:
+        candidates, remaining = stack[-1]
+        i = next(remaining, None)
+        if i is None:
+            stack.pop()
+            if comb:
+                comb.pop()
+            continue
+
+        comb.append(i)
+        yield tuple(comb)
+        candidates &= compatible[i]
+        stack.append((candidates, iter_bits(candidates)))
+
+
+class BudgetExceeded(Exception):
+    """Raised when an evaluation exceeds its budget or is cancelled."""
+
+
+class Budget:
+    """A wall-clock and term-count budget for a Mason evaluation.
+
+    Enumeration steps charge the budget as they go, so that an evaluation that
+    is too large stops with BudgetExceeded instead of running indefinitely.
+
+    Args:
+        seconds: Optional; The wall-clock time allowed, starting now.
+        terms: Optional; The number of cycles, combinations, and paths allowed
+            to be enumerated.
+        cancel: Optional; An event that cancels the evaluation once set.
+    """
+
+    def __init__(self, seconds: Optional[float] = None,
+                 terms: Optional[int] = None,
+                 cancel: Optional[threading.Event] = None):
+        self.deadline = None if seconds is None \
+            else time.monotonic() + seconds
+        self.terms = terms
+        self.cancel = cancel
+        self.count = 0
+
+    def charge(self, terms: int = 1):
+        """Counts enumerated terms against the budget.
+
+        Raises:
+            BudgetExceeded: If the budget is exceeded or cancelled.
+        """
+        self.count += terms
+
+        if self.cancel is not None and self.cancel.is_set():
+            raise BudgetExceeded('Evaluation cancelled.')
+        if self.terms is not None and self.count > self.terms:
+            raise BudgetExceeded('Term budget exceeded.')
+        if self.deadline is not None and time.monotonic() > self.deadline:
+            raise BudgetExceeded('Time budget exceeded.')
+
+
+def _charged(iterable: Iterable, budget: Optional[Budget]) -> Iterator:
+    """Charges the budget for every item of an iterable."""
+    for item in iterable:
+        if budget is not None:
+            budget.charge()
+        yield item
+
+
+def _split(items: List, parts: int) -> List[List]:
+    """Splits a list into at most the given number of non-empty lists of
+    nearly equal length."""
+    return [items[i::parts] for i in range(min(parts, len(items)))]
+
+
+def process_pool(processes: Optional[int]) \
+        -> Optional[concurrent.futures.Executor]:
+    """Returns the shared process pool with the given number of workers, or
+    None if processes is None or 0.
+
+    The pool is created on first use and kept for the life of the process,
+    so it must not be shut down by the caller.
+    """
+    if not processes:
+        return None
+
+    with PROCESS_POOL_LOCK:
+        if processes not in PROCESS_POOLS:
+            PROCESS_POOLS[processes] = \
+                concurrent.futures.ProcessPoolExecutor(processes)
+        return PROCESS_POOLS[processes]
+
+
+def _discard_pool(executor: concurrent.futures.Executor):
+    """Forgets a shared process pool, so that the next evaluation creates a
+    new one."""
+    with PROCESS_POOL_LOCK:
+        for processes, pool in list(PROCESS_POOLS.items()):
+            if pool is executor:
+                del PROCESS_POOLS[processes]
+
+
+def parallel_sum(executor: concurrent.futures.Executor, func, units: Iterable,
+                 budget: Optional[Budget] = None) -> sympy.Expr:
+    """Sums the partial results of work units evaluated in a process pool.
+
+    Args:
+        executor: The process pool.
+        func: A module-level function mapping a work unit to a sympy
+            expression. Both must be picklable.
+        units: The work units.
+        budget: Optional; Checked while waiting for partial results.
+            Pending units are cancelled once it is exceeded, but units
+            already running finish in the background.
+
+    Returns:
+        The sum of the partial results.
+
+    Raises:
+        BudgetExceeded: If the evaluation exceeds its budget.
+    """
+    futures = [executor.submit(func, unit) for unit in units]
+    partial_sums = []
+
+    try:
+        pending = set(futures)
+        while pending:
+            done, pending = concurrent.futures.wait(
+                pending, timeout=PARALLEL_POLL_SECONDS,
+                return_when=concurrent.futures.FIRST_COMPLETED)
+            partial_sums.extend(future.result() for future in done)
+            if budget is not None:
+                budget.charge(0)
+    except BudgetExceeded:
+        for future in futures:
+            future.cancel()
+        raise
+    except concurrent.futures.process.BrokenProcessPool:
+        # A worker died, and the pool can no longer be used.
+        _discard_pool(executor)
+        raise
+
+    return sympy.Add.fromiter(partial_sums)
 
-    Iterates over combinations of disjoint items. Items are considered disjoint
-    if their key sets are disjoint.
+
+def cyclic_components(sfg: nx.DiGraph) -> Iterator[Set[str]]:
+    """Iterates over the strongly connected components that contain a cycle.
 
     Args:
-        items: A list of items to select from.
-        key: A function that maps each item to a set.
+        sfg: An SFG.
 
     Yields:
-        A combination of items.
+        The set of nodes of a component.
     """
-    def dfs(i: int, comb: List, keys: Set) -> Iterator[Tuple]:
+    for nodes in nx.strongly_connected_components(sfg):
+        if len(nodes) > 1 or any(sfg.has_edge(node, node) for node in nodes):
+            yield nodes
 
-        if i == len(items):
-            return
 
-        yield from dfs(i + 1, comb, keys)
+class CycleGraph:
+    """A compact, integer-indexed view of (part of) an SFG.
 
-        if keys.isdisjoint(items[i]):
-            keys |= key(items[i])
-            comb.append(items[i])
-            yield tuple(comb)
-            yield from dfs(i + 1, comb, keys)
-            comb.pop()
-            keys -= key(items[i])
+    Nodes are numbered in the given order and edges in insertion order, so
+    cycles can be enumerated on plain integer lists and encoded as a node
+    bitmask plus a tuple of edge indices.
 
-    yield from dfs(0, [], set())
+    Args:
+        sfg: An SFG with weighted edges.
+        nodes: Optional; The nodes to keep. Defaults to all nodes.
+
+    Attributes:
+        nodes: The name of each node, indexed by node id.
+        index: The id of each node, by name.
+        edges: The (source id, target id) of each edge.
+        weights: The gain of each edge.
+        successors: For each node id, the (edge index, target id) of each of
+            its out-edges.
+    """
 
+    def __init__(self, sfg: nx.DiGraph, nodes: Optional[Iterable[str]] = None):
+        self.nodes = list(sfg if nodes is None else nodes)
+        self.index = {node: i for i, node in enumerate(self.nodes)}
+        self.edges = []
+        self.weights = []
+        self.successors = [[] for _ in self.nodes]
 
-def determinant(graph: nx.DiGraph,
-                cycle_combinations: List[Tuple[OrderedDict, ...]],
-                path: Optional[OrderedDict] = None) -> sympy.Expr:
-    """Finds the determinant of an SFG.
+        for src, dst, weight in sfg.subgraph(self.nodes).edges(data='weight'):
+            u, v = self.index[src], self.index[dst]
+            self.successors[u].append((len(self.edges), v))
+            self.edges.append((u, v))
+            self.weights.append(weight)
 
-    Finds the determinant of an SFG, considering only feedback loops not
-    touching a given simple path. If no such path is given, all feedback
-    loops are considered.
+    def mask(self, nodes: Iterable[str]) -> int:
+        """Finds the bitmask of the given nodes, ignoring unknown nodes."""
+        mask = 0
+        for node in nodes:
+            if node in self.index:
+                mask |= 1 << self.index[node]
+        return mask
+
+    def cycle_nodes(self, edges: Tuple[int, ...]) -> List[str]:
+        """Finds the names of the nodes of a cycle, in order."""
+        return [self.nodes[self.edges[e][0]] for e in edges]
+
+    def gain(self, edges: Iterable[int]) -> sympy.Expr:
+        """Finds the product of the gains of the given edges."""
+        return sympy.Mul.fromiter(self.weights[e] for e in edges)
+
+
+def find_cycles(graph: CycleGraph, max_cycles: Optional[int] = None,
+                max_length: Optional[int] = None,
+                budget: Optional[Budget] = None) \
+        -> Iterator[Tuple[int, Tuple[int, ...]]]:
+    """Iterates over the simple cycles of a graph with Johnson's algorithm.
+
+    Every cycle is found from its lowest-numbered node, so the search from a
+    start node only visits higher-numbered nodes. If max_length is given, a
+    depth-bounded search is used instead, since blocking is only valid for
+    unbounded cycles.
 
     Args:
-        graph: An SFG.
-        cycle_combinations: All combinations of non-touching cycles in the SFG.
-        path: Optional; A simple path with which feedback loops should not
-            intersect.
+        graph: An integer-indexed graph.
+        max_cycles: Optional; Stops after this many cycles.
+        max_length: Optional; Only cycles of at most this many edges are
+            found.
+        budget: Optional; Charged for every cycle and checked for every start
+            node.
+
+    Yields:
+        A (node mask, edge indices) tuple for each cycle, with edges in path
+        order.
+
+    Raises:
+        BudgetExceeded: If the search exceeds its budget.
+    """
+    if max_cycles is not None and max_cycles <= 0:
+        return
+
+    search = _johnson_circuits if max_length is None else _bounded_circuits
+    count = 0
+
+    for start in range(len(graph.nodes)):
+        if budget is not None:
+            budget.charge(0)
+
+        for cycle in search(graph, start, max_length):
+            if budget is not None:
+                budget.charge()
+            yield cycle
+
+            count += 1
+            if max_cycles is not None and count >= max_cycles:
+                return
+
+
+def _johnson_circuits(graph: CycleGraph, start: int, _=None) \
+        -> Iterator[Tuple[int, Tuple[int, ...]]]:
+    successors = graph.successors
+    blocked = [False] * len(graph.nodes)
+    blocked_by = [set() for _ in graph.nodes]
+
+    def unblock(node: int):
+        stack = [node]
+        while stack:
+            node = stack.pop()
+            if blocked[node]:
+                blocked[node] = False
+                stack.extend(blocked_by[node])
+                blocked_by[node].clear()
+
+    # The search is iterative, as in networkx.simple_cycles, so that long
+    # cycles do not exceed the recursion limit. Each frame of the stack holds
+    # a node on the path, an iterator over its remaining out-edges, the mask
+    # of the path so far, and whether a cycle was found through the node.
+    path = []
+    blocked[start] = True
+    stack = [[start, iter(successors[start]), 1 << start, False]]
+
+    while stack:
+        frame = stack[-1]
+        node, remaining, mask, _ = frame
+        step = next(remaining, None)
+
+        if step is not None:
+            edge, succ = step
+            if succ == start:
+                yield mask, tuple(path) + (edge,)
+                frame[3] = True
+            elif succ > start and not blocked[succ]:
+                path.append(edge)
+                blocked[succ] = True
+                stack.append([succ, iter(successors[succ]), mask | 1 << succ,
+                              False])
+            continue
+
+        # All out-edges of the node are explored.
+        stack.pop()
+        found = frame[3]
+        if found:
+            unblock(node)
+        else:
+            for _, succ in successors[node]:
+                if succ > start:
+                    blocked_by[succ].add(node)
+
+        if stack:
+            path.pop()
+            stack[-1][3] |= found
+
+
+def _bounded_circuits(graph: CycleGraph, start: int, max_length: int) \
+        -> Iterator[Tuple[int, Tuple[int, ...]]]:
+    if max_length <= 0:
+        return
+
+    successors = graph.successors
+    path = []
+    stack = [(iter(successors[start]), 1 << start)]
+
+    while stack:
+        remaining, mask = stack[-1]
+        step = next(remaining, None)
+
+        if step is None:
+            stack.pop()
+            if stack:
+                path.pop()
+            continue
+
+        edge, succ = step
+        if succ == start:
+            yield mask, tuple(path) + (edge,)
+        elif succ > start and not mask >> succ & 1 \
+                and len(path) + 1 < max_length:
+            path.append(edge)
+            stack.append((iter(successors[succ]), mask | 1 << succ))
+
+
+def sfg_fingerprint(sfg: nx.DiGraph) -> str:
+    """Finds a canonical fingerprint of the structure of an SFG.
+
+    The fingerprint covers the node names, the edges and the symbolic edge
+    weights, but not the numerical values of any symbol, so circuits of the
+    same topology and component names share it, whatever their values. It
+    is the same in every process and for every insertion order.
+
+    Args:
+        sfg: An SFG with weighted edges.
 
     Returns:
-        The determinant expression.
+        A hexadecimal SHA-256 digest of the SFG.
     """
-    path = path or OrderedDict()
-    gain_products_sums = []
+    nodes = sorted(map(str, sfg.nodes))
+    edges = sorted((str(u), str(v), sympy.srepr(sympy.sympify(weight)))
+                   for u, v, weight in sfg.edges(data='weight', default=0))
+    text = repr((nodes, edges))
+    return hashlib.sha256(text.encode()).hexdigest()
+
+
+def relevant_nodes(sfg: nx.DiGraph, input_node: str, output_node: str) \
+        -> Set[str]:
+    """Finds the nodes relevant to the transfer function between two nodes.
 
-    for size, group in groupby(cycle_combinations, key=len):
+    A node is relevant if it is reachable from the input node and can reach
+    the output node. The relevant nodes form whole strongly connected
+    components, and no forward path touches any other component. The loops of
+    those other components appear alike in the determinant and in every path
+    cofactor, so they cancel exactly in the transfer function.
+
+    Args:
+        sfg: An SFG with weighted edges.
+        input_node: The name of the input node.
+        output_node: The name of the output node.
 
-        gain_products = []
+    Returns:
+        The set of relevant nodes. It is empty if the output node is not
+        reachable from the input node.
+    """
+    if input_node not in sfg:
+        raise ValueError('Invalid input node.')
+    if output_node not in sfg:
+        raise ValueError('Invalid output node.')
 
-        for comb in group:
+    return (nx.descendants(sfg, input_node) | {input_node}) \
+        & (nx.ancestors(sfg, output_node) | {output_node})
 
-            if all(path.keys().isdisjoint(cycle.keys()) for cycle in comb):
-                # If all cycles in this combination do not intersect the path,
-                # compute the product of loop gains.
 
-                gains = (graph.edges[u, v]['weight']
-                         for cycle in comb
-                         for u, v in pairwise_circular(cycle))
-                gain_products.append(sympy.Mul.fromiter(gains))
+def prune(sfg: nx.DiGraph, input_node: str, output_node: str) -> nx.DiGraph:
+    """Restricts an SFG to the nodes relevant to a transfer function.
 
-        # Odd-sized combinations have a negative sign.
-        sign = -1 if size % 2 else 1
-        gain_products_sums.append(sympy.Add.fromiter(gain_products) * sign)
+    The transfer function between the input and output nodes is the same for
+    the pruned SFG as for the original. The loop gain is not.
 
-    return 1 + sympy.Add.fromiter(gain_products_sums)
+    Args:
+        sfg: An SFG with weighted edges.
+        input_node: The name of the input node.
+        output_node: The name of the output node.
+
+    Returns:
+        A pruned copy of the SFG.
+    """
+    return sfg.subgraph(relevant_nodes(sfg, input_node, output_node)).copy()
+
+
+class LoopComponent:
+    """The feedback loops of one strongly connected component of an SFG.
+
+    Cycles and combinations are encoded as integer bitmasks of their nodes. An
+    inverted index maps each node to the bitset of combinations touching it,
+    so a cofactor only visits the combinations that do not intersect the
+    given nodes. The index is built on first use, and the product of each
+    combination the first time a cofactor needs it. Neither is pickled, so
+    that a component is cheap to send to a worker process.
+
+    Attributes:
+        nodes: The nodes of the component.
+        cycles: All simple cycles in the component, as lists of nodes.
+        cycle_combinations: All combinations of non-touching cycles, as tuples
+            of indices into cycles.
+        determinant: The determinant of the component.
+    """
+
+    def __init__(self, sfg: nx.DiGraph, nodes: Iterable[str],
+                 budget: Optional[Budget] = None,
+                 processes: Optional[int] = None):
+        self.nodes = set(nodes)
+        self._graph = CycleGraph(sfg, self.nodes)
+
+        # Find all simple cycles, and the bitmask and loop gain of each.
+        found = list(find_cycles(self._graph, budget=budget))
+        self._cycle_masks = [mask for mask, _ in found]
+        self._cycle_gains = [self._graph.gain(edges) for _, edges in found]
+        self.cycles = [self._graph.cycle_nodes(edges) for _, edges in found]
+
+        # Find all combinations of non-touching cycles. Each contributes the
+        # product of its loop gains to the determinant, and odd-sized
+        # combinations have a negative sign.
+        self.cycle_combinations = list(_charged(
+            non_touching_combinations(self._cycle_masks), budget))
+        self._terms = None
+        self._touching = None
+
+        if processes and len(self.cycle_combinations) >= PARALLEL_MIN_TERMS:
+            # Each worker builds and sums the products of its share of the
+            # combinations.
+            units = (CombinationShard(self._cycle_gains, shard) for shard
+                     in _split(self.cycle_combinations, processes))
+            self.determinant = 1 + parallel_sum(
+                process_pool(processes), _combination_shard_sum, units,
+                budget)
+        else:
+            self.determinant = self.cofactor(())
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_terms'] = None
+        state['_touching'] = None
+        return state
+
+    def _index(self) -> List[int]:
+        """Builds the inverted index, if it is not already."""
+        if self._touching is None:
+            touching = [0] * len(self.nodes)
+
+            for c, comb in enumerate(self.cycle_combinations):
+                mask = 0
+                for i in comb:
+                    mask |= self._cycle_masks[i]
+                for node in iter_bits(mask):
+                    touching[node] |= 1 << c
+
+            self._terms = [None] * len(self.cycle_combinations)
+            self._touching = touching
+
+        return self._touching
+
+    def _term(self, c: int) -> sympy.Expr:
+        """Finds the term of a combination, if it is not already known."""
+        term = self._terms[c]
+        if term is None:
+            term = _combination_term(self._cycle_gains,
+                                     self.cycle_combinations[c])
+            self._terms[c] = term
+        return term
+
+    def cofactor(self, nodes: Iterable[str]) -> sympy.Expr:
+        """Finds the determinant of the component, considering only feedback
+        loops that do not touch any of the given nodes.
+
+        Args:
+            nodes: The nodes to avoid. Nodes outside the component are
+                ignored.
+
+        Returns:
+            The cofactor expression.
+        """
+        index = self._index()
+
+        touching = 0
+        for node in iter_bits(self._graph.mask(nodes)):
+            touching |= index[node]
+
+        non_touching = ((1 << len(self.cycle_combinations)) - 1) & ~touching
+
+        return 1 + sympy.Add.fromiter(self._term(c)
+                                      for c in iter_bits(non_touching))
+
+
+class CombinationShard(NamedTuple):
+    """A picklable unit of determinant work: the loop gains of every cycle in
+    a component, and a shard of its combinations of non-touching cycles."""
+    gains: List[sympy.Expr]
+    combinations: List[Tuple[int, ...]]
+
+
+def _combination_term(gains: List[sympy.Expr], comb: Tuple[int, ...]) \
+        -> sympy.Expr:
+    """Finds the signed product of the loop gains of a combination of
+    cycles."""
+    sign = -1 if len(comb) % 2 else 1
+    return sign * sympy.Mul.fromiter(gains[i] for i in comb)
+
+
+def _combination_shard_sum(shard: CombinationShard) -> sympy.Expr:
+    """Sums the terms of a shard of combinations."""
+    return sympy.Add.fromiter(_combination_term(shard.gains, comb)
+                              for comb in shard.combinations)
+
+
+class MasonContext:
+    """Shared state for repeated applications of Mason's formula to one SFG.
+
+    Finding all simple cycles, their non-touching combinations and the overall
+    determinant only depends on the SFG. The context does this work once, so
+    that any number of (input_node, output_node) pairs and the loop gain can be
+    computed from the same state. The SFG must not be modified afterwards.
+
+    No loop crosses between strongly connected components, so the determinant
+    is the product of the determinants of each component, and so is every
+    path cofactor. Loops are only ever combined within their own component.
+    Components are enumerated lazily, the first time a transfer function
+    they are relevant to, or the loop gain, is requested, so the loops of
+    components that cannot affect a pair of nodes are never enumerated for
+    its transfer function.
+
+    With processes set, determinants and numerators of at least
+    PARALLEL_MIN_TERMS terms are split into one picklable work unit per
+    worker, which builds and sums its share of the terms, across a shared
+    pool of worker processes. See process_pool.
+
+    Args:
+        sfg: An SFG with weighted edges.
+        budget: Optional; The budget for enumerating cycles and combinations,
+            where a method is not given its own.
+        processes: Optional; The number of worker processes. If None or 0,
+            everything is evaluated in the calling process.
+
+    Attributes:
+        sfg: An SFG with weighted edges.
+    """
+
+    def __init__(self, sfg: nx.DiGraph, budget: Optional[Budget] = None,
+                 processes: Optional[int] = None):
+        self.sfg = sfg
+        self.processes = processes
+        self.budget = budget
+
+        # The nodes of each strongly connected component with a cycle, and
+        # its loops, once enumerated.
+        self._nodes = list(cyclic_components(sfg))
+        self._components = [None] * len(self._nodes)
+        self._determinant = None
+
+        self._transfer_functions = {}
+
+    def _load_components(self, indices: List[int],
+                         budget: Optional[Budget]) -> List[LoopComponent]:
+        """Enumerates the loops of the given components, if they are not
+        already."""
+        missing = [c for c in indices if self._components[c] is None]
+        if missing:
+            budget = budget if budget is not None else self.budget
+            for c in missing:
+                self._components[c] = LoopComponent(
+                    self.sfg, self._nodes[c], budget, self.processes)
+
+        return [self._components[c] for c in indices]
+
+    @property
+    def components(self) -> List[LoopComponent]:
+        """The loops of each strongly connected component that has at least
+        one cycle."""
+        return self._load_components(list(range(len(self._nodes))), None)
+
+    @property
+    def determinant(self) -> sympy.Expr:
+        """The overall determinant of the SFG."""
+        if self._determinant is None:
+            self._determinant = sympy.Mul.fromiter(
+                component.determinant for component in self.components)
+        return self._determinant
+
+    @property
+    def cycles(self) -> List[List[str]]:
+        """All simple cycles in the SFG, as lists of nodes."""
+        return [cycle for component in self.components
+                for cycle in component.cycles]
+
+    def transfer_function(self, input_node: str, output_node: str,
+                          budget: Optional[Budget] = None,
+                          with_loop_gain: bool = True) \
+            -> Tuple[sympy.Expr, Optional[sympy.Expr]]:
+        """Computes the transfer function between a pair of nodes.
+
+        Args:
+            input_node: The name of the input node.
+            output_node: The name of the output node.
+            budget: Optional; The budget for enumerating the loops of the
+                relevant components and the forward paths.
+            with_loop_gain: Optional; If False, the loop gain is not
+                computed, so only the components relevant to the pair of
+                nodes are enumerated. Defaults to True.
+
+        Returns:
+            A tuple consisting of the transfer function and loop gain
+            expression, which is None if with_loop_gain is False.
+        """
+        key = (input_node, output_node)
+
+        if key not in self._transfer_functions:
+            # Only the components relevant to this pair of nodes are
+            # enumerated; the determinants of the others cancel out.
+            relevant = relevant_nodes(self.sfg, input_node, output_node)
+            components = self._load_components(
+                [c for c, nodes in enumerate(self._nodes)
+                 if not nodes.isdisjoint(relevant)], budget)
+
+            denom = sympy.Mul.fromiter(component.determinant
+                                       for component in components)
+            self._transfer_functions[key] = self._numerator(
+                input_node, output_node, components, budget) / denom
+
+        loop_gain = self.loop_gain(budget) if with_loop_gain else None
+        return self._transfer_functions[key], loop_gain
+
+    def loop_gain(self, budget: Optional[Budget] = None) -> sympy.Expr:
+        """Computes the loop gain of the SFG.
+
+        Args:
+            budget: Optional; The budget for enumerating the loops of every
+                component.
+
+        Returns:
+            The loop gain expression.
+        """
+        if self._determinant is None:
+            self._load_components(list(range(len(self._nodes))), budget)
+        return 1 - self.determinant
+
+    def _numerator(self, input_node: str, output_node: str,
+                   components: List[LoopComponent],
+                   budget: Optional[Budget]) -> sympy.Expr:
+        sfg = self.sfg
+        paths = _charged(all_simple_paths(sfg, input_node, output_node),
+                         budget)
+
+        if self.processes:
+            # Only shard the paths if there are enough of them.
+            first = list(islice(paths, PARALLEL_MIN_TERMS))
+            paths = chain(first, paths)
+
+            if len(first) == PARALLEL_MIN_TERMS:
+                # Each worker finds the gains and cofactors of its share of
+                # the paths, so the SFG and components are sent once per
+                # worker.
+                units = (PathShard(sfg, shard, components) for shard
+                         in _split(list(paths), self.processes))
+                return parallel_sum(process_pool(self.processes),
+                                    _path_shard_sum, units, budget)
+
+        # For each forward path, find its gain and cofactor. Then, find the
+        # sum of their products.
+        return sympy.Add.fromiter(
+            sympy.Mul(_path_gain(sfg, path), _path_cofactor(path, components))
+            for path in paths
+        )
+
+
+class PathShard(NamedTuple):
+    """A picklable unit of numerator work: the SFG, a shard of its forward
+    paths, and the loop components their cofactors are taken over."""
+    sfg: nx.DiGraph
+    paths: List[List[str]]
+    components: List[LoopComponent]
+
+
+def _path_shard_sum(shard: PathShard) -> sympy.Expr:
+    """Sums the products of path gain and cofactor over a shard of paths."""
+    return sympy.Add.fromiter(
+        sympy.Mul(_path_gain(shard.sfg, path),
+                  _path_cofactor(path, shard.components))
+        for path in shard.paths
+    )
+
+
+def _path_gain(sfg: nx.DiGraph, path: List[str]) -> sympy.Expr:
+    """Finds the product of the edge gains along a path."""
+    return sympy.Mul.fromiter(sfg.edges[u, v]['weight']
+                              for u, v in pairwise(path))
+
+
+def _path_cofactor(path: List[str], components: List[LoopComponent]) \
+        -> sympy.Expr:
+    """Finds the determinant over the given components, considering only
+    feedback loops that do not touch a path. Only the components the path
+    passes through differ from their own determinant."""
+    return sympy.Mul.fromiter(
+        component.cofactor(path) if not component.nodes.isdisjoint(path)
+        else component.determinant
+        for component in components
+    )
+
+
+def iter_transfer_function(sfg: nx.DiGraph, input_node: str,
+                           output_node: str,
+                           budget: Optional[Budget] = None) \
+        -> Iterator[Tuple[str, sympy.Expr]]:
+    """Streams the terms of the transfer function of an SFG.
+
+    The determinant is yielded as one factor per strongly connected component
+    as soon as that component's loops are enumerated, followed by one
+    numerator term per forward path. At any point, the product of the
+    'denominator' factors and the sum of the 'numerator' terms yielded so far
+    are partial results. Only nodes relevant to the pair of nodes are visited.
+
+    Args:
+        sfg: An SFG with weighted edges.
+        input_node: The name of the input node.
+        output_node: The name of the output node.
+        budget: Optional; The budget for the whole evaluation. Once exceeded,
+            BudgetExceeded is raised from the iterator.
+
+    Yields:
+        A ('denominator', factor) or ('numerator', term) tuple.
+    """
+    sfg = sfg.subgraph(relevant_nodes(sfg, input_node, output_node))
+    if output_node not in sfg:
+        return
+
+    components = []
+    for nodes in cyclic_components(sfg):
+        components.append(LoopComponent(sfg, nodes, budget))
+        yield 'denominator', components[-1].determinant
+
+    for path in _charged(all_simple_paths(sfg, input_node, output_node),
+                         budget):
+        yield 'numerator', sympy.Mul(_path_gain(sfg, path),
+                                     _path_cofactor(path, components))
+
+
+class Reduction(NamedTuple):
+    """The result of reduce_sfg.
+
+    Attributes:
+        sfg: The reduced SFG. Each edge has an 'absorbed' attribute listing
+            the original nodes folded into it.
+        absorbed: Maps each absorbed node to the edge of the reduced SFG it
+            was folded into.
+        scale: The factor by which the determinant of the reduced SFG must be
+            multiplied to give the determinant of the original SFG.
+    """
+    sfg: nx.DiGraph
+    absorbed: Dict[str, Tuple[str, str]]
+    scale: sympy.Expr
+
+
+def reduce_sfg(sfg: nx.DiGraph, keep: Iterable[str] = (),
+               fold_self_loops: bool = True) -> Reduction:
+    """Collapses series nodes and self-loops of an SFG.
+
+    The following reductions are applied until none is left, to every node
+    that is not kept:
+        * A series node, with exactly one incoming and one outgoing edge, is
+          replaced by a single edge with the product of both gains. If an edge
+          between the same nodes already exists, the gains are added. This
+          leaves the determinant unchanged.
+        * A self-loop with gain L is removed, and the gains of the incoming
+          edges of its node are divided by (1 - L). This divides the
+          determinant by (1 - L), which is accounted for by the scale.
+
+    Both reductions preserve the value of every remaining node, so transfer
+    functions between kept nodes are unchanged.
+
+    Args:
+        sfg: An SFG with weighted edges.
+        keep: Optional; The nodes that must not be reduced, such as the input
+            and output nodes.
+        fold_self_loops: Optional; If False, self-loops are kept, so the
+            scale is 1 and the reduced SFG has the same determinant, and so
+            the same loop gain, as the original. Defaults to True.
+
+    Returns:
+        The reduced SFG, the absorbed nodes, and the determinant scale.
+    """
+    keep = set(keep)
+    reduced = nx.DiGraph()
+    reduced.add_nodes_from(sfg)
+    for src, dst, data in sfg.edges(data=True):
+        reduced.add_edge(src, dst, weight=sympy.sympify(data['weight']),
+                         absorbed=list(data.get('absorbed', ())))
 
+    scale = sympy.S.One
+    dropped = {}
+    queue = list(reduced)
 
-def transfer_function(sfg: nx.DiGraph, input_node: str, output_node: str) \
+    while queue:
+        node = queue.pop()
+        if node in keep or node not in reduced:
+            continue
+
+        if reduced.has_edge(node, node):
+            if not fold_self_loops:
+                continue
+
+            loop = reduced.edges[node, node]
+            reduced.remove_edge(node, node)
+            scale *= 1 - loop['weight']
+
+            if not reduced.in_degree(node):
+                dropped.update(dict.fromkeys(loop['absorbed'], (node, node)))
+
+            for pred in reduced.predecessors(node):
+                edge = reduced.edges[pred, node]
+                edge['weight'] /= 1 - loop['weight']
+                edge['absorbed'] += loop['absorbed']
+
+            queue.append(node)
+
+        elif reduced.in_degree(node) == 1 and reduced.out_degree(node) == 1:
+            (pred,) = reduced.predecessors(node)
+            (succ,) = reduced.successors(node)
+            first = reduced.edges[pred, node]
+            second = reduced.edges[node, succ]
+
+            weight = first['weight'] * second['weight']
+            absorbed = first['absorbed'] + [node] + second['absorbed']
+            reduced.remove_node(node)
+
+            if reduced.has_edge(pred, succ):
+                # Parallel edges are merged.
+                edge = reduced.edges[pred, succ]
+                edge['weight'] += weight
+                edge['absorbed'] += absorbed
+            else:
+                reduced.add_edge(pred, succ, weight=weight, absorbed=absorbed)
+
+            queue.extend((pred, succ))
+
+    absorbed = {node: (src, dst)
+                for src, dst, nodes in reduced.edges(data='absorbed')
+                for node in nodes}
+    absorbed.update(dropped)
+
+    return Reduction(reduced, absorbed, scale)
+
+
+def transfer_function(sfg: nx.DiGraph, input_node: str, output_node: str,
+                      reduce: bool = False, budget: Optional[Budget] = None,
+                      processes: Optional[int] = None) \
         -> Tuple[sympy.Expr, sympy.Expr]:
     """Computes the transfer function of an SFG.
 
+    To compute several transfer functions of the same SFG, construct a
+    MasonContext once instead.
+
     Args:
         sfg: An SFG with weighted edges.
         input_node: The name of the input node.
         output_node: The name of the output node.
+        reduce: Optional; If True, series nodes and self-loops are collapsed
+            by reduce_sfg before applying Mason's formula. Defaults to False.
+        budget: Optional; The budget for the whole evaluation.
+        processes: Optional; The number of worker processes to shard forward
+            paths and cycle combinations across. Defaults to None, which
+            evaluates everything in the calling process.
 
     Returns:
         A tuple consisting of the transfer function and loop gain expression.
+
+    Raises:
+        BudgetExceeded: If the evaluation exceeds its budget.
     """
+    if not reduce:
+        return MasonContext(sfg, budget, processes).transfer_function(
+            input_node, output_node, budget)
 
-    # Find all simple paths from the input node to the output node.
-    paths = [OrderedDict.fromkeys(nodes) for nodes
-             in all_simple_paths(sfg, input_node, output_node)]
+    reduction = reduce_sfg(sfg, keep=(input_node, output_node))
+    transfer, loop = MasonContext(reduction.sfg, budget, processes). \
+        transfer_function(input_node, output_node, budget)
 
-    # Find all simple cycles.
-    cycles = [OrderedDict.fromkeys(nodes) for nodes in simple_cycles(sfg)]
+    return transfer, 1 - (1 - loop) * reduction.scale
 
-    # Find all combinations of non-touching cycles, sorted by combination size.
-    cycle_combinations = list(disjoint_combinations(
-        cycles, key=lambda cycle: cycle.keys()))
-    cycle_combinations.sort(key=len)
 
-    # Find overall determinant.
-    denom = determinant(sfg, cycle_combinations)
+def loop_gain(sfg: nx.DiGraph, budget: Optional[Budget] = None,
+              processes: Optional[int] = None) -> sympy.Expr:
+    """Computes the loop gain of a given SFG.
 
-    # For each forward path, find its gain and determinant. Then, find the sum
-    # of their products.
-    path_gains = (sympy.Mul.fromiter(sfg.edges[u, v]['weight']
-                                     for u, v in pairwise(path))
-                  for path in paths)
-    determs = (determinant(sfg, cycle_combinations, path) for path in paths)
-    numer = sympy.Add.fromiter(
-        sympy.Mul(path_gain, determ)
-        for path_gain, determ in zip(path_gains, determs)
-    )
+    Args:
+        sfg: An SFG with weighted edges.
+        budget: Optional; The budget for the whole evaluation.
+        processes: Optional; The number of worker processes. Defaults to None.
 
-    # Final result
-    transfer_function = numer / denom
-    loop_gain = 1 - denom
+    Returns:
+        The loop gain expression.
 
-    print(cycles)
-    print(cycle_combinations)
-    print(sfg)
-    print("lg")
-    print(loop_gain)
-    return transfer_function, loop_gain
+    Raises:
+        BudgetExceeded: If the evaluation exceeds its budget.
+    """
+    return MasonContext(sfg, budget, processes).loop_gain()
 
 
-def loop_gain(sfg: nx.DiGraph) -> sympy.Expr:
-    """Computes the loop gain of a given SFG.
+def bareiss_determinant(matrix: List[List[Any]]) -> Any:
+    """Computes the determinant of a square matrix over a polynomial ring.
+
+    Uses Bareiss's fraction-free elimination. Every division in the algorithm
+    is exact, so entries stay polynomials instead of growing into nested
+    fractions.
+
+    Args:
+        matrix: A non-empty square matrix of polynomial ring elements, as a
+            list of rows.
+
+    Returns:
+        The determinant, as a ring element.
+    """
+    m = [list(row) for row in matrix]
+    n = len(m)
+    sign = 1
+    prev = None
+
+    for k in range(n - 1):
+        if not m[k][k]:
+            # Swap in a row with a non-zero pivot, if there is one.
+            pivot = next((i for i in range(k + 1, n) if m[i][k]), None)
+            if pivot is None:
+                return m[k][k]
+            m[k], m[pivot] = m[pivot], m[k]
+            sign = -sign
+
+        for i in range(k + 1, n):
+            for j in range(k + 1, n):
+                numer = m[k][k] * m[i][j] - m[i][k] * m[k][j]
+                m[i][j] = numer if prev is None else numer.exquo(prev)
+
+        prev = m[k][k]
+
+    return sign * m[n - 1][n - 1]
+
+
+def bareiss_solve(matrix: List[List[Any]], rhs: List[List[Any]]) \
+        -> Tuple[Any, List[List[Any]]]:
+    """Solves a square system for several right-hand sides without fractions.
+
+    The augmented matrix is reduced by Bareiss's elimination, once for all
+    right-hand sides, and the solution is scaled by the last pivot d, which
+    is the determinant up to sign, so back-substitution stays exact.
+
+    Args:
+        matrix: A non-empty, non-singular square matrix of polynomial ring
+            elements, as a list of rows.
+        rhs: The right-hand sides, as a list of rows with one column for each
+            right-hand side.
+
+    Returns:
+        A (d, scaled) tuple, where the solution is scaled / d. Rows of scaled
+        follow the rows of the matrix, and columns the right-hand sides.
+    """
+    m = [list(row) + list(b) for row, b in zip(matrix, rhs)]
+    n = len(m)
+    width = len(m[0])
+    prev = None
+
+    for k in range(n - 1):
+        if not m[k][k]:
+            pivot = next((i for i in range(k + 1, n) if m[i][k]), None)
+            if pivot is None:
+                raise ZeroDivisionError('Singular matrix.')
+            m[k], m[pivot] = m[pivot], m[k]
+
+        for i in range(k + 1, n):
+            for j in range(k + 1, width):
+                numer = m[k][k] * m[i][j] - m[i][k] * m[k][j]
+                m[i][j] = numer if prev is None else numer.exquo(prev)
+
+        prev = m[k][k]
+
+    d = m[n - 1][n - 1]
+    if not d:
+        raise ZeroDivisionError('Singular matrix.')
+
+    # Back-substitute for d times the solution, one row at a time; every
+    # division is exact.
+    scaled = [None] * n
+    for i in reversed(range(n)):
+        scaled[i] = [
+            (d * m[i][n + c] - sum((m[i][j] * scaled[j][c]
+                                    for j in range(i + 1, n)), d.ring.zero))
+            .exquo(m[i][i])
+            for c in range(width - n)
+        ]
+
+    return d, scaled
+
+
+def eliminate_nodes(sfg: nx.DiGraph, input_nodes: List[str] = (),
+                    output_nodes: List[str] = (),
+                    budget: Optional[Budget] = None) \
+        -> Tuple[List[List[sympy.Expr]], sympy.Expr]:
+    """Solves an SFG by eliminating its nodes one at a time.
+
+    This is Gaussian elimination of (I - A), where A is the gain matrix,
+    carried out on the graph. Eliminating a node with self-loop gain L adds
+    the gain of every path through it, divided by the pivot 1 - L, to the
+    edge between each of its predecessors and successors. Gains are kept in
+    factored form, never expanded, so the cost is polynomial in the number
+    of nodes however many loops the SFG has. Nodes are eliminated in order
+    of least fill-in, which keeps chains and rings as small as they are.
+
+    Each input node is excited through an edge from its own source node, and
+    each output node drives its own sink node, so once every node of the SFG
+    is eliminated, the edge from a source to a sink is the transfer function
+    between them, and the determinant of (I - A) is the product of pivots.
 
     Args:
         sfg: An SFG with weighted edges.
+        input_nodes: Optional; The names of the input nodes.
+        output_nodes: Optional; The names of the output nodes.
+        budget: Optional; Charged for every predecessor updated by each
+            elimination.
+
+    Returns:
+        A (matrix, determinant) tuple, where matrix[j][i] is the transfer
+        function from input_nodes[i] to output_nodes[j].
+
+    Raises:
+        BudgetExceeded: If the elimination exceeds its budget.
+        ZeroDivisionError: If (I - A) is singular.
+    """
+    index = {node: i for i, node in enumerate(sfg)}
+    n = len(index)
+    sources = range(n, n + len(input_nodes))
+    sinks = range(n + len(input_nodes), n + len(input_nodes) +
+                  len(output_nodes))
+
+    # Outgoing edge gains, and the predecessors of each node.
+    gains = [{} for _ in range(sinks.stop)]
+    for src, dst, weight in sfg.edges(data='weight'):
+        gains[index[src]][index[dst]] = sympy.sympify(weight)
+    for source, input_node in zip(sources, input_nodes):
+        gains[source][index[input_node]] = sympy.S.One
+    for sink, output_node in zip(sinks, output_nodes):
+        gains[index[output_node]][sink] = sympy.S.One
+
+    predecessors = [set() for _ in gains]
+    for src, edges in enumerate(gains):
+        for dst in edges:
+            if dst != src:
+                predecessors[dst].add(src)
+
+    def fill_in(node):
+        pivot = 1 - gains[node].get(node, sympy.S.Zero)
+        return (pivot == 0,
+                len(predecessors[node]) * (len(gains[node]) -
+                                           (node in gains[node])))
+
+    pivots = []
+    remaining = set(range(n))
+    while remaining:
+        node = min(remaining, key=fill_in)
+        remaining.remove(node)
+
+        pivot = 1 - gains[node].pop(node, sympy.S.Zero)
+        if pivot == 0:
+            raise ZeroDivisionError('Singular matrix.')
+        pivots.append(pivot)
+
+        successors = gains[node]
+        for predecessor in predecessors[node]:
+            if budget is not None:
+                budget.charge()
+
+            gain = gains[predecessor].pop(node) / pivot
+            for successor, weight in successors.items():
+                gains[predecessor][successor] = \
+                    gains[predecessor].get(successor, sympy.S.Zero) + \
+                    gain * weight
+                if successor != predecessor:
+                    predecessors[successor].add(predecessor)
+
+        for successor in successors:
+            predecessors[successor].discard(node)
+        gains[node] = {}
+
+    matrix = [[gains[source].get(sink, sympy.S.Zero) for source in sources]
+              for sink in sinks]
+    return matrix, sympy.Mul.fromiter(pivots)
+
+
+def elimination_transfer_function(sfg: nx.DiGraph, input_node: str,
+                                  output_node: str,
+                                  budget: Optional[Budget] = None,
+                                  with_loop_gain: bool = True) \
+        -> Tuple[sympy.Expr, Optional[sympy.Expr]]:
+    """Computes the transfer function of an SFG by symbolic elimination.
+
+    Unlike Mason's formula, cycles are never enumerated. See eliminate_nodes.
+    Nodes irrelevant to the pair of nodes are only eliminated for the loop
+    gain.
+
+    Args:
+        sfg: An SFG with weighted edges.
+        input_node: The name of the input node.
+        output_node: The name of the output node.
+        budget: Optional; The budget for the whole evaluation.
+        with_loop_gain: Optional; If False, the loop gain is not computed.
+            Defaults to True.
+
+    Returns:
+        A tuple consisting of the transfer function and loop gain expression,
+        which is None if with_loop_gain is False.
+
+    Raises:
+        BudgetExceeded: If the evaluation exceeds its budget.
+    """
+    relevant = relevant_nodes(sfg, input_node, output_node)
+
+    if output_node in relevant:
+        matrix, determ = eliminate_nodes(
+            sfg.subgraph(relevant), [input_node], [output_node], budget)
+        transfer = matrix[0][0]
+    else:
+        transfer, determ = sympy.S.Zero, sympy.S.One
+
+    if not with_loop_gain:
+        return transfer, None
+
+    # The determinant of the irrelevant nodes cancels out of the transfer
+    # function, and is only needed for the loop gain.
+    _, rest = eliminate_nodes(sfg.subgraph(set(sfg) - relevant),
+                              budget=budget)
+    return transfer, 1 - determ * rest
+
+
+def elimination_loop_gain(sfg: nx.DiGraph,
+                          budget: Optional[Budget] = None) -> sympy.Expr:
+    """Computes the loop gain of an SFG by symbolic elimination.
+
+    Args:
+        sfg: An SFG with weighted edges.
+        budget: Optional; The budget for the whole evaluation.
 
     Returns:
         The loop gain expression.
+
+    Raises:
+        BudgetExceeded: If the evaluation exceeds its budget.
+    """
+    return 1 - eliminate_nodes(sfg, budget=budget)[1]
+
+
+def transfer_matrix_nodes(sfg: nx.DiGraph, input_nodes: List[str],
+                          output_nodes: List[str]) -> Set[str]:
+    """Finds the nodes relevant to any pair of input and output nodes.
+
+    Raises:
+        ValueError: If a node is not in the SFG.
+    """
+    return set().union(*(relevant_nodes(sfg, input_node, output_node)
+                         for input_node in input_nodes
+                         for output_node in output_nodes))
+
+
+def elimination_transfer_matrix(sfg: nx.DiGraph, input_nodes: List[str],
+                                output_nodes: List[str],
+                                budget: Optional[Budget] = None) \
+        -> sympy.Matrix:
+    """Computes the transfer functions between every pair of input and output
+    nodes by symbolic elimination.
+
+    The SFG is eliminated once, with a source for each input node and a sink
+    for each output node, so each additional pair costs no more than the
+    fill-in of its source and sink. See eliminate_nodes.
+
+    Args:
+        sfg: An SFG with weighted edges.
+        input_nodes: The names of the input nodes.
+        output_nodes: The names of the output nodes.
+        budget: Optional; The budget for the whole evaluation.
+
+    Returns:
+        A matrix whose entry [j, i] is the transfer function from
+        input_nodes[i] to output_nodes[j].
+
+    Raises:
+        BudgetExceeded: If the evaluation exceeds its budget.
+    """
+    relevant = transfer_matrix_nodes(sfg, input_nodes, output_nodes)
+    matrix = sympy.zeros(len(output_nodes), len(input_nodes))
+    if not relevant:
+        return matrix
+
+    # Only nodes of the relevant subgraph can be excited or observed.
+    inputs = [i for i, node in enumerate(input_nodes) if node in relevant]
+    outputs = [j for j, node in enumerate(output_nodes) if node in relevant]
+    entries, _ = eliminate_nodes(
+        sfg.subgraph(relevant), [input_nodes[i] for i in inputs],
+        [output_nodes[j] for j in outputs], budget)
+
+    for row, j in zip(entries, outputs):
+        for entry, i in zip(row, inputs):
+            matrix[j, i] = entry
+
+    return matrix
+
+
+def estimate_cost(sfg: nx.DiGraph, input_node: Optional[str] = None,
+                  output_node: Optional[str] = None,
+                  limit: int = ESTIMATE_LIMIT,
+                  budget: Optional[Budget] = None) -> Dict[str, Any]:
+    """Estimates how expensive each symbolic engine is for an SFG.
+
+    No loop crosses between strongly connected components, so cycles and
+    their non-touching combinations are counted per component, and the
+    combination counts multiply. Every count stops at the limit, so the
+    estimate itself stays cheap on pathological SFGs. The size of the
+    expression elimination derives is estimated by replaying the elimination
+    on edge sizes; see eliminate_nodes.
+
+    Args:
+        sfg: An SFG with weighted edges.
+        input_node: Optional; The name of the input node. If both the input
+            and output nodes are given, the SFG is pruned to the nodes
+            relevant to them first, as by MasonContext.transfer_function,
+            and forward paths are counted.
+        output_node: Optional; The name of the output node.
+        limit: Optional; The maximum count of paths, cycles, and
+            combinations.
+        budget: Optional; The budget of the request. Its time and
+            cancellation are checked as the counts are made, but no terms
+            are charged.
+
+    Returns:
+        A dictionary of node, edge, component, path, cycle, combination, and
+        term counts, whether any of these counts reached the limit, and the
+        'elimination_size' of the expression elimination derives.
+
+    Raises:
+        BudgetExceeded: If the request runs out of time or is cancelled.
+    """
+    def checked(iterable: Iterable) -> Iterator:
+        for item in iterable:
+            if budget is not None:
+                budget.charge(0)
+            yield item
+
+    exceeded = False
+
+    paths = 0
+    if input_node is not None and output_node is not None:
+        sfg = prune(sfg, input_node, output_node)
+        if output_node in sfg:
+            paths = sum(1 for _ in islice(
+                checked(all_simple_paths(sfg, input_node, output_node)),
+                limit))
+        exceeded |= paths >= limit
+
+    components = 0
+    cycles = 0
+    # One more than the number of combinations, i.e., the number of terms in
+    # the determinant.
+    determinant_terms = 1
+
+    for nodes in cyclic_components(sfg):
+        components += 1
+
+        masks = [mask for mask, _ in checked(
+            find_cycles(CycleGraph(sfg, nodes), max_cycles=limit))]
+        cycles += len(masks)
+
+        if len(masks) >= limit:
+            exceeded = True
+            determinant_terms = limit + 1
+            continue
+
+        combinations = sum(1 for _ in islice(
+            checked(non_touching_combinations(masks)), limit))
+        exceeded |= combinations >= limit
+        determinant_terms = min(determinant_terms * (combinations + 1),
+                                limit + 1)
+
+    combinations = min(determinant_terms - 1, limit)
+    exceeded |= combinations >= limit
+
+    return {
+        'nodes': sfg.number_of_nodes(),
+        'edges': sfg.number_of_edges(),
+        'components': components,
+        'paths': paths,
+        'cycles': min(cycles, limit),
+        'combinations': combinations,
+        # Each forward path is multiplied by its cofactor, which has at most
+        # as many terms as the determinant.
+        'terms': (paths + 1) * (combinations + 1),
+        'exceeded': exceeded,
+        'elimination_size': _elimination_size(
+            sfg, input_node, output_node, checked)
+    }
+
+
+def _elimination_size(sfg: nx.DiGraph, input_node: Optional[str],
+                      output_node: Optional[str], checked) -> int:
+    """Estimates the number of operations in the expression eliminate_nodes
+    derives: the transfer function between a pair of nodes, or the
+    determinant if either node is None.
+
+    The elimination is replayed on edge sizes instead of gains, so it costs
+    no more than the fill-in. It stops once an edge exceeds
+    ELIMINATION_SIZE_LIMIT, as that size only grows as it is propagated.
+    """
+    index = {node: i for i, node in enumerate(sfg)}
+    n = len(index)
+    pair = input_node is not None and output_node is not None and \
+        output_node in index
+
+    sizes = [{} for _ in range(n + 2)]
+    for src, dst in sfg.edges():
+        sizes[index[src]][index[dst]] = 1
+    if pair:
+        sizes[n][index[input_node]] = 1
+        sizes[index[output_node]][n + 1] = 1
+
+    predecessors = [set() for _ in sizes]
+    for src, edges in enumerate(sizes):
+        for dst in edges:
+            if dst != src:
+                predecessors[dst].add(src)
+
+    determinant = 0
+    for _ in checked(range(n)):
+        node = min((node for node in range(n) if sizes[node] is not None),
+                   key=lambda node: len(predecessors[node]) * (
+                       len(sizes[node]) - (node in sizes[node])))
+
+        pivot = sizes[node].pop(node, 0) + 1
+        determinant += pivot
+        for predecessor in predecessors[node]:
+            gain = sizes[predecessor].pop(node) + pivot
+            for successor, size in sizes[node].items():
+                sizes[predecessor][successor] = \
+                    sizes[predecessor].get(successor, 0) + gain + size
+                if sizes[predecessor][successor] > ELIMINATION_SIZE_LIMIT:
+                    return ELIMINATION_SIZE_LIMIT + 1
+                if successor != predecessor:
+                    predecessors[successor].add(predecessor)
+
+        for successor in sizes[node]:
+            predecessors[successor].discard(node)
+        sizes[node] = None
+
+    return sizes[n].get(n + 1, 0) if pair else determinant
+
+
+def plan_engine(estimate: Dict[str, Any], symbolic: bool = True) -> str:
+    """Picks the engine for a transfer function or loop gain request.
+
+    Args:
+        estimate: A cost estimate, as returned by estimate_cost.
+        symbolic: Optional; Whether a symbolic expression is needed. If False,
+            only numbers are needed, and the numeric engine is picked.
+
+    Returns:
+        The engine name; one of 'mason', 'elimination', or 'numeric'.
+
+    Raises:
+        BudgetExceeded: If a symbolic expression is needed, but both engines
+            are estimated to exceed their limits.
+    """
+    if not symbolic:
+        return 'numeric'
+
+    if not estimate['exceeded'] and estimate['terms'] <= MASON_TERM_LIMIT:
+        return 'mason'
+
+    if estimate['elimination_size'] <= ELIMINATION_SIZE_LIMIT:
+        return 'elimination'
+
+    raise BudgetExceeded('The expression is estimated to be too large for '
+                         'either symbolic engine.')
+
+
+def _edge_function(sfg: nx.DiGraph) -> Tuple[List[Tuple[Any, Any]], Any,
+                                              List[str]]:
+    """Compiles the edge weights of an SFG into one numpy function of s and
+    its symbols, or finds it in the cache.
+
+    Returns:
+        The (source, target) of each edge, the compiled function, which
+        returns the weight of each edge in that order, and the names of the
+        symbols it takes after s.
+    """
+    key = sfg_fingerprint(sfg)
+    edges = sorted(sfg.edges(data='weight'),
+                   key=lambda edge: (str(edge[0]), str(edge[1])))
+
+    with EDGE_FUNCTION_LOCK:
+        cached = EDGE_FUNCTIONS.get(key)
+        if cached is not None:
+            EDGE_FUNCTIONS.move_to_end(key)
+
+    if cached is not None:
+        function, names = cached
+    else:
+        # Compiled outside the lock, so that other threads can look up
+        # their own SFGs meanwhile.
+        s = sympy.Symbol('s')
+        weights = [sympy.sympify(weight) for _, _, weight in edges]
+        symbols = sorted(set().union(*(weight.free_symbols
+                                       for weight in weights)) - {s}, key=str)
+        function = sympy.lambdify([s] + symbols, weights, 'numpy')
+        names = [str(symbol) for symbol in symbols]
+
+        with EDGE_FUNCTION_LOCK:
+            EDGE_FUNCTIONS[key] = function, names
+            EDGE_FUNCTIONS.move_to_end(key)
+            if len(EDGE_FUNCTIONS) > EDGE_FUNCTION_LIMIT:
+                EDGE_FUNCTIONS.popitem(last=False)
+
+    return [(src, dst) for src, dst, _ in edges], function, names
+
+
+def gain_matrix(sfg: nx.DiGraph, s: np.ndarray,
+                parameters: Optional[Dict[str, float]] = None) -> np.ndarray:
+    """Evaluates the gain matrix of an SFG over a grid of complex frequencies.
+
+    The edge weights are compiled once per SFG structure, with the symbols
+    as arguments, so repeated evaluations with different parameter values
+    do not re-compile them.
+
+    Args:
+        sfg: An SFG with weighted edges.
+        s: A 1-D array of complex frequencies.
+        parameters: Optional; Maps symbol names to their numerical values. All
+            symbols other than 's' must be given a value.
+
+    Returns:
+        An array of shape (len(s), n, n), where n is the number of nodes. Entry
+        [k, j, i] is the gain of the edge from node i to node j at s[k], with
+        nodes indexed in the iteration order of the SFG.
+    """
+    parameters = parameters or {}
+    index = {node: i for i, node in enumerate(sfg)}
+    edges, function, names = _edge_function(sfg)
+
+    unknown = [name for name in names if name not in parameters]
+    if unknown:
+        raise ValueError('Missing values for symbols: ' + ', '.join(unknown))
+
+    # Constant weights evaluate to scalars and are broadcast over the
+    # frequency grid on assignment.
+    values = function(s, *(parameters[name] for name in names))
+
+    matrix = np.zeros((len(s), len(index), len(index)), dtype=complex)
+    for (src, dst), value in zip(edges, values):
+        matrix[:, index[dst], index[src]] = value
+
+    return matrix
+
+
+def numeric_transfer_function(sfg: nx.DiGraph, input_node: str,
+                              output_node: str, s: np.ndarray,
+                              parameters: Optional[Dict[str, float]] = None) \
+        -> np.ndarray:
+    """Evaluates the transfer function of an SFG over a frequency grid.
+
+    Instead of enumerating paths and loops, the node equations x = Ax + b are
+    solved directly for a unit excitation at the input node, in one batched
+    solve of (I - A)x = b over the whole grid. The cost grows polynomially with
+    the number of nodes, regardless of the number of feedback loops. Only the
+    nodes relevant to the pair of nodes are solved for.
+
+    Args:
+        sfg: An SFG with weighted edges.
+        input_node: The name of the input node.
+        output_node: The name of the output node.
+        s: A 1-D array of complex frequencies.
+        parameters: Optional; Maps symbol names to their numerical values.
+
+    Returns:
+        A complex array of transfer function values, one for each frequency.
+    """
+    s = np.atleast_1d(np.asarray(s, dtype=complex))
+
+    sfg = prune(sfg, input_node, output_node)
+    if output_node not in sfg:
+        return np.zeros(len(s), dtype=complex)
+
+    index = {node: i for i, node in enumerate(sfg)}
+    system = np.eye(len(index)) - gain_matrix(sfg, s, parameters)
+
+    excitation = np.zeros((len(s), len(index), 1), dtype=complex)
+    excitation[:, index[input_node], 0] = 1
+
+    return np.linalg.solve(system, excitation)[:, index[output_node], 0]
+
+
+def numeric_transfer_matrix(sfg: nx.DiGraph, input_nodes: List[str],
+                            output_nodes: List[str], s: np.ndarray,
+                            parameters: Optional[Dict[str, float]] = None) \
+        -> np.ndarray:
+    """Evaluates the transfer functions between every pair of input and
+    output nodes over a frequency grid.
+
+    (I - A) is factorised once per frequency, with a unit excitation at each
+    input node as a right-hand side of the same batched solve.
+
+    Args:
+        sfg: An SFG with weighted edges.
+        input_nodes: The names of the input nodes.
+        output_nodes: The names of the output nodes.
+        s: A 1-D array of complex frequencies.
+        parameters: Optional; Maps symbol names to their numerical values.
+
+    Returns:
+        A complex array of shape (len(s), len(output_nodes), len(input_nodes)),
+        whose entry [k, j, i] is the transfer function from input_nodes[i] to
+        output_nodes[j] at s[k].
+    """
+    s = np.atleast_1d(np.asarray(s, dtype=complex))
+    result = np.zeros((len(s), len(output_nodes), len(input_nodes)),
+                      dtype=complex)
+
+    relevant = transfer_matrix_nodes(sfg, input_nodes, output_nodes)
+    if not relevant:
+        return result
+
+    sfg = sfg.subgraph(relevant)
+    index = {node: i for i, node in enumerate(sfg)}
+    system = np.eye(len(index)) - gain_matrix(sfg, s, parameters)
+
+    excitation = np.zeros((len(s), len(index), len(input_nodes)),
+                          dtype=complex)
+    for i, input_node in enumerate(input_nodes):
+        if input_node in index:
+            excitation[:, index[input_node], i] = 1
+
+    solution = np.linalg.solve(system, excitation)
+    for j, output_node in enumerate(output_nodes):
+        if output_node in index:
+            result[:, j, :] = solution[:, index[output_node], :]
+
+    return result
+
+
+def numeric_loop_gain(sfg: nx.DiGraph, s: np.ndarray,
+                      parameters: Optional[Dict[str, float]] = None) \
+        -> np.ndarray:
+    """Evaluates the loop gain of an SFG over a frequency grid.
+
+    The graph determinant equals det(I - A), so the loop gain is found without
+    enumerating cycles.
+
+    Args:
+        sfg: An SFG with weighted edges.
+        s: A 1-D array of complex frequencies.
+        parameters: Optional; Maps symbol names to their numerical values.
+
+    Returns:
+        A complex array of loop gain values, one for each frequency.
     """
-    # Find all simple cycles.
-    cycles = [OrderedDict.fromkeys(nodes) for nodes in simple_cycles(sfg)]
-
-    # Find all combinations of non-touching cycles, sorted by combination size.
-    cycle_combinations = list(disjoint_combinations(
-        cycles, key=lambda cycle: cycle.keys()))
-    cycle_combinations.sort(key=len)
-
-    # Find overall determinant.
-    determ = determinant(sfg, cycle_combinations)
-    print(cycles)
-    print(cycle_combinations)
-    print(sfg)
-    print("lg!!")
-    loop_gain = 1 - determ
-    print(loop_gain)
-    return loop_gain
+    s = np.atleast_1d(np.asarray(s, dtype=complex))
+    system = np.eye(len(sfg)) - gain_matrix(sfg, s, parameters)
+    return 1 - np.linalg.det(system)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,622 @@
+from typing import List, Set, Tuple, Dict, Optional, Iterable
+import hashlib
+
+import numpy as np
+import sympy
+
+
+# The complex frequency variable of every transfer function.
+S = sympy.Symbol('s')
+
+
+def _strip(coefficients: List[sympy.Expr]) -> List[sympy.Expr]:
+    """Removes the zero coefficients of the highest powers of s."""
+    coefficients = list(coefficients)
+    while len(coefficients) > 1 and coefficients[-1] == 0:
+        coefficients.pop()
+    return coefficients or [sympy.S.Zero]
+
+
+def polynomial_coefficients(expr: sympy.Expr) -> List[sympy.Expr]:
+    """Collects a polynomial in s by powers of s.
+
+    Coefficients are combined by convolution without being expanded, so a
+    product of loop determinants keeps the size of its factors instead of
+    multiplying out into every combination of circuit symbols.
+
+    Args:
+        expr: A polynomial in s, whose coefficients may be any expression
+            not involving s.
+
+    Returns:
+        The coefficients, in ascending powers of s.
+
+    Raises:
+        ValueError: If the expression is not a polynomial in s.
+    """
+    if not expr.has(S):
+        return [expr]
+
+    if expr == S:
+        return [sympy.S.Zero, sympy.S.One]
+
+    if expr.is_Add:
+        coefficients = [sympy.S.Zero]
+        for term in expr.args:
+            coefficients = _add(coefficients, polynomial_coefficients(term))
+        return _strip(coefficients)
+
+    if expr.is_Mul:
+        coefficients = [sympy.S.One]
+        for factor in expr.args:
+            coefficients = _multiply(coefficients,
+                                     polynomial_coefficients(factor))
+        return _strip(coefficients)
+
+    if expr.is_Pow and expr.exp.is_Integer and expr.exp > 0:
+        base = polynomial_coefficients(expr.base)
+        coefficients = [sympy.S.One]
+        for _ in range(int(expr.exp)):
+            coefficients = _multiply(coefficients, base)
+        return _strip(coefficients)
+
+    raise ValueError('Invalid polynomial.')
+
+
+def _add(a: List[sympy.Expr], b: List[sympy.Expr]) -> List[sympy.Expr]:
+    if len(a) < len(b):
+        a, b = b, a
+    return [x + b[k] if k < len(b) else x for k, x in enumerate(a)]
+
+
+def _multiply(a: List[sympy.Expr], b: List[sympy.Expr]) -> List[sympy.Expr]:
+    return [
+        sympy.Add.fromiter(a[i] * b[k - i]
+                           for i in range(max(0, k - len(b) + 1),
+                                          min(k, len(a) - 1) + 1))
+        for k in range(len(a) + len(b) - 1)
+    ]
+
+
+class RationalFunction:
+    """A ratio of two polynomials in s with symbolic coefficients.
+
+    This is the canonical form of a transfer function: every coefficient is
+    collected by its power of s, and common powers of s are cancelled. Unlike
+    an arbitrary sympy expression, it can be displayed, evaluated, and have
+    its roots found without being refactored.
+
+    Args:
+        numerator: The coefficients of the numerator, in ascending powers of
+            s.
+        denominator: The coefficients of the denominator, in ascending powers
+            of s.
+
+    Attributes:
+        numerator: The coefficients of the numerator, in ascending powers of
+            s.
+        denominator: The coefficients of the denominator, in ascending powers
+            of s.
+    """
+
+    def __init__(self, numerator: Iterable[sympy.Expr],
+                 denominator: Iterable[sympy.Expr]):
+        numerator = _strip([sympy.sympify(c) for c in numerator])
+        denominator = _strip([sympy.sympify(c) for c in denominator])
+
+        if denominator == [0]:
+            raise ValueError('Invalid denominator.')
+
+        # Cancel the lowest power of s common to both polynomials.
+        if numerator != [0]:
+            shift = 0
+            while numerator[shift] == 0 and denominator[shift] == 0:
+                shift += 1
+            numerator = numerator[shift:]
+            denominator = denominator[shift:]
+
+        self.numerator = numerator
+        self.denominator = denominator
+        self._compiled = None
+        self._digest = None
+
+    @classmethod
+    def from_expr(cls, expr: sympy.Expr) -> 'RationalFunction':
+        """Converts a rational expression in s to its canonical form.
+
+        Args:
+            expr: A rational function of s.
+
+        Returns:
+            The canonical form of the expression.
+        """
+        numer, denom = sympy.fraction(sympy.together(sympy.sympify(expr)))
+        return cls(polynomial_coefficients(numer),
+                   polynomial_coefficients(denom))
+
+    def __getstate__(self):
+        # Compiled coefficient functions are rebuilt on demand.
+        return {'numerator': self.numerator, 'denominator': self.denominator,
+                '_digest': self._digest}
+
+    def __setstate__(self, state):
+        self._digest = None
+        self.__dict__.update(state)
+        self._compiled = None
+
+    def __eq__(self, other):
+        return isinstance(other, RationalFunction) \
+            and self.numerator == other.numerator \
+            and self.denominator == other.denominator
+
+    def __repr__(self):
+        return f'RationalFunction({self.numerator}, {self.denominator})'
+
+    def digest(self) -> str:
+        """Finds a stable hash of the coefficients.
+
+        Unlike hash(), the result is the same in every process. It is
+        computed once, and kept when the function is pickled.
+
+        Returns:
+            A hexadecimal SHA-256 digest of the coefficients.
+        """
+        if self._digest is None:
+            text = sympy.srepr([self.numerator, self.denominator])
+            self._digest = hashlib.sha256(text.encode()).hexdigest()
+        return self._digest
+
+    def free_symbols(self) -> Set[sympy.Symbol]:
+        """Returns the symbols of the coefficients."""
+        return set().union(*(c.free_symbols
+                             for c in self.numerator + self.denominator))
+
+    def as_expr(self, factor: bool = False) -> sympy.Expr:
+        """Converts the rational function back to a sympy expression.
+
+        Args:
+            factor: If True, pulls common factors out of each coefficient.
+                Defaults to False.
+        """
+        return _polynomial_expr(self.numerator, factor) / \
+            _polynomial_expr(self.denominator, factor)
+
+    def latex(self, factor: bool = False) -> str:
+        """Formats the rational function in latex, in descending powers of s.
+
+        Args:
+            factor: If True, pulls common factors out of each coefficient.
+                Defaults to False.
+        """
+        return r'\frac{%s}{%s}' % (_polynomial_latex(self.numerator, factor),
+                                   _polynomial_latex(self.denominator, factor))
+
+    def to_string(self, factor: bool = False) -> str:
+        """Formats the rational function as plain text, in descending powers
+        of s.
+
+        Args:
+            factor: If True, pulls common factors out of each coefficient.
+                Defaults to False.
+        """
+        return '(%s)/(%s)' % (_polynomial_str(self.numerator, factor),
+                              _polynomial_str(self.denominator, factor))
+
+    def __str__(self):
+        return self.to_string()
+
+    def coefficients(self, parameters: Optional[Dict[str, float]] = None) \
+            -> Tuple[np.ndarray, np.ndarray]:
+        """Evaluates the coefficients for the given parameter values.
+
+        The coefficients are compiled into a single numpy function of the
+        parameters once, and re-used for any later parameter values.
+
+        Args:
+            parameters: Optional; Maps symbol names to their numerical values.
+                Every symbol of the coefficients must be given a value.
+
+        Returns:
+            A (numerator, denominator) tuple of complex coefficient arrays, in
+            ascending powers of s along the first axis. If parameter values
+            are arrays, the remaining axes are their broadcast shape.
+
+        Raises:
+            ValueError: If a symbol is not given a value.
+        """
+        parameters = parameters or {}
+
+        if self._compiled is None:
+            names = sorted(str(x) for x in self.free_symbols())
+            self._compiled = names, sympy.lambdify(
+                [sympy.Symbol(name) for name in names],
+                [self.numerator, self.denominator], 'numpy')
+
+        names, function = self._compiled
+        missing = [name for name in names if name not in parameters]
+        if missing:
+            raise ValueError('Missing values for symbols: ' +
+                             ', '.join(missing))
+
+        numerator, denominator = function(*(parameters[n] for n in names))
+        return _stack(numerator), _stack(denominator)
+
+    def substitute(self, parameters: Dict[str, float]) -> 'RationalFunction':
+        """Substitutes numerical values for all symbols except s.
+
+        Args:
+            parameters: Maps symbol names to their numerical values.
+
+        Returns:
+            A rational function with numerical coefficients.
+        """
+        numerator, denominator = self.coefficients(parameters)
+        return RationalFunction(map(_number, numerator),
+                                map(_number, denominator))
+
+    def evaluate(self, s: np.ndarray,
+                 parameters: Optional[Dict[str, float]] = None) -> np.ndarray:
+        """Evaluates the rational function over an array of frequencies.
+
+        Args:
+            s: An array of complex frequencies.
+            parameters: Optional; Maps symbol names to their numerical values.
+
+        Returns:
+            A complex array of function values.
+        """
+        numerator, denominator = self.coefficients(parameters)
+        s = np.asarray(s, dtype=complex)
+        return np.polynomial.polynomial.polyval(s, numerator) / \
+            np.polynomial.polynomial.polyval(s, denominator)
+
+    def zeros(self, parameters: Optional[Dict[str, float]] = None) \
+            -> np.ndarray:
+        """Finds the zeros for the given parameter values.
+
+        Returns:
+            A complex array of zeros, in rad/s, in increasing magnitude.
+        """
+        return polynomial_roots(self.coefficients(parameters)[0])
+
+    def poles(self, parameters: Optional[Dict[str, float]] = None) \
+            -> np.ndarray:
+        """Finds the poles for the given parameter values.
+
+        Returns:
+            A complex array of poles, in rad/s, in increasing magnitude.
+        """
+        return polynomial_roots(self.coefficients(parameters)[1])
+
+    def dc_gain(self, parameters: Optional[Dict[str, float]] = None) \
+            -> complex:
+        """Finds the gain at s = 0 for the given parameter values.
+
+        Returns:
+            The DC gain, which is infinite if there is a pole at the origin.
+        """
+        numerator, denominator = self.coefficients(parameters)
+        if denominator[0] == 0:
+            return complex(np.inf)
+        return numerator[0] / denominator[0]
+
+    def bandwidth(self, parameters: Optional[Dict[str, float]] = None,
+                  drop: float = 3.0) -> Dict[str, np.ndarray]:
+        """Finds the bandwidth for the given parameter values.
+
+        See bandwidth for details. Parameter values may be arrays, to find
+        the bandwidth for every combination of values at once.
+
+        Args:
+            parameters: Optional; Maps symbol names to their numerical values.
+            drop: The drop in gain from the peak at the corners, in decibels.
+                Defaults to 3.
+
+        Returns:
+            The corners and bandwidth, as returned by bandwidth.
+        """
+        return bandwidth(*self.coefficients(parameters), drop)
+
+    def dominant_pole_estimate(
+            self, parameters: Optional[Dict[str, float]] = None) \
+            -> Optional[complex]:
+        """Estimates the dominant pole from the two lowest-order denominator
+        coefficients, assuming it is far below every other pole.
+
+        Returns:
+            The estimated pole, in rad/s, or None if the denominator has no
+            s term.
+        """
+        denominator = self.coefficients(parameters)[1]
+        if len(denominator) < 2 or denominator[1] == 0:
+            return None
+        return -denominator[0] / denominator[1]
+
+
+def polynomial_roots(coefficients: np.ndarray) -> np.ndarray:
+    """Finds the roots of a polynomial with numeric coefficients.
+
+    Coefficients of circuit polynomials span many orders of magnitude, so s
+    is first scaled by the geometric mean magnitude of the non-zero roots,
+    which keeps the companion matrix well conditioned.
+
+    Args:
+        coefficients: The coefficients, in ascending powers of s.
+
+    Returns:
+        A complex array of roots, in increasing magnitude.
+    """
+    coefficients = np.trim_zeros(np.asarray(coefficients, dtype=complex), 'b')
+    if not coefficients.imag.any():
+        # Real coefficients give exact conjugate pairs.
+        coefficients = coefficients.real
+
+    # Roots at the origin.
+    origin = np.argmax(coefficients != 0) if coefficients.any() else 0
+    coefficients = coefficients[origin:]
+    degree = len(coefficients) - 1
+
+    if degree < 1:
+        return np.zeros(origin, dtype=complex)
+
+    scale = abs(coefficients[0] / coefficients[-1]) ** (1 / degree)
+    scaled = coefficients * scale ** np.arange(degree + 1)
+
+    roots = np.concatenate([np.zeros(origin, dtype=complex),
+                            np.roots(scaled[::-1]).astype(complex) * scale])
+    return roots[np.argsort(np.abs(roots), kind='stable')]
+
+
+def _stack(coefficients: List) -> np.ndarray:
+    """Stacks coefficients that may be scalars or arrays along a new first
+    axis."""
+    return np.asarray(np.broadcast_arrays(*coefficients), dtype=complex)
+
+
+def _convolve(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    """Multiplies polynomials along the first axis of coefficient arrays."""
+    product = np.zeros((len(a) + len(b) - 1,) + np.broadcast_shapes(
+        a.shape[1:], b.shape[1:]), dtype=np.result_type(a, b))
+    for i in range(len(a)):
+        product[i:i + len(b)] += a[i] * b
+    return product
+
+
+def power_spectrum(coefficients: np.ndarray) -> np.ndarray:
+    """Finds the squared magnitude of a polynomial with real coefficients
+        on the imaginary axis.
+
+    Args:
+        coefficients: The coefficients of P(s), in ascending powers of s
+            along the first axis.
+
+    Returns:
+        The coefficients of |P(jw)|^2 as a polynomial in u = w^2, in
+        ascending powers of u along the first axis.
+    """
+    coefficients = np.asarray(coefficients).real
+    signs = (-1.0) ** np.arange(len(coefficients))
+    mirrored = coefficients * signs.reshape((-1,) + (1,) *
+                                            (coefficients.ndim - 1))
+
+    # P(s) P(-s) is even in s, and s^2 = -u on the imaginary axis.
+    even = _convolve(coefficients, mirrored)[::2]
+    return even * ((-1.0) ** np.arange(len(even))).reshape(
+        (-1,) + (1,) * (even.ndim - 1))
+
+
+def _batch_roots(coefficients: np.ndarray) -> np.ndarray:
+    """Finds the non-zero roots of a batch of polynomials with real
+        coefficients.
+
+    The roots are the eigenvalues of companion matrices, scaled as in
+    polynomial_roots, and found in one batched call for each degree.
+
+    Args:
+        coefficients: The coefficients, in ascending powers of s along the
+            first axis, and one polynomial along the second.
+
+    Returns:
+        A complex array with a row of roots for each polynomial, padded with
+        NaN. Polynomials with non-finite coefficients have no roots.
+    """
+    coefficients = np.asarray(coefficients, dtype=float)
+    length, count = coefficients.shape
+    nonzero = (coefficients != 0) & \
+        np.isfinite(coefficients).all(axis=0)
+    # Drop roots at the origin and trailing zeros.
+    origin = np.argmax(nonzero, axis=0)
+    degree = np.where(nonzero.any(axis=0),
+                      length - 1 - np.argmax(nonzero[::-1], axis=0) - origin,
+                      0)
+
+    roots = np.full((count, max(length - 1, 0)), np.nan, dtype=complex)
+    for d in np.unique(degree[degree > 0]):
+        columns = np.flatnonzero(degree == d)
+        c = coefficients[origin[columns] + np.arange(d + 1)[:, None],
+                         columns]
+
+        scale = np.abs(c[0] / c[-1]) ** (1 / d)
+        monic = c[:-1] * scale ** np.arange(d)[:, None] / \
+            (c[-1] * scale ** d)
+
+        companion = np.zeros((len(columns), d, d))
+        companion[:, np.arange(1, d), np.arange(d - 1)] = 1
+        companion[:, :, -1] = -monic.T
+        roots[columns, :d] = np.linalg.eigvals(companion) * scale[:, None]
+    return roots
+
+
+def _positive_real_roots(coefficients: np.ndarray) -> np.ndarray:
+    """Finds the positive real roots of a batch of polynomials, in rows
+    sorted in increasing order and padded with NaN. See _batch_roots."""
+    roots = _batch_roots(coefficients)
+    real = np.where(
+        (np.abs(roots.imag) <= 1e-7 * np.abs(roots)) & (roots.real > 0),
+        roots.real, np.nan)
+    return np.sort(real, axis=1)
+
+
+def bandwidth(numerator: np.ndarray, denominator: np.ndarray,
+              drop: float = 3.0) -> Dict[str, np.ndarray]:
+    """Finds the corners and bandwidth of a rational function analytically.
+
+    The peak gain is found at u = w^2 = 0, at infinity, or at a root of the
+    derivative of |N(jw)|^2 / |D(jw)|^2. The corners are the roots of
+    |N(jw)|^2 - k |D(jw)|^2, where k is the squared peak gain less the drop,
+    nearest to either side of the peak. Band-pass functions have both
+    corners, and their bandwidth is the difference; low-pass functions have
+    only an upper corner, which is their bandwidth.
+
+    Every element of a batch is solved at once: the roots are found for all
+    elements together by _batch_roots.
+
+    Args:
+        numerator: The real coefficients of the numerator, in ascending
+            powers of s along the first axis. Any further axes are batch
+            axes, one result is found for each element.
+        denominator: The real coefficients of the denominator, in the same
+            form.
+        drop: The drop in gain from the peak at the corners, in decibels.
+            Defaults to 3.
+
+    Returns:
+        A dictionary of arrays over the batch axes: the 'lower' and 'upper'
+        corners and the 'bandwidth' in hertz, the 'peak_gain' in decibels,
+        and the 'peak_frequency' in hertz. Corners are NaN if they do not
+        exist, as is the bandwidth if there is no upper corner. Everything
+        is NaN if the gain is unbounded.
+    """
+    numerator = np.asarray(numerator).real
+    denominator = np.asarray(denominator).real
+    shape = np.broadcast_shapes(numerator.shape[1:], denominator.shape[1:])
+    numerator, denominator = (
+        np.broadcast_to(x.reshape(x.shape[:1] + (1,) * (len(shape) + 1 -
+                                                        x.ndim) + x.shape[1:]),
+                        x.shape[:1] + shape)
+        for x in (numerator, denominator))
+
+    spectra = power_spectrum(numerator), power_spectrum(denominator)
+    length = max(len(x) for x in spectra)
+    a, b = (np.pad(x.reshape(len(x), -1), ((0, length - len(x)), (0, 0)))
+            for x in spectra)
+
+    def degree(x):
+        return np.where(x.any(axis=0),
+                        len(x) - 1 - np.argmax(x[::-1] != 0, axis=0), -1)
+
+    def gain(u):
+        return np.polynomial.polynomial.polyval(u, a, tensor=False) / \
+            np.polynomial.polynomial.polyval(u, b, tensor=False)
+
+    # Zero, or unbounded at DC or at infinity.
+    a_degree, b_degree = degree(a), degree(b)
+    valid = (a_degree >= 0) & (b[0] != 0) & (a_degree <= b_degree)
+    a = np.where(valid, a, 0)
+    b = np.where(valid, b, 1)
+
+    # Candidates for the peak, in increasing u: DC, the stationary points
+    # and infinity. Ties go to the highest frequency.
+    stationary = _positive_real_roots(
+        _convolve(np.polynomial.polynomial.polyder(a), b) -
+        _convolve(a, np.polynomial.polynomial.polyder(b)))
+    columns = np.arange(a.shape[1])
+    at_infinity = np.where(a_degree == b_degree,
+                           a[b_degree, columns] / b[b_degree, columns],
+                           -np.inf)
+    u = np.column_stack([np.zeros(len(columns)), stationary,
+                         np.full(len(columns), np.inf)])
+    candidates = np.column_stack([
+        a[0] / b[0],
+        np.where(np.isnan(stationary), -np.inf,
+                 gain(np.nan_to_num(stationary).T).T),
+        at_infinity])
+    best = candidates.shape[1] - 1 - np.argmax(candidates[:, ::-1], axis=1)
+    peak = candidates[columns, best]
+    peak_u = u[columns, best]
+    valid &= peak > 0
+
+    level = np.where(valid, peak, 1) * 10 ** (-drop / 10)
+    corners = _positive_real_roots(np.where(valid, a - level * b, np.nan))
+
+    lower = np.max(corners, axis=1, initial=-np.inf,
+                   where=corners < peak_u[:, None])
+    upper = np.min(corners, axis=1, initial=np.inf,
+                   where=corners > peak_u[:, None])
+    lower = np.where(np.isfinite(lower), np.sqrt(np.abs(lower)), np.nan) / \
+        (2 * np.pi)
+    upper = np.where(np.isfinite(upper), np.sqrt(np.abs(upper)), np.nan) / \
+        (2 * np.pi)
+
+    result = {
+        'lower': lower,
+        'upper': upper,
+        'bandwidth': upper - np.nan_to_num(lower),
+        'peak_gain': 10 * np.log10(np.where(valid, peak, np.nan)),
+        'peak_frequency': np.sqrt(np.where(valid, peak_u, np.nan)) /
+        (2 * np.pi)
+    }
+    return {name: np.where(valid, value, np.nan).reshape(shape)
+            for name, value in result.items()}
+
+
+def _number(value: complex) -> sympy.Expr:
+    """Converts a numpy coefficient to a sympy number, dropping a zero
+    imaginary part."""
+    if value == 0:
+        return sympy.S.Zero
+    if value.imag == 0:
+        return sympy.Float(value.real)
+    return sympy.sympify(complex(value))
+
+
+def _coefficient(c: sympy.Expr, factor: bool) -> sympy.Expr:
+    return sympy.factor_terms(c) if factor else c
+
+
+def _polynomial_expr(coefficients: List[sympy.Expr], factor: bool) \
+        -> sympy.Expr:
+    return sympy.Add.fromiter(_coefficient(c, factor) * S ** k
+                              for k, c in enumerate(coefficients))
+
+
+def _polynomial_terms(coefficients: List[sympy.Expr], factor: bool,
+                      printer, power, sep: str) -> List[str]:
+    terms = []
+    for k in reversed(range(len(coefficients))):
+        c = _coefficient(coefficients[k], factor)
+        if c == 0:
+            continue
+        if k == 0:
+            terms.append(printer(c))
+        elif c == 1:
+            terms.append(power(k))
+        elif c == -1:
+            terms.append('-' + power(k))
+        elif isinstance(c, sympy.Add):
+            terms.append('(%s)%s%s' % (printer(c), sep, power(k)))
+        else:
+            terms.append('%s%s%s' % (printer(c), sep, power(k)))
+
+    if not terms:
+        return ['0']
+    return terms
+
+
+def _join(terms: List[str]) -> str:
+    result = terms[0]
+    for term in terms[1:]:
+        result += ' - ' + term[1:] if term.startswith('-') else ' + ' + term
+    return result
+
+
+def _polynomial_latex(coefficients: List[sympy.Expr], factor: bool) -> str:
+    return _join(_polynomial_terms(
+        coefficients, factor, sympy.latex,
+        lambda k: 's' if k == 1 else 's^{%d}' % k, ' '))
+
+
+def _polynomial_str(coefficients: List[sympy.Expr], factor: bool) -> str:
+    return _join(_polynomial_terms(
+        coefficients, factor, str,
+        lambda k: 's' if k == 1 else 's**%d' % k, '*'))
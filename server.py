@@ -12,15 +12,77 @@ from distutils.util import strtobool
 import tempfile
 import dill
 import json
+import math
 import sympy
 
 import db
+import mason
 
 
 app = Flask(__name__)
 # app.config['DEBUG'] = False
 CORS(app)
 
+# Default wall-clock budget, in seconds, of a symbolic evaluation.
+SYMBOLIC_BUDGET_SECONDS = 30.0
+
+
+def request_budget():
+    """Builds the budget of a symbolic evaluation from the query arguments."""
+    return mason.Budget(
+        seconds=request.args.get(
+            "budget_seconds", default=SYMBOLIC_BUDGET_SECONDS, type=float
+        ),
+        terms=request.args.get("budget_terms", default=None, type=int),
+    )
+
+
+def request_parameters(circuit):
+    """Parses the parameter overrides of an evaluation from the query
+    arguments, given as a JSON object of parameter names and values.
+
+    Raises:
+        ValueError: If the argument is not a JSON object, a value is not a
+            finite number, or a name is not a parameter of the circuit.
+    """
+    # Parsed here rather than by request.args.get(type=...), which would
+    # silently fall back to the default on invalid JSON.
+    text = request.args.get("parameters")
+    if text is None:
+        return None
+
+    try:
+        parameters = json.loads(text)
+    except ValueError:
+        raise ValueError("Invalid parameters: not valid JSON.")
+
+    if not isinstance(parameters, dict):
+        raise ValueError("Invalid parameters: not a JSON object.")
+
+    for name, value in parameters.items():
+        if name == "f" or name not in circuit.parameters:
+            raise ValueError(f"Invalid parameters: unknown parameter {name}.")
+        if isinstance(value, bool) or not isinstance(value, (int, float)) \
+                or not math.isfinite(value):
+            raise ValueError(f"Invalid parameters: {name} is not a finite "
+                             "number.")
+
+    return parameters
+
+
+def request_sweep():
+    """Parses the scale, number of points and explicit values of a parameter
+    sweep from the query arguments."""
+    return {
+        "scale": request.args.get("scale", default="linear"),
+        "points": request.args.get("points", default=None, type=int),
+        "values": request.args.get(
+            "values",
+            default=None,
+            type=lambda s: [float(v) for v in s.split(",")],
+        ),
+    }
+
 
 @app.route("/favicon.ico")
 def favicon():
@@ -477,6 +539,7 @@ def get_transfer_function(circuit_id):
     numerical = request.args.get(
         "numerical", default=False, type=lambda s: bool(strtobool(s))
     )
+    engine = request.args.get("engine", default="auto")
 
     try:
         transfer_function = circuit.compute_transfer_function(
@@ -485,16 +548,27 @@ def get_transfer_function(circuit_id):
             latex=latex,
             factor=factor,
             numerical=numerical,
-            cache_result=False,
+            cache_result=True,
+            engine=engine,
+            budget=request_budget(),
+        )
+        # Cached results report the engine that derived them, without an
+        # estimate.
+        plan = circuit.engine_plan
+
+    except mason.BudgetExceeded as e:
+        abort(
+            422,
+            description=f"{e} The transfer function is too large to derive "
+            "symbolically; use the numeric engine (transfer_function/bode).",
         )
-
     except Exception as e:
         abort(400, description=str(e))
 
     circuit.save()
 
     # Return the loop gain as a JSON response with appropriate Cache-Control header
-    response = jsonify({"transfer_function": transfer_function})
+    response = jsonify({"transfer_function": transfer_function, **plan})
 
     # Disable caching for the response
     response.headers["Cache-Control"] = (
@@ -541,12 +615,16 @@ def get_transfer_function_bode(circuit_id):
             gain_unit,
             phase_unit,
             cache_result=False,
+            parameters=request_parameters(circuit),
+            adaptive=request.args.get(
+                "adaptive", default=False, type=lambda s: bool(strtobool(s))
+            ),
         )
 
     except Exception as e:
         abort(400, description=str(e))
 
-    circuit.save()
+    # Evaluations never modify the circuit, so it is not saved.
 
     # print response
     print("freq: " + str(freq))
@@ -576,12 +654,27 @@ def get_loop_gain(circuit_id):
     numerical = request.args.get(
         "numerical", default=False, type=lambda s: bool(strtobool(s))
     )
+    engine = request.args.get("engine", default="auto")
 
     try:
         loop_gain = circuit.compute_loop_gain(
-            latex=latex, factor=factor, numerical=numerical, cache_result=False
+            latex=latex,
+            factor=factor,
+            numerical=numerical,
+            cache_result=True,
+            engine=engine,
+            budget=request_budget(),
+        )
+        # Cached results report the engine that derived them, without an
+        # estimate.
+        plan = circuit.engine_plan
+
+    except mason.BudgetExceeded as e:
+        abort(
+            422,
+            description=f"{e} The loop gain is too large to derive "
+            "symbolically; use the numeric engine (loop_gain/bode).",
         )
-
     except Exception as e:
         abort(400, description=str(e))
 
@@ -592,7 +685,7 @@ def get_loop_gain(circuit_id):
     # # return {'loop_gain': loop_gain}
 
     # Return the loop gain as a JSON response with appropriate Cache-Control header
-    response = jsonify({"loop_gain": loop_gain})
+    response = jsonify({"loop_gain": loop_gain, **plan})
     # response.headers['Cache-Control'] = 'no-store'  # Prevent caching
 
     # Disable caching for the response
@@ -634,12 +727,16 @@ def get_loop_gain_bode(circuit_id):
             gain_unit,
             phase_unit,
             cache_result=False,
+            parameters=request_parameters(circuit),
+            adaptive=request.args.get(
+                "adaptive", default=False, type=lambda s: bool(strtobool(s))
+            ),
         )
 
     except Exception as e:
         abort(400, description=str(e))
 
-    circuit.save()
+    # Evaluations never modify the circuit, so it is not saved.
 
     # print response
     print("freq: " + str(freq))
@@ -657,6 +754,388 @@ def get_loop_gain_bode(circuit_id):
     return response
 
 
+@app.route("/circuits/<circuit_id>/transfer_function/poles_zeros", methods=["GET"])
+def get_transfer_function_poles_zeros(circuit_id):
+    circuit = db.Circuit.objects(id=circuit_id).first()
+
+    if not circuit:
+        abort(404, description="Circuit not found")
+
+    input_node = request.args.get("input_node")
+    output_node = request.args.get("output_node")
+    engine = request.args.get("engine", default="auto")
+
+    try:
+        poles_zeros = circuit.compute_transfer_function_poles_zeros(
+            input_node,
+            output_node,
+            engine=engine,
+            budget=request_budget(),
+        )
+
+    except mason.BudgetExceeded as e:
+        abort(
+            422,
+            description=f"{e} The transfer function is too large to derive "
+            "symbolically; use the numeric engine (transfer_function/bode).",
+        )
+    except Exception as e:
+        abort(400, description=str(e))
+
+    response = jsonify(poles_zeros)
+
+    response.headers["Cache-Control"] = "no-cache, no-store, must-revalidate"
+    response.headers["Pragma"] = "no-cache"
+    response.headers["Expires"] = "0"
+
+    return response
+
+
+@app.route("/circuits/<circuit_id>/transfer_function/bandwidth", methods=["GET"])
+def get_transfer_function_bandwidth(circuit_id):
+    circuit = db.Circuit.objects(id=circuit_id).first()
+
+    if not circuit:
+        abort(404, description="Circuit not found")
+
+    input_node = request.args.get("input_node")
+    output_node = request.args.get("output_node")
+    drop = request.args.get("drop_db", default=3.0, type=float)
+    engine = request.args.get("engine", default="auto")
+
+    try:
+        bandwidth = circuit.compute_bandwidth(
+            input_node,
+            output_node,
+            drop,
+            parameters=request_parameters(circuit),
+            engine=engine,
+            budget=request_budget(),
+        )
+
+    except mason.BudgetExceeded as e:
+        abort(
+            422,
+            description=f"{e} The transfer function is too large to derive "
+            "symbolically; use the numeric engine (transfer_function/bode).",
+        )
+    except Exception as e:
+        abort(400, description=str(e))
+
+    # The symbolic result may have been cached on the circuit.
+    circuit.save()
+
+    response = jsonify(bandwidth)
+
+    response.headers["Cache-Control"] = "no-cache, no-store, must-revalidate"
+    response.headers["Pragma"] = "no-cache"
+    response.headers["Expires"] = "0"
+
+    return response
+
+
+@app.route("/circuits/<circuit_id>/loop_gain/poles_zeros", methods=["GET"])
+def get_loop_gain_poles_zeros(circuit_id):
+    circuit = db.Circuit.objects(id=circuit_id).first()
+
+    if not circuit:
+        abort(404, description="Circuit not found")
+
+    engine = request.args.get("engine", default="auto")
+
+    try:
+        poles_zeros = circuit.compute_loop_gain_poles_zeros(
+            engine=engine,
+            budget=request_budget(),
+        )
+
+    except mason.BudgetExceeded as e:
+        abort(
+            422,
+            description=f"{e} The loop gain is too large to derive "
+            "symbolically; use the numeric engine (loop_gain/bode).",
+        )
+    except Exception as e:
+        abort(400, description=str(e))
+
+    response = jsonify(poles_zeros)
+
+    response.headers["Cache-Control"] = "no-cache, no-store, must-revalidate"
+    response.headers["Pragma"] = "no-cache"
+    response.headers["Expires"] = "0"
+
+    return response
+
+
+@app.route("/circuits/<circuit_id>/stability_margins", methods=["GET"])
+def get_stability_margins(circuit_id):
+    circuit = db.Circuit.objects(id=circuit_id).first()
+
+    if not circuit:
+        abort(404, description="Circuit not found")
+
+    input_node = request.args.get("input_node")
+    output_node = request.args.get("output_node")
+    start_freq = request.args.get("start_freq_hz", default=1e3, type=float)
+    end_freq = request.args.get("end_freq_hz", default=1e12, type=float)
+    engine = request.args.get("engine", default="auto")
+
+    try:
+        margins = circuit.compute_stability_margins(
+            input_node,
+            output_node,
+            start_freq,
+            end_freq,
+            parameters=request_parameters(circuit),
+            engine=engine,
+            budget=request_budget(),
+        )
+
+    except mason.BudgetExceeded as e:
+        abort(
+            422,
+            description=f"{e} The function is too large to derive "
+            "symbolically; use the numeric engine (loop_gain/bode).",
+        )
+    except Exception as e:
+        abort(400, description=str(e))
+
+    # The symbolic result may have been cached on the circuit.
+    circuit.save()
+
+    response = jsonify(margins)
+
+    response.headers["Cache-Control"] = "no-cache, no-store, must-revalidate"
+    response.headers["Pragma"] = "no-cache"
+    response.headers["Expires"] = "0"
+
+    return response
+
+
+@app.route("/circuits/<circuit_id>/design_target", methods=["GET"])
+def solve_design_target(circuit_id):
+    circuit = db.Circuit.objects(id=circuit_id).first()
+
+    if not circuit:
+        abort(404, description="Circuit not found")
+
+    input_node = request.args.get("input_node")
+    output_node = request.args.get("output_node")
+    selected_device = request.args.get("selected_device", type=str)
+    metric = request.args.get("metric", type=str)
+    target = request.args.get("target", type=float)
+    min_val = request.args.get("min_val", type=float)
+    max_val = request.args.get("max_val", type=float)
+    scale = request.args.get("scale", default="log")
+    drop = request.args.get("drop_db", default=3.0, type=float)
+    start_freq = request.args.get("start_freq_hz", default=1e3, type=float)
+    end_freq = request.args.get("end_freq_hz", default=1e12, type=float)
+    engine = request.args.get("engine", default="auto")
+
+    try:
+        if target is None or min_val is None or max_val is None:
+            raise ValueError("Invalid target or bounds.")
+
+        solution = circuit.solve_design_target(
+            selected_device,
+            metric,
+            target,
+            min_val,
+            max_val,
+            input_node,
+            output_node,
+            scale=scale,
+            drop=drop,
+            start_freq=start_freq,
+            end_freq=end_freq,
+            parameters=request_parameters(circuit),
+            engine=engine,
+            budget=request_budget(),
+        )
+
+    except mason.BudgetExceeded as e:
+        abort(
+            422,
+            description=f"{e} The function is too large to derive "
+            "symbolically; use the numeric engine.",
+        )
+    except Exception as e:
+        abort(400, description=str(e))
+
+    # The symbolic result may have been cached on the circuit.
+    circuit.save()
+
+    response = jsonify(solution)
+
+    response.headers["Cache-Control"] = "no-cache, no-store, must-revalidate"
+    response.headers["Pragma"] = "no-cache"
+    response.headers["Expires"] = "0"
+
+    return response
+
+
+@app.route("/circuits/<circuit_id>/sweep", methods=["GET"])
+def sweep_parameters(circuit_id):
+    circuit = db.Circuit.objects(id=circuit_id).first()
+
+    if not circuit:
+        abort(404, description="Circuit not found")
+
+    input_node = request.args.get("input_node")
+    output_node = request.args.get("output_node")
+    mode = request.args.get("mode", default="grid")
+    samples = request.args.get("samples", default=None, type=int)
+    scale = request.args.get("scale", default="linear")
+    seed = request.args.get("seed", default=None, type=int)
+    metrics = request.args.get(
+        "metrics",
+        default="phase_margin,gain_margin,bandwidth,dc_gain",
+    ).split(",")
+    drop = request.args.get("drop_db", default=3.0, type=float)
+    start_freq = request.args.get("start_freq_hz", default=1e3, type=float)
+    end_freq = request.args.get("end_freq_hz", default=1e12, type=float)
+    engine = request.args.get("engine", default="auto")
+
+    try:
+        spec = request.args.get("sweep", default=None, type=json.loads)
+        if not isinstance(spec, dict):
+            raise ValueError("Invalid sweep parameters.")
+
+        result = circuit.sweep_parameters(
+            spec,
+            input_node,
+            output_node,
+            mode=mode,
+            samples=samples,
+            scale=scale,
+            seed=seed,
+            metrics=metrics,
+            drop=drop,
+            start_freq=start_freq,
+            end_freq=end_freq,
+            parameters=request_parameters(circuit),
+            engine=engine,
+            budget=request_budget(),
+        )
+
+    except mason.BudgetExceeded as e:
+        abort(
+            422,
+            description=f"{e} The function is too large to derive "
+            "symbolically; use the numeric engine.",
+        )
+    except Exception as e:
+        abort(400, description=str(e))
+
+    # The symbolic result may have been cached on the circuit.
+    circuit.save()
+
+    response = jsonify(result)
+
+    response.headers["Cache-Control"] = "no-cache, no-store, must-revalidate"
+    response.headers["Pragma"] = "no-cache"
+    response.headers["Expires"] = "0"
+
+    return response
+
+
+@app.route("/circuits/<circuit_id>/transfer_matrix", methods=["GET"])
+def get_transfer_matrix(circuit_id):
+    circuit = db.Circuit.objects(id=circuit_id).first()
+
+    if not circuit:
+        abort(404, description="Circuit not found")
+
+    input_nodes = request.args.get("input_nodes", default="").split(",")
+    output_nodes = request.args.get("output_nodes", default="").split(",")
+    latex = request.args.get("latex", default=True, type=lambda s: bool(strtobool(s)))
+    factor = request.args.get("factor", default=True, type=lambda s: bool(strtobool(s)))
+    numerical = request.args.get(
+        "numerical", default=False, type=lambda s: bool(strtobool(s))
+    )
+
+    try:
+        transfer_matrix = circuit.compute_transfer_matrix(
+            input_nodes,
+            output_nodes,
+            latex=latex,
+            factor=factor,
+            numerical=numerical,
+            budget=request_budget(),
+        )
+
+    except mason.BudgetExceeded as e:
+        abort(
+            422,
+            description=f"{e} The transfer functions are too large to derive "
+            "symbolically; use the numeric engine (transfer_matrix/bode).",
+        )
+    except Exception as e:
+        abort(400, description=str(e))
+
+    response = jsonify(
+        {
+            "input_nodes": input_nodes,
+            "output_nodes": output_nodes,
+            "transfer_matrix": transfer_matrix,
+        }
+    )
+
+    response.headers["Cache-Control"] = "no-cache, no-store, must-revalidate"
+    response.headers["Pragma"] = "no-cache"
+    response.headers["Expires"] = "0"
+
+    return response
+
+
+@app.route("/circuits/<circuit_id>/transfer_matrix/bode", methods=["GET"])
+def get_transfer_matrix_bode(circuit_id):
+    circuit = db.Circuit.objects(id=circuit_id).first()
+
+    if not circuit:
+        abort(404, description="Circuit not found")
+
+    input_nodes = request.args.get("input_nodes", default="").split(",")
+    output_nodes = request.args.get("output_nodes", default="").split(",")
+    start_freq = request.args.get("start_freq_hz", type=float)
+    end_freq = request.args.get("end_freq_hz", type=float)
+    points_per_decade = request.args.get("points_per_decade", type=int)
+    frequency_unit = request.args.get("frequency_unit", default="hz")
+    gain_unit = request.args.get("gain_unit", default="db")
+    phase_unit = request.args.get("phase_unit", default="deg")
+
+    try:
+        freq, gain, phase = circuit.eval_transfer_matrix(
+            input_nodes,
+            output_nodes,
+            start_freq,
+            end_freq,
+            points_per_decade,
+            frequency_unit,
+            gain_unit,
+            phase_unit,
+        )
+
+    except Exception as e:
+        abort(400, description=str(e))
+
+    response = jsonify(
+        {
+            "input_nodes": input_nodes,
+            "output_nodes": output_nodes,
+            "frequency": freq,
+            "gain": gain,
+            "phase": phase,
+        }
+    )
+
+    response.headers["Cache-Control"] = "no-cache, no-store, must-revalidate"
+    response.headers["Pragma"] = "no-cache"
+    response.headers["Expires"] = "0"
+
+    return response
+
+
 # CHECK HERE FOR SIMPLIFICATION OF THE CIRCUIT
 @app.route("/circuits/<circuit_id>/simplify", methods=["PATCH"])
 def simplify_circuit(circuit_id):
@@ -694,13 +1173,31 @@ def simplification_automation_sfg(circuit_id):
     if not circuit:
         abort(404, description="Circuit not found")
 
-    circuit.simplify_entire_sfg()
+    method = request.args.get("method", default="dead_branches")
+    absorbed = None
+
+    try:
+        if method == "dead_branches":
+            circuit.simplify_entire_sfg()
+        elif method == "series_parallel":
+            keep = (request.get_json(silent=True) or {}).get("keep")
+            absorbed = circuit.reduce_sfg(keep)
+        else:
+            raise ValueError("Invalid simplification method.")
+
+    except Exception as e:
+        abort(400, description=str(e))
+
     circuit.save()
 
     try:
         fields = request.args.get("fields", type=lambda s: s and s.split(",") or None)
 
-        return circuit.to_dict(fields)
+        output = circuit.to_dict(fields)
+        if absorbed is not None:
+            output["absorbed"] = absorbed
+
+        return output
 
     except Exception as e:
         abort(400, description=str(e))
@@ -866,9 +1363,9 @@ def plot_phase_margin(circuit_id):
     input_node = request.args.get('input_node', type=str)
     output_node = request.args.get('output_node', type=str)
     selected_device = request.args.get('selected_device', type=str)
-    min_val = float(request.args.get('min_val', type=float))
-    max_val = float(request.args.get('max_val', type=float))
-    step_size = float(request.args.get('step_size', type=float))
+    min_val = request.args.get('min_val', type=float)
+    max_val = request.args.get('max_val', type=float)
+    step_size = request.args.get('step_size', type=float)
 
     try:
         device_value, phase_margin = circuit.sweep_params_for_phase_margin(
@@ -877,9 +1374,15 @@ def plot_phase_margin(circuit_id):
             param_name=selected_device,
             min_value=min_val,
             max_value=max_val,
-            step=step_size
+            step=step_size,
+            engine=request.args.get('engine', default='auto'),
+            budget=request_budget(),
+            **request_sweep()
         )
 
+    except mason.BudgetExceeded as e:
+        abort(422, description=f'{e} The transfer function is too large to '
+              'derive symbolically.')
     except Exception as e:
         abort(400, description=str(e))
 
@@ -907,9 +1410,9 @@ def plot_bandwidth(circuit_id):
     input_node = request.args.get('input_node', type=str)
     output_node = request.args.get('output_node', type=str)
     selected_device = request.args.get('selected_device', type=str)
-    min_val = float(request.args.get('min_val', type=float))
-    max_val = float(request.args.get('max_val', type=float))
-    step_size = float(request.args.get('step_size', type=float))
+    min_val = request.args.get('min_val', type=float)
+    max_val = request.args.get('max_val', type=float)
+    step_size = request.args.get('step_size', type=float)
 
     try:
         parameter_value, bandwidth = circuit.sweep_params_for_bandwidth(
@@ -918,9 +1421,15 @@ def plot_bandwidth(circuit_id):
             param_name=selected_device,
             min_val=min_val,
             max_val=max_val,
-            step=step_size
+            step=step_size,
+            engine=request.args.get('engine', default='auto'),
+            budget=request_budget(),
+            **request_sweep()
         )
 
+    except mason.BudgetExceeded as e:
+        abort(422, description=f'{e} The transfer function is too large to '
+              'derive symbolically.')
     except Exception as e:
         abort(400, description=str(e))
 
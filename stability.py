@@ -0,0 +1,301 @@
+from typing import Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+
+# Relative machine precision, which bounds the tolerance of root finding.
+EPS = np.finfo(float).eps
+
+
+def brentq(f: Callable[[np.ndarray], np.ndarray], a: np.ndarray,
+           b: np.ndarray, xtol: float = 1e-12, maxiter: int = 100,
+           fa: Optional[np.ndarray] = None,
+           fb: Optional[np.ndarray] = None) -> Tuple[np.ndarray, int]:
+    """Finds roots of a function by Brent's method, for many brackets at
+        once.
+
+    Each bracket is refined by inverse quadratic interpolation or secant
+    steps where they converge, falling back to bisection where they do not.
+    All brackets share each evaluation of f, so f should be vectorised.
+
+    Args:
+        f: A function of an array of points, which returns the function
+            values at those points.
+        a: The lower ends of the brackets.
+        b: The upper ends of the brackets. f(a) and f(b) must not have the
+            same sign.
+        xtol: The absolute tolerance of the roots.
+        maxiter: The maximum number of iterations.
+        fa: Optional; The values of f at a, if they are already known.
+        fb: Optional; The values of f at b, if they are already known.
+
+    Returns:
+        A (roots, evaluations) tuple, where evaluations is the number of
+        times f was called.
+
+    Raises:
+        ValueError: If a bracket does not contain a sign change.
+    """
+    a = np.array(a, dtype=float)
+    b = np.array(b, dtype=float)
+    evaluations = 0
+    if fa is None:
+        fa = f(a)
+        evaluations += 1
+    if fb is None:
+        fb = f(b)
+        evaluations += 1
+    fa = np.asarray(fa, dtype=float)
+    fb = np.asarray(fb, dtype=float)
+
+    if np.any(np.sign(fa) * np.sign(fb) > 0):
+        raise ValueError('Invalid bracket.')
+
+    c, fc = a.copy(), fa.copy()
+    d = e = b - a
+
+    for _ in range(maxiter):
+        # Keep the root between b and c.
+        same = np.sign(fb) == np.sign(fc)
+        c = np.where(same, a, c)
+        fc = np.where(same, fa, fc)
+        d = np.where(same, b - a, d)
+        e = np.where(same, b - a, e)
+
+        # Keep b the best estimate.
+        swap = np.abs(fc) < np.abs(fb)
+        a, fa = np.where(swap, b, a), np.where(swap, fb, fa)
+        b, fb = np.where(swap, c, b), np.where(swap, fc, fb)
+        c, fc = np.where(swap, a, c), np.where(swap, fa, fc)
+
+        tol = 2 * EPS * np.abs(b) + 0.5 * xtol
+        xm = 0.5 * (c - b)
+        done = (np.abs(xm) <= tol) | (fb == 0)
+        if np.all(done):
+            break
+
+        # Interpolate: secant if a and c coincide, inverse quadratic
+        # otherwise.
+        with np.errstate(divide='ignore', invalid='ignore'):
+            s = fb / fa
+            q_ac = fa / fc
+            r = fb / fc
+            secant = a == c
+            p = np.where(secant, 2 * xm * s,
+                         s * (2 * xm * q_ac * (q_ac - r) - (b - a) * (r - 1)))
+            q = np.where(secant, 1 - s, (q_ac - 1) * (r - 1) * (s - 1))
+            q = np.where(p > 0, -q, q)
+            p = np.abs(p)
+
+            interpolate = (np.abs(e) >= tol) & (np.abs(fa) > np.abs(fb)) & \
+                (2 * p < np.minimum(3 * xm * q - np.abs(tol * q),
+                                    np.abs(e * q)))
+            step = np.where(interpolate, p / q, xm)
+
+        e = np.where(interpolate, d, xm)
+        d = step
+
+        a, fa = np.where(done, a, b), np.where(done, fa, fb)
+        b = np.where(done, b,
+                     b + np.where(np.abs(d) > tol, d, np.copysign(tol, xm)))
+        fb = np.where(done, fb, np.asarray(f(b), dtype=float))
+        evaluations += 1
+
+    return b, evaluations
+
+
+def wrap_phase(phase: np.ndarray) -> np.ndarray:
+    """Wraps phases in degrees into (-180, 180]."""
+    return 180 - np.mod(180 - phase, 360)
+
+
+def stability_margins(
+    response: Callable[[np.ndarray], np.ndarray],
+    start_freq: float = 1e3,
+    end_freq: float = 1e12,
+    points_per_decade: int = 5,
+    xtol: float = 1e-9
+) -> Dict[str, np.ndarray]:
+    """Finds the phase margin, gain margin and crossover frequencies of one
+        or more frequency responses.
+
+    The responses are scanned on a coarse logarithmic grid, where the phase
+    is unwrapped, to bracket the unity gain crossover and the crossing of
+    -180 degrees (or any odd multiple of 180 degrees). Each crossing is then
+    refined by Brent's method in log frequency. The gain crossover is the
+    highest frequency at which the gain crosses unity, and the phase
+    crossover is the lowest frequency at which the phase crosses -180
+    degrees.
+
+    Margins follow the negative feedback convention, in which the closed
+    loop is unstable where the response T is -1: the phase margin is
+    180 degrees plus the phase of T at the gain crossover, wrapped into
+    (-180, 180], and is negative for an unstable loop.
+
+    Args:
+        response: A function of complex frequencies s, of shape (1, K) or
+            (R, 1), which returns the values of R responses, of shape (R, K).
+        start_freq: The lowest frequency of the scan, in hertz.
+        end_freq: The highest frequency of the scan, in hertz.
+        points_per_decade: The density of the scan. It must resolve every
+            phase change of 180 degrees or more.
+        xtol: The tolerance of each crossover, in decades.
+
+    Returns:
+        A dictionary of arrays with one value per response: the
+        'phase_margin', and the unwrapped 'gain_crossover_phase', in
+        degrees, the 'gain_margin' in decibels, the 'gain_crossover' and
+        'phase_crossover' frequencies in hertz, and 'evaluations', the
+        number of frequencies at which each response was evaluated. Values
+        are NaN where there is no crossover.
+    """
+    num_points = max(2, round(points_per_decade *
+                              np.log10(end_freq / start_freq)) + 1)
+    x = np.linspace(np.log10(start_freq), np.log10(end_freq), num_points)
+
+    def evaluate(x: np.ndarray) -> np.ndarray:
+        return response(1j * 2 * np.pi * 10 ** x)
+
+    # Scan the responses, one row per response.
+    scan = np.atleast_2d(evaluate(x[None, :]))
+    rows = np.arange(len(scan))
+    log_gain = np.log10(np.abs(scan))
+    phase = np.degrees(np.unwrap(np.angle(scan), axis=-1))
+
+    # Where a crossing is found between samples i and i + 1, the phase
+    # between them is continued from sample i.
+    def crossings(changed: np.ndarray, last: bool) -> np.ndarray:
+        found = changed.any(axis=-1)
+        index = len(x) - 2 - np.argmax(changed[:, ::-1], axis=-1) if last \
+            else np.argmax(changed, axis=-1)
+        return np.where(found, index, -1)
+
+    def local_phase(xr: np.ndarray, index: np.ndarray) -> np.ndarray:
+        i = np.maximum(index, 0)
+        return phase[rows, i] + np.degrees(np.angle(
+            evaluate(xr[:, None])[:, 0] / scan[rows, i]))
+
+    def refine(f, index: np.ndarray) -> Tuple[np.ndarray, int]:
+        found = index >= 0
+        if not found.any():
+            return np.full(len(rows), np.nan), 0
+        i = np.maximum(index, 0)
+        # Rows without a crossing are given a dummy bracket of zero width.
+        a = np.where(found, x[i], x[0])
+        b = np.where(found, x[i + 1], x[0])
+        fixed = lambda xr: np.where(found, f(xr, index), 0)
+        root, evaluations = brentq(fixed, a, b, xtol)
+        return np.where(found, root, np.nan), evaluations
+
+    # Unity gain crossover.
+    gain_index = crossings(np.diff(np.sign(log_gain), axis=-1) != 0,
+                           last=True)
+    gain_x, gain_evaluations = refine(
+        lambda xr, index: np.log10(np.abs(evaluate(xr[:, None])[:, 0])),
+        gain_index)
+
+    # Phase crossover, at the first odd multiple of 180 degrees crossed.
+    band = np.floor((phase + 180) / 360)
+    phase_index = crossings(np.diff(band, axis=-1) != 0, last=False)
+    i = np.maximum(phase_index, 0)
+    level = -180 + 360 * np.maximum(band[rows, i], band[rows, i + 1])
+    phase_x, phase_evaluations = refine(
+        lambda xr, index: local_phase(xr, index) - level, phase_index)
+
+    # Evaluate the margins at the refined crossovers.
+    gain_found = gain_index >= 0
+    crossover_phase = np.where(
+        gain_found,
+        local_phase(np.where(gain_found, gain_x, x[0]), gain_index),
+        np.nan)
+
+    phase_found = phase_index >= 0
+    phase_crossover_gain = np.where(
+        phase_found,
+        np.abs(evaluate(np.where(phase_found, phase_x, x[0])[:, None])[:, 0]),
+        np.nan)
+
+    return {
+        'phase_margin': wrap_phase(180 + crossover_phase),
+        'gain_margin': -20 * np.log10(phase_crossover_gain),
+        'gain_crossover': 10 ** gain_x,
+        'phase_crossover': 10 ** phase_x,
+        'gain_crossover_phase': crossover_phase,
+        'evaluations': np.full(len(rows), len(x) + gain_evaluations +
+                               phase_evaluations + 2)
+    }
+
+
+def solve_target(
+    metric: Callable[[np.ndarray], np.ndarray],
+    target: float,
+    lower: float,
+    upper: float,
+    scale: str = 'log',
+    xtol: float = 1e-6,
+    maxiter: int = 50
+) -> Dict:
+    """Finds the parameter value at which a metric reaches a target, by
+        Brent's method.
+
+    The metric must cross the target between the bounds. If it crosses more
+    than once, any one of the crossings may be found.
+
+    Args:
+        metric: A function of an array of parameter values, which returns
+            the metric at each value, or NaN where it is undefined.
+        target: The target value of the metric.
+        lower: The lower bound of the parameter.
+        upper: The upper bound of the parameter.
+        scale: Can be 'log' to search in the logarithm of the parameter,
+            which suits values spanning decades, or 'linear'. Defaults to
+            'log'.
+        xtol: The tolerance of the value, as a fraction of the width of the
+            bounds on the given scale.
+        maxiter: The maximum number of iterations.
+
+    Returns:
+        A dictionary of the 'value' of the parameter, the 'metric' there,
+        and the 'history', a list of the (value, metric) pairs evaluated,
+        in order.
+
+    Raises:
+        ValueError: If the bounds or scale are invalid, or the metric does
+            not cross the target between the bounds.
+    """
+    if scale == 'log':
+        if not 0 < lower < upper:
+            raise ValueError('Invalid bounds.')
+        forward, inverse = np.log10, lambda x: 10 ** x
+    elif scale == 'linear':
+        if not lower < upper:
+            raise ValueError('Invalid bounds.')
+        forward, inverse = np.asarray, np.asarray
+    else:
+        raise ValueError('Invalid scale.')
+
+    history: List[Tuple[float, float]] = []
+
+    def objective(x: np.ndarray) -> np.ndarray:
+        values = np.atleast_1d(inverse(np.asarray(x, dtype=float)))
+        result = np.asarray(metric(values), dtype=float).reshape(
+            values.shape)
+        history.extend(zip(values.tolist(), result.tolist()))
+        return result.reshape(np.shape(x)) - target
+
+    a, b = forward(float(lower)), forward(float(upper))
+    ends = objective(np.array([a, b]))
+    if np.isnan(ends).any() or ends[0] * ends[1] > 0:
+        raise ValueError('Invalid bounds: the metric does not cross the '
+                         'target between them.')
+
+    if ends[0] == 0 or ends[1] == 0:
+        root = a if ends[0] == 0 else b
+    else:
+        root, _ = brentq(objective, a, b, xtol * (b - a), maxiter,
+                         ends[0], ends[1])
+
+    value = float(inverse(root))
+    # The last evaluation is at the root, unless the root is an end.
+    reached = next(m for v, m in reversed(history) if v == value)
+    return {'value': value, 'metric': reached, 'history': history}
@@ -0,0 +1,265 @@
+from typing import Callable, Dict, Iterator, Optional, Sequence, Tuple, Union
+
+import numpy as np
+
+
+def sweep_values(
+    start: Optional[float] = None,
+    stop: Optional[float] = None,
+    step: Optional[float] = None,
+    scale: str = 'linear',
+    points: Optional[int] = None,
+    values: Optional[Sequence[float]] = None
+) -> np.ndarray:
+    """Builds the values of a parameter sweep.
+
+    Args:
+        start: The first value.
+        stop: The last value. Linear sweeps include it if it is a whole
+            number of steps from the start.
+        step: The increment of a linear sweep. If None, a linear sweep takes
+            the given number of points instead.
+        scale: Can be 'linear' for evenly spaced values, 'log' for
+            logarithmically spaced values, or 'list' for explicit values.
+            Defaults to 'linear'.
+        points: The number of values of a logarithmic sweep, or of a linear
+            sweep without a step.
+        values: The explicit values of a 'list' sweep.
+
+    Returns:
+        The values, as a 1-D array.
+
+    Raises:
+        ValueError: If the sweep is invalid.
+    """
+    if scale == 'list':
+        if values is None or len(values) == 0:
+            raise ValueError('Invalid sweep values.')
+        return np.asarray(values, dtype=float)
+
+    if start is None or stop is None or stop < start:
+        raise ValueError('Invalid sweep range.')
+
+    if scale == 'linear':
+        if step is not None:
+            if step <= 0:
+                raise ValueError('Invalid sweep step.')
+            # Tolerate rounding errors, so that the stop value is included
+            # when it is a whole number of steps from the start.
+            count = int(np.floor((stop - start) / step + 1e-9)) + 1
+            return start + step * np.arange(count)
+        if not points or points < 1:
+            raise ValueError('Invalid number of sweep points.')
+        return np.linspace(start, stop, points)
+
+    if scale == 'log':
+        if start <= 0:
+            raise ValueError('Invalid sweep range.')
+        if not points or points < 1:
+            raise ValueError('Invalid number of sweep points.')
+        return np.geomspace(start, stop, points)
+
+    raise ValueError('Invalid sweep scale.')
+
+
+def adaptive_frequencies(
+    response: Callable[[np.ndarray], np.ndarray],
+    start_freq: float,
+    end_freq: float,
+    points_per_decade: float = 2,
+    hints: Optional[Sequence[float]] = None,
+    gain_tolerance: float = 0.1,
+    phase_tolerance: float = 1.0,
+    max_points: int = 2000,
+    min_spacing: float = 1e-4
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Samples a frequency response adaptively.
+
+    Starting from a coarse logarithmic grid, every interval is split at its
+    midpoint in log frequency until the response there is within tolerance
+    of the interpolation between the ends of the interval. Flat regions are
+    therefore left coarse, while resonances and notches are refined until
+    their peaks are resolved. Each round evaluates every midpoint in a
+    single call.
+
+    Args:
+        response: A function of an array of frequencies, which returns the
+            complex values of the response at those frequencies.
+        start_freq: The starting frequency.
+        end_freq: The ending frequency.
+        points_per_decade: The density of the initial grid.
+        hints: Optional; Frequencies to sample initially, such as the
+            magnitudes of poles and zeros. Those outside the range are
+            ignored.
+        gain_tolerance: The allowed interpolation error of the gain, in
+            decibels.
+        phase_tolerance: The allowed interpolation error of the phase, in
+            degrees.
+        max_points: The maximum number of samples. Refinement stops early
+            once it is reached.
+        min_spacing: The narrowest interval that is still split, in
+            decades.
+
+    Returns:
+        A (frequency, output) tuple of arrays of the samples, in increasing
+        frequency.
+
+    Raises:
+        ValueError: If the frequency range is invalid.
+    """
+    if not 0 < start_freq < end_freq:
+        raise ValueError('Invalid frequency range.')
+
+    lo, hi = np.log10(start_freq), np.log10(end_freq)
+    num_points = max(2, int(np.ceil(points_per_decade * (hi - lo))) + 1)
+    x = np.linspace(lo, hi, num_points)
+
+    if hints is not None:
+        hints = np.log10(np.asarray(hints, dtype=float)[
+            np.asarray(hints, dtype=float) > 0])
+        x = np.union1d(x, hints[(hints > lo) & (hints < hi)])
+
+    output = np.asarray(response(10 ** x), dtype=complex)
+    output = np.broadcast_to(output, x.shape).copy()
+
+    # Intervals are split while they are wide enough.
+    split = np.diff(x) > min_spacing
+
+    while split.any() and len(x) < max_points:
+        index = np.flatnonzero(split)[:max_points - len(x)]
+        mid = 0.5 * (x[index] + x[index + 1])
+        value = np.broadcast_to(
+            np.asarray(response(10 ** mid), dtype=complex), mid.shape)
+
+        left, right = output[index], output[index + 1]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            gain_error = np.abs(
+                20 * np.log10(np.abs(value)) -
+                10 * np.log10(np.abs(left) * np.abs(right)))
+            phase_error = np.degrees(np.abs(
+                np.angle(value / left) - 0.5 * np.angle(right / left)))
+        refine = ~((gain_error <= gain_tolerance) &
+                   (phase_error <= phase_tolerance))
+
+        # Keep the midpoints that were not yet resolved, and split both of
+        # their halves next.
+        index, mid, value = index[refine], mid[refine], value[refine]
+        x = np.insert(x, index + 1, mid)
+        output = np.insert(output, index + 1, value)
+
+        # The new halves start at index + 1 + (number of earlier insertions).
+        split = np.zeros(len(x) - 1, dtype=bool)
+        positions = index + np.arange(len(index))
+        split[positions] = split[positions + 1] = True
+        split &= np.diff(x) > min_spacing
+
+    return 10 ** x, output
+
+
+def latin_hypercube(
+    bounds: Sequence[Tuple[float, float]],
+    samples: int,
+    scale: str = 'linear',
+    seed: Optional[int] = None
+) -> np.ndarray:
+    """Draws a Latin hypercube sample of a box.
+
+    The range of every dimension is split into as many strata as there are
+    samples, and each stratum is sampled exactly once, at a random point
+    within it. The strata of different dimensions are paired at random.
+
+    Args:
+        bounds: The (lower, upper) bounds of each dimension.
+        samples: The number of samples.
+        scale: Can be 'linear' to stratify each range evenly, or 'log' to
+            stratify it evenly in decades. Defaults to 'linear'.
+        seed: Optional; The seed of the random number generator.
+
+    Returns:
+        The samples, as an array of shape (samples, dimensions).
+
+    Raises:
+        ValueError: If the bounds, number of samples or scale are invalid.
+    """
+    bounds = np.asarray(bounds, dtype=float).reshape(-1, 2)
+    if not samples or samples < 1 or np.any(bounds[:, 1] < bounds[:, 0]):
+        raise ValueError('Invalid sweep range.')
+    if scale == 'log':
+        if np.any(bounds <= 0):
+            raise ValueError('Invalid sweep range.')
+        bounds = np.log10(bounds)
+    elif scale != 'linear':
+        raise ValueError('Invalid sweep scale.')
+
+    rng = np.random.default_rng(seed)
+    strata = np.argsort(rng.random((samples, len(bounds))), axis=0)
+    unit = (strata + rng.random(strata.shape)) / samples
+    points = bounds[:, 0] + unit * (bounds[:, 1] - bounds[:, 0])
+    return 10 ** points if scale == 'log' else points
+
+
+def sample_parameters(
+    spec: Dict[str, Union[Sequence[float], Dict]],
+    mode: str = 'grid',
+    samples: Optional[int] = None,
+    scale: str = 'linear',
+    seed: Optional[int] = None
+) -> Tuple[Tuple[int, ...], Dict[str, np.ndarray]]:
+    """Builds the points of a sweep over several parameters.
+
+    Args:
+        spec: Maps each parameter name to its sweep. In 'grid' mode, a
+            sweep is a list of values, or a dictionary of the arguments of
+            sweep_values. In 'latin_hypercube' mode, it is the [lower, upper]
+            bounds of the parameter. In 'points' mode, it is the values of
+            the parameter at each point, which must have the same length
+            for every parameter.
+        mode: Can be 'grid' for the Cartesian product of the sweeps,
+            'latin_hypercube' for a Latin hypercube sample of the bounds, or
+            'points' for explicit points. Defaults to 'grid'.
+        samples: The number of points of a Latin hypercube sample.
+        scale: The scale of a Latin hypercube sample. See latin_hypercube.
+        seed: Optional; The seed of a Latin hypercube sample.
+
+    Returns:
+        A (shape, values) tuple, where shape is the shape of the sweep,
+        with one axis per parameter for a grid and a single axis otherwise,
+        and values maps each parameter name to its flattened values at every
+        point, in C order.
+
+    Raises:
+        ValueError: If the sweep is invalid.
+    """
+    if not spec:
+        raise ValueError('Invalid sweep parameters.')
+    names = list(spec)
+
+    if mode == 'grid':
+        axes = [sweep_values(**spec[name]) if isinstance(spec[name], dict)
+                else sweep_values(scale='list', values=spec[name])
+                for name in names]
+        shape = tuple(len(axis) for axis in axes)
+        grid = np.meshgrid(*axes, indexing='ij')
+        return shape, {name: g.ravel() for name, g in zip(names, grid)}
+
+    if mode == 'latin_hypercube':
+        points = latin_hypercube([spec[name] for name in names], samples,
+                                 scale, seed)
+        return (len(points),), dict(zip(names, points.T))
+
+    if mode == 'points':
+        values = [np.asarray(spec[name], dtype=float).ravel()
+                  for name in names]
+        if len({len(v) for v in values}) != 1 or len(values[0]) == 0:
+            raise ValueError('Invalid sweep values.')
+        return (len(values[0]),), dict(zip(names, values))
+
+    raise ValueError('Invalid sweep mode.')
+
+
+def chunks(count: int, size: int) -> Iterator[slice]:
+    """Splits a range of indices into consecutive slices of at most the
+    given size."""
+    size = max(1, int(size))
+    for start in range(0, count, size):
+        yield slice(start, min(start + size, count))
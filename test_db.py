@@ -0,0 +1,247 @@
+import threading
+import unittest
+from collections import OrderedDict
+from unittest import mock
+
+import dill
+import mongoengine
+import mongomock
+import networkx as nx
+import sympy
+
+import db
+import kernels
+import mason
+import rational
+
+
+s, gm, R, C, b = sympy.symbols('s gm R C b')
+
+
+def feedback_sfg():
+    sfg = nx.DiGraph()
+    sfg.add_edge('Vin', 'X', weight=sympy.Integer(1))
+    sfg.add_edge('X', 'Vout', weight=-gm * R / (1 + s * R * C))
+    sfg.add_edge('Vout', 'X', weight=-b)
+    return sfg
+
+
+class TestResultCache(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        mongoengine.disconnect()
+        mongoengine.connect('test', mongo_client_class=mongomock.MongoClient)
+
+    @classmethod
+    def tearDownClass(cls):
+        mongoengine.disconnect()
+
+    def setUp(self):
+        db.SymbolicResult.drop_collection()
+        db.SYMBOLIC_RESULTS.clear()
+        db.NUMERIC_RESULTS.clear()
+        db.MASON_CONTEXTS.clear()
+        db.Circuit.sfg_stack = []
+        db.Circuit.redo_stack = []
+        self.parameters = {'gm': 0.04, 'R': 1e4, 'C': 1e-12, 'b': 0.1,
+                           'f': 1.0}
+
+    def circuit(self, **parameters):
+        return db.Circuit(sfg=dill.dumps(feedback_sfg()),
+                          parameters=dict(self.parameters, **parameters))
+
+    def test_replaces_legacy_entries(self):
+        circuit = self.circuit()
+        # Cached before the rational form was stored.
+        circuit.transfer_functions.append(db.TransferFunction(
+            input_node='Vin', output_node='Vout',
+            sympy_expression=dill.dumps(sympy.Integer(1))))
+
+        for _ in range(2):
+            circuit._compute_transfer_function('Vin', 'Vout',
+                                               cache_result=True)
+
+        self.assertEqual(len(circuit.transfer_functions), 1)
+        self.assertIsNotNone(circuit.transfer_functions[0].rational_function)
+
+    def test_edit_edge_invalidates(self):
+        circuit = self.circuit()
+        before, _, _ = circuit._compute_transfer_function(
+            'Vin', 'Vout', cache_result=True)
+        circuit._compute_loop_gain(cache_result=True)
+
+        circuit.sfg_stack.append(circuit.sfg)
+        circuit.edit_edge('Vout', 'X', '-2*b')
+
+        self.assertEqual(len(circuit.transfer_functions), 0)
+        self.assertIsNone(circuit.loop_gain)
+        after, _, _ = circuit._compute_transfer_function(
+            'Vin', 'Vout', cache_result=True)
+        self.assertNotEqual(sympy.simplify(after - before), 0)
+
+        circuit.undo_sfg()
+
+        self.assertEqual(len(circuit.transfer_functions), 0)
+        undone, _, _ = circuit._compute_transfer_function(
+            'Vin', 'Vout', cache_result=True)
+        self.assertEqual(sympy.simplify(undone - before), 0)
+
+    def test_parameter_update_keeps_symbolic_results(self):
+        circuit = self.circuit()
+        circuit._compute_transfer_function('Vin', 'Vout', cache_result=True)
+        cached = circuit.transfer_functions[0].rational_function
+
+        circuit.update_parameters({'b': 0.2})
+
+        self.assertEqual(circuit.transfer_functions[0].rational_function,
+                         cached)
+
+    def test_numeric_results_keyed_by_parameters(self):
+        first = self.circuit()
+        second = self.circuit(b=0.2)
+
+        first_result = first.compute_transfer_function_poles_zeros(
+            'Vin', 'Vout')
+        second_result = second.compute_transfer_function_poles_zeros(
+            'Vin', 'Vout')
+
+        # Both circuits share one symbolic result, but not numeric results.
+        self.assertEqual(len(db.SYMBOLIC_RESULTS), 1)
+        self.assertEqual(db.SymbolicResult.objects.count(), 1)
+        self.assertEqual(len(db.NUMERIC_RESULTS), 2)
+        self.assertNotEqual(first_result, second_result)
+
+        self.assertIs(
+            first.compute_transfer_function_poles_zeros('Vin', 'Vout'),
+            first_result)
+        self.assertEqual(len(db.NUMERIC_RESULTS), 2)
+
+    def test_symbolic_results_expire(self):
+        self.circuit()._compute_transfer_function('Vin', 'Vout',
+                                                  cache_result=False)
+
+        self.assertIsNotNone(db.SymbolicResult.objects.first().created)
+        indexes = db.SymbolicResult._get_collection().index_information()
+        self.assertIn(86400, [index.get('expireAfterSeconds')
+                              for index in indexes.values()])
+
+    def test_kernels_expire(self):
+        db.CompiledKernel.drop_collection()
+        with mock.patch.object(db, 'KERNELS', kernels.KernelCache()):
+            db.load_kernel(rational.RationalFunction.from_expr(
+                gm * R / (1 + s * R * C)))
+
+        self.assertIsNotNone(db.CompiledKernel.objects.first().created)
+        indexes = db.CompiledKernel._get_collection().index_information()
+        self.assertIn(86400, [index.get('expireAfterSeconds')
+                              for index in indexes.values()])
+
+    def test_cached_results_report_their_engine(self):
+        circuit = self.circuit()
+        circuit._compute_transfer_function('Vin', 'Vout', cache_result=True,
+                                           engine='elimination')
+        circuit._compute_loop_gain(cache_result=True, engine='elimination')
+
+        # From the circuit's own cache, and then from the shared cache.
+        for shared in (False, True):
+            other = self.circuit() if shared else circuit
+            other._compute_transfer_function('Vin', 'Vout',
+                                             cache_result=False,
+                                             engine='mason')
+            self.assertEqual(other.engine_plan,
+                             {'engine': 'elimination', 'estimate': None})
+            other._compute_loop_gain(cache_result=False, engine='auto')
+            self.assertEqual(other.engine_plan['engine'], 'elimination')
+
+        # Results cached before the engine was recorded.
+        legacy = self.circuit()
+        legacy.transfer_functions.append(db.TransferFunction(
+            input_node='Vin', output_node='Vout',
+            sympy_expression=dill.dumps(sympy.Integer(1)),
+            rational_function=dill.dumps(
+                rational.RationalFunction([1], [1]))))
+        legacy._compute_transfer_function('Vin', 'Vout', cache_result=False)
+        self.assertEqual(legacy.engine_plan['engine'], 'cached')
+
+    def test_budget_reaches_every_engine(self):
+        circuit = self.circuit()
+
+        for engine in ('mason', 'elimination'):
+            with self.assertRaises(mason.BudgetExceeded):
+                circuit._compute_transfer_function(
+                    'Vin', 'Vout', cache_result=False, engine=engine,
+                    budget=mason.Budget(terms=0))
+            with self.assertRaises(mason.BudgetExceeded):
+                circuit._compute_loop_gain(
+                    cache_result=False, engine=engine,
+                    budget=mason.Budget(terms=0))
+
+        with self.assertRaises(mason.BudgetExceeded):
+            circuit.sweep_params_for_phase_margin(
+                'Vin', 'Vout', 'b', 0.1, 0.2, points=2,
+                budget=mason.Budget(terms=0))
+        with self.assertRaises(mason.BudgetExceeded):
+            circuit.sweep_params_for_bandwidth(
+                'Vin', 'Vout', 'b', 0.1, 0.2, points=2,
+                budget=mason.Budget(terms=0))
+
+
+class TestSampledResponse(unittest.TestCase):
+    def setUp(self):
+        self.circuit = db.Circuit()
+
+    def test_phase_margin(self):
+        # Crosses 0 dB halfway between the second and third samples.
+        gain = [20, 10, -10, -20]
+        phase = [-90, -110, -130, -150]
+        self.assertAlmostEqual(self.circuit.compute_phase_margin(gain, phase),
+                               60)
+
+        # Phases past -180 degrees are wrapped, as in /pm/plot.
+        self.assertAlmostEqual(
+            self.circuit.compute_phase_margin(gain, [-200, -240, -260, -270]),
+            70)
+        self.assertIsNone(self.circuit.compute_phase_margin([10, 5], [0, 0]))
+
+    def test_bandwidth(self):
+        frequencies = [1e3, 1e4, 1e5, 1e6]
+        magnitudes = [20, 20, 16, 0]
+
+        # 17 dB is three quarters of the way from 1e4 to 1e5 in log
+        # frequency.
+        self.assertAlmostEqual(
+            self.circuit.calculate_bandwidth(frequencies, magnitudes),
+            10 ** 4.75)
+        self.assertIsNone(
+            self.circuit.calculate_bandwidth(frequencies, [0, 1, 2, 3]))
+        with self.assertRaises(ValueError):
+            self.circuit.calculate_bandwidth(frequencies, magnitudes, drop=0)
+
+
+class TestMemoryCache(unittest.TestCase):
+    def test_eviction_under_concurrent_use(self):
+        cache = OrderedDict()
+        errors = []
+
+        def use(offset):
+            try:
+                for i in range(2000):
+                    key = (offset + i) % 8
+                    if db._recall(cache, key) is None:
+                        db._remember(cache, 4, key, i + 1)
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=use, args=(offset,))
+                   for offset in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        self.assertLessEqual(len(cache), 4)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,146 @@
+import pickle
+import os
+import tempfile
+import threading
+import unittest
+
+import numpy as np
+import sympy
+
+import kernels
+from rational import RationalFunction
+
+
+s, a, b, c = sympy.symbols('s a b c')
+
+
+class TestKernel(unittest.TestCase):
+    def setUp(self):
+        self.expr = (a * b * s + a * b + c) / (s ** 2 + (a + c) * s + a * b)
+        self.rational = RationalFunction.from_expr(self.expr)
+        self.kernel = kernels.compile_kernel(self.rational)
+        self.parameters = {'a': 2.0, 'b': 0.5, 'c': 3.0}
+        self.s = 1j * np.logspace(-2, 2, 9)
+
+    def test_matches_expression(self):
+        expected = sympy.lambdify(s, self.expr.subs(self.parameters))(self.s)
+        np.testing.assert_allclose(self.kernel(self.s, self.parameters),
+                                   expected)
+
+    def test_source(self):
+        source = kernels.kernel_source(self.rational)
+
+        self.assertTrue(source.startswith('def kernel(s, _p0, _p1, _p2):'))
+        # a*b is shared by three coefficients, and computed once.
+        self.assertEqual(source.count('_p0*_p1'), 1)
+        # Horner form: one multiplication by s per power of s.
+        self.assertEqual(source.count('* s'), 3)
+
+    def test_broadcasts_parameters(self):
+        parameters = dict(self.parameters, a=np.array([[1.0], [2.0]]))
+        output = self.kernel(self.s, parameters)
+
+        self.assertEqual(output.shape, (2, len(self.s)))
+        np.testing.assert_allclose(output[1],
+                                   self.kernel(self.s, self.parameters))
+
+    def test_constant(self):
+        kernel = kernels.compile_kernel(RationalFunction([2], [1]))
+        np.testing.assert_allclose(kernel(self.s), np.full(len(self.s), 2))
+
+    def test_missing_parameters(self):
+        with self.assertRaises(ValueError):
+            self.kernel(self.s, {'a': 1.0})
+
+    def test_pickle(self):
+        kernel = pickle.loads(pickle.dumps(self.kernel))
+        self.assertEqual(kernel.source, self.kernel.source)
+        np.testing.assert_allclose(kernel(self.s, self.parameters),
+                                   self.kernel(self.s, self.parameters))
+
+
+class TestKernelCache(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.rational = RationalFunction.from_expr(a / (s + b))
+        self.key = kernels.expression_hash(self.rational)
+        self.kernel = kernels.compile_kernel(self.rational)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_expression_hash(self):
+        self.assertEqual(
+            kernels.expression_hash(RationalFunction.from_expr(a / (s + b))),
+            self.key)
+        self.assertNotEqual(
+            kernels.expression_hash(RationalFunction.from_expr(b / (s + a))),
+            self.key)
+
+    def test_directory(self):
+        kernels.KernelCache(self.directory.name).put(self.key, self.kernel)
+
+        # A new cache, as in another process, loads the kernel from the
+        # directory.
+        cache = kernels.KernelCache(self.directory.name)
+        kernel = cache.get(self.key)
+        self.assertEqual(kernel.source, self.kernel.source)
+        self.assertEqual(kernel.arguments, ['a', 'b'])
+        self.assertIsNone(cache.get('missing'))
+
+    def test_memory_only(self):
+        cache = kernels.KernelCache()
+        cache.put(self.key, self.kernel)
+        self.assertIs(cache.get(self.key), self.kernel)
+        self.assertIsNone(kernels.KernelCache().get(self.key))
+
+    def test_refuses_shared_files(self):
+        kernels.KernelCache(self.directory.name).put(self.key, self.kernel)
+        path = os.path.join(self.directory.name, self.key + '.json')
+
+        os.chmod(path, 0o666)
+        with self.assertWarns(UserWarning):
+            self.assertIsNone(
+                kernels.KernelCache(self.directory.name).get(self.key))
+
+        os.chmod(path, 0o600)
+        os.chmod(self.directory.name, 0o777)
+        with self.assertWarns(UserWarning):
+            self.assertIsNone(
+                kernels.KernelCache(self.directory.name).get(self.key))
+
+    def test_eviction(self):
+        cache = kernels.KernelCache(self.directory.name, limit=1)
+        cache.put('first', self.kernel)
+        cache.put('second', self.kernel)
+
+        self.assertEqual(list(cache._kernels), ['second'])
+        # Evicted kernels are still found in the directory.
+        self.assertIsNotNone(cache.get('first'))
+
+    def test_concurrent_eviction(self):
+        cache = kernels.KernelCache(limit=2)
+        errors = []
+
+        def use(offset):
+            try:
+                for i in range(2000):
+                    key = str((offset + i) % 4)
+                    if cache.get(key) is None:
+                        cache.put(key, self.kernel)
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=use, args=(offset,))
+                   for offset in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        self.assertLessEqual(len(cache._kernels), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,16 +1,647 @@
+import pickle
+import threading
 import unittest
+from unittest import mock
+
+import networkx as nx
+import numpy as np
+import sympy
+from sympy.polys.domains import ZZ
+from sympy.polys.rings import ring
+
+import mason
 from mason import transfer_function
 
 
-class MyTestCase(unittest.TestCase):
-    def test_something(self):
-        self.assertEqual(True, False)
+def example_sfg():
+    """Returns the SFG from the mason.py example, with symbolic edge gains."""
+    graph = nx.DiGraph()
+
+    edges = [
+        ('y1', 'y2', 'a'),
+        ('y2', 'y3', 'b'),
+        ('y3', 'y2', 'j'),
+        ('y3', 'y4', 'c'),
+        ('y3', 'y5', 'g'),
+        ('y4', 'y5', 'd'),
+        ('y5', 'y5', 'f'),
+        ('y5', 'y3', 'h'),
+        ('y5', 'y4', 'i'),
+        ('y5', 'y6', 'e')
+    ]
+
+    for src, dest, gain in edges:
+        graph.add_edge(src, dest, weight=sympy.Symbol(gain))
+
+    return graph
+
+
+# Edge gains for the example SFG; some depend on s so that the response
+# varies with frequency.
+EXAMPLE_PARAMETERS = {
+    'a': 2.0, 'b': 0.5, 'c': 1.5, 'd': 0.3, 'e': 4.0,
+    'f': 0.2, 'g': 0.7, 'h': 0.4, 'i': 0.25, 'j': 0.6
+}
+
+
+class TestNonTouchingCombinations(unittest.TestCase):
+    def test_combinations(self):
+        # Cycles 0 and 1 touch at node 1; cycle 2 touches neither.
+        masks = [0b0011, 0b0110, 0b1000]
+        combinations = set(mason.non_touching_combinations(masks))
+
+        self.assertEqual(combinations,
+                         {(0,), (1,), (2,), (0, 2), (1, 2)})
+
+    def test_no_cycles(self):
+        self.assertEqual(list(mason.non_touching_combinations([])), [])
+
+
+class TestFindCycles(unittest.TestCase):
+    def setUp(self):
+        self.graph = mason.CycleGraph(example_sfg())
+
+    def cycles(self, **kwargs):
+        return sorted(sorted(self.graph.cycle_nodes(edges))
+                      for _, edges in mason.find_cycles(self.graph, **kwargs))
+
+    def test_matches_networkx(self):
+        expected = sorted(sorted(cycle)
+                          for cycle in nx.simple_cycles(example_sfg()))
+        self.assertEqual(self.cycles(), expected)
+
+    def test_masks_and_edges(self):
+        for mask, edges in mason.find_cycles(self.graph):
+            nodes = self.graph.cycle_nodes(edges)
+            self.assertEqual(mask, self.graph.mask(nodes))
+            # Consecutive edges are joined head to tail, and the last edge
+            # closes the cycle.
+            for e, f in zip(edges, edges[1:] + edges[:1]):
+                self.assertEqual(self.graph.edges[e][1],
+                                 self.graph.edges[f][0])
+
+    def test_limits(self):
+        self.assertEqual(len(self.cycles(max_cycles=2)), 2)
+        self.assertEqual(self.cycles(max_length=1), [['y5']])
+        self.assertEqual(self.cycles(max_length=2),
+                         [['y2', 'y3'], ['y3', 'y5'], ['y4', 'y5'], ['y5']])
+
+    def test_long_ring(self):
+        # A single cycle far longer than the recursion limit, with a chord
+        # that makes a second, shorter cycle.
+        graph = nx.DiGraph()
+        nx.add_cycle(graph, range(1200), weight=1)
+        graph.add_edge(600, 0, weight=1)
+        ring = mason.CycleGraph(graph)
+
+        cycles = sorted(len(edges) for _, edges in mason.find_cycles(ring))
+        self.assertEqual(cycles, [601, 1200])
+        self.assertEqual(
+            sorted(len(edges) for _, edges in
+                   mason.find_cycles(ring, max_length=1500)), [601, 1200])
+
+
+class TestMasonContext(unittest.TestCase):
+    def setUp(self):
+        self.sfg = example_sfg()
+        self.context = mason.MasonContext(self.sfg)
+
+    def test_matches_transfer_function(self):
+        for input_node, output_node in [('y1', 'y6'), ('y2', 'y4'),
+                                        ('y3', 'y5')]:
+            expected, expected_loop_gain = transfer_function(
+                self.sfg, input_node, output_node)
+            actual, actual_loop_gain = self.context.transfer_function(
+                input_node, output_node)
+
+            self.assertEqual(sympy.simplify(expected - actual), 0)
+            self.assertEqual(expected_loop_gain, actual_loop_gain)
+
+    def test_loop_gain(self):
+        self.assertEqual(self.context.loop_gain(), mason.loop_gain(self.sfg))
+
+    def test_factorises_over_components(self):
+        # Two cascaded stages with local feedback.
+        graph = nx.DiGraph()
+        for src, dst, gain in [('u', 'a', 'g1'), ('a', 'b', 'g2'),
+                               ('b', 'a', 'h1'), ('b', 'c', 'g3'),
+                               ('c', 'd', 'g4'), ('d', 'c', 'h2'),
+                               ('d', 'd', 'h3'), ('d', 'y', 'g5')]:
+            graph.add_edge(src, dst, weight=sympy.Symbol(gain))
+
+        context = mason.MasonContext(graph)
+        self.assertEqual(len(context.components), 2)
+        self.assertEqual(len(context.cycles), 3)
+
+        g2, g4, h1, h2, h3 = sympy.symbols('g2 g4 h1 h2 h3')
+        self.assertEqual(sympy.expand(context.determinant),
+                         sympy.expand((1 - g2 * h1) * (1 - g4 * h2 - h3)))
+
+        expected = mason.elimination_transfer_function(graph, 'u', 'y')[0]
+        actual, _ = context.transfer_function('u', 'y')
+        self.assertEqual(sympy.simplify(expected - actual), 0)
+
+    def test_reuses_results(self):
+        first, _ = self.context.transfer_function('y1', 'y6')
+        second, _ = self.context.transfer_function('y1', 'y6')
+        self.assertIs(first, second)
+
+
+class TestBudget(unittest.TestCase):
+    def test_streaming_terms(self):
+        sfg = example_sfg()
+        terms = list(mason.iter_transfer_function(sfg, 'y1', 'y6'))
+
+        kinds = [kind for kind, _ in terms]
+        self.assertEqual(kinds, sorted(kinds))
+        numerator = sympy.Add.fromiter(
+            term for kind, term in terms if kind == 'numerator')
+        denominator = sympy.Mul.fromiter(
+            term for kind, term in terms if kind == 'denominator')
+
+        expected, _ = transfer_function(sfg, 'y1', 'y6')
+        self.assertEqual(sympy.simplify(expected - numerator / denominator), 0)
+
+    def test_term_budget(self):
+        with self.assertRaises(mason.BudgetExceeded):
+            transfer_function(example_sfg(), 'y1', 'y6',
+                              budget=mason.Budget(terms=3))
+        with self.assertRaises(mason.BudgetExceeded):
+            list(mason.iter_transfer_function(example_sfg(), 'y1', 'y6',
+                                              mason.Budget(terms=3)))
+
+        budget = mason.Budget(terms=1000)
+        transfer_function(example_sfg(), 'y1', 'y6', budget=budget)
+        self.assertGreater(budget.count, 0)
+
+    def test_time_budget(self):
+        with self.assertRaises(mason.BudgetExceeded):
+            mason.loop_gain(example_sfg(), mason.Budget(seconds=0))
+
+    def test_cancel(self):
+        cancel = threading.Event()
+        budget = mason.Budget(cancel=cancel)
+        terms = mason.iter_transfer_function(example_sfg(), 'y1', 'y6',
+                                             budget)
+        next(terms)
+
+        cancel.set()
+        with self.assertRaises(mason.BudgetExceeded):
+            list(terms)
+
+
+class TestParallel(unittest.TestCase):
+    def test_matches_serial(self):
+        sfg = example_sfg()
+
+        for input_node, output_node in [('y1', 'y6'), ('y2', 'y4')]:
+            expected, expected_loop_gain = transfer_function(
+                sfg, input_node, output_node)
+            with mock.patch.object(mason, 'PARALLEL_MIN_TERMS', 1):
+                actual, actual_loop_gain = transfer_function(
+                    sfg, input_node, output_node, processes=2)
+
+            self.assertEqual(sympy.simplify(expected - actual), 0)
+            self.assertEqual(sympy.expand(expected_loop_gain
+                                          - actual_loop_gain), 0)
+
+    def test_reuses_pool(self):
+        pool = mason.process_pool(2)
+        self.assertIs(mason.process_pool(2), pool)
+        self.assertIsNone(mason.process_pool(0))
+
+        with mock.patch.object(mason, 'PARALLEL_MIN_TERMS', 1):
+            transfer_function(example_sfg(), 'y1', 'y6', processes=2)
+        self.assertIs(mason.process_pool(2), pool)
+
+    def test_small_sums_stay_serial(self):
+        with mock.patch.object(mason, 'parallel_sum') as parallel_sum:
+            transfer_function(example_sfg(), 'y1', 'y6', processes=2)
+        parallel_sum.assert_not_called()
+
+    def test_path_shard_is_picklable(self):
+        sfg = example_sfg()
+        context = mason.MasonContext(sfg)
+        shard = mason.PathShard(sfg, [['y1', 'y2']], context.components)
+        unpickled = pickle.loads(pickle.dumps(shard))
+        self.assertEqual(mason._path_shard_sum(unpickled),
+                         mason._path_shard_sum(shard))
+
+    def test_components_pickle_without_terms(self):
+        component = mason.MasonContext(example_sfg()).components[0]
+        cofactor = component.cofactor(['y2'])
+
+        unpickled = pickle.loads(pickle.dumps(component))
+        self.assertIsNone(unpickled._terms)
+        self.assertEqual(unpickled.cofactor(['y2']), cofactor)
+
+    def test_combination_shards_sum_to_determinant(self):
+        component = mason.MasonContext(example_sfg()).components[0]
+        shards = [mason.CombinationShard(component._cycle_gains, shard)
+                  for shard in mason._split(component.cycle_combinations, 2)]
+
+        self.assertEqual(
+            sympy.expand(1 + sum(mason._combination_shard_sum(shard)
+                                 for shard in shards)
+                         - component.determinant), 0)
+
+
+class TestFingerprint(unittest.TestCase):
+    def test_ignores_insertion_order(self):
+        sfg = example_sfg()
+        reordered = nx.DiGraph()
+        reordered.add_edges_from(reversed(list(sfg.edges(data=True))))
+
+        self.assertEqual(mason.sfg_fingerprint(reordered),
+                         mason.sfg_fingerprint(sfg))
+
+    def test_covers_weights(self):
+        sfg = example_sfg()
+        fingerprint = mason.sfg_fingerprint(sfg)
+
+        sfg['y1']['y2']['weight'] = sympy.Symbol('a') * sympy.Symbol('s')
+        self.assertNotEqual(mason.sfg_fingerprint(sfg), fingerprint)
+
+
+class TestPruning(unittest.TestCase):
+    def setUp(self):
+        # Extend the example with a loop hanging off the output, and a loop
+        # feeding into the input, neither of which touches a forward path.
+        self.sfg = example_sfg()
+        for src, dst, gain in [('y6', 'z1', 'k1'), ('z1', 'z1', 'k2'),
+                               ('z2', 'z2', 'k3'), ('z2', 'y1', 'k4')]:
+            self.sfg.add_edge(src, dst, weight=sympy.Symbol(gain))
+
+    def test_relevant_nodes(self):
+        self.assertEqual(mason.relevant_nodes(self.sfg, 'y1', 'y6'),
+                         {'y1', 'y2', 'y3', 'y4', 'y5', 'y6'})
+        self.assertEqual(mason.relevant_nodes(self.sfg, 'y6', 'y1'), set())
+
+    def test_irrelevant_loops_cancel(self):
+        context = mason.MasonContext(self.sfg)
+        actual, loop_gain = context.transfer_function('y1', 'y6')
+        expected, _ = transfer_function(example_sfg(), 'y1', 'y6')
+
+        self.assertEqual(sympy.simplify(expected - actual), 0)
+        self.assertTrue({sympy.Symbol('k2'), sympy.Symbol('k3')}
+                        .isdisjoint(actual.free_symbols))
+        # The loop gain still covers the whole SFG.
+        self.assertTrue({sympy.Symbol('k2'), sympy.Symbol('k3')}
+                        <= loop_gain.free_symbols)
+
+    def test_irrelevant_loops_not_enumerated(self):
+        # A complete graph on 7 nodes, with 2365 cycles, hanging off the
+        # output.
+        for src, dst in nx.complete_graph(7, nx.DiGraph).edges:
+            self.sfg.add_edge('k%d' % src, 'k%d' % dst, weight=1)
+        self.sfg.add_edge('y6', 'k0', weight=1)
+        context = mason.MasonContext(self.sfg)
+
+        actual, loop_gain = context.transfer_function(
+            'y1', 'y6', mason.Budget(terms=200), with_loop_gain=False)
+        expected, _ = transfer_function(example_sfg(), 'y1', 'y6')
+
+        self.assertEqual(sympy.simplify(expected - actual), 0)
+        self.assertIsNone(loop_gain)
+        with self.assertRaises(mason.BudgetExceeded):
+            context.loop_gain(mason.Budget(terms=200))
+
+    def test_elimination_loop_gain_covers_whole_sfg(self):
+        _, expected = mason.MasonContext(self.sfg).transfer_function(
+            'y1', 'y6')
+        _, actual = mason.elimination_transfer_function(self.sfg, 'y1', 'y6')
+
+        # Elimination keeps the loop gain in factored form.
+        self.assertEqual(sympy.simplify(expected - actual), 0)
+
+    def test_unreachable_output(self):
+        actual, _ = mason.elimination_transfer_function(self.sfg, 'y6', 'y1')
+        self.assertEqual(actual, 0)
+        self.assertEqual(
+            mason.MasonContext(self.sfg).transfer_function('y6', 'y1')[0], 0)
+
+
+class TestReduction(unittest.TestCase):
+    def setUp(self):
+        # A chain with a series node 'b', a parallel branch through 'c', and a
+        # node 'd' with a self-loop inside a feedback loop.
+        self.sfg = nx.DiGraph()
+        for src, dst, gain in [('u', 'a', 'g1'), ('a', 'b', 'g2'),
+                               ('b', 'd', 'g3'), ('a', 'c', 'g4'),
+                               ('c', 'd', 'g5'), ('d', 'd', 'l1'),
+                               ('d', 'y', 'g6'), ('y', 'a', 'h1')]:
+            self.sfg.add_edge(src, dst, weight=sympy.Symbol(gain))
+
+    def test_reduce_sfg(self):
+        reduction = mason.reduce_sfg(self.sfg, keep=('u', 'y'))
+
+        self.assertEqual(set(reduction.sfg), {'u', 'y', 'a'})
+        self.assertEqual(set(reduction.absorbed), {'b', 'c', 'd'})
+        self.assertEqual(reduction.absorbed['b'], ('a', 'y'))
+        self.assertEqual(reduction.scale, 1 - sympy.Symbol('l1'))
+
+    def test_transfer_function_unchanged(self):
+        expected, expected_loop_gain = transfer_function(self.sfg, 'u', 'y')
+        actual, actual_loop_gain = transfer_function(self.sfg, 'u', 'y',
+                                                     reduce=True)
+
+        self.assertEqual(sympy.simplify(expected - actual), 0)
+        self.assertEqual(
+            sympy.simplify(expected_loop_gain - actual_loop_gain), 0)
+
+    def test_keeps_self_loops(self):
+        reduction = mason.reduce_sfg(self.sfg, keep=('u', 'y'),
+                                     fold_self_loops=False)
+
+        self.assertEqual(reduction.scale, 1)
+        self.assertTrue(reduction.sfg.has_edge('d', 'd'))
+        # The reduced SFG has the same loop gain without any scale.
+        self.assertEqual(sympy.simplify(mason.loop_gain(reduction.sfg)
+                                        - mason.loop_gain(self.sfg)), 0)
+        expected, _ = transfer_function(self.sfg, 'u', 'y')
+        actual, _ = transfer_function(reduction.sfg, 'u', 'y')
+        self.assertEqual(sympy.simplify(expected - actual), 0)
+
+
+class TestEliminationEngine(unittest.TestCase):
+    def setUp(self):
+        self.sfg = example_sfg()
+
+    def test_transfer_function_matches_mason(self):
+        for input_node, output_node in [('y1', 'y6'), ('y2', 'y4')]:
+            expected, expected_loop_gain = transfer_function(
+                self.sfg, input_node, output_node)
+            actual, actual_loop_gain = mason.elimination_transfer_function(
+                self.sfg, input_node, output_node)
+
+            self.assertEqual(sympy.simplify(expected - actual), 0)
+            self.assertEqual(
+                sympy.simplify(expected_loop_gain - actual_loop_gain), 0)
+
+    def test_loop_gain_matches_mason(self):
+        self.assertEqual(sympy.simplify(mason.elimination_loop_gain(self.sfg)
+                                        - mason.loop_gain(self.sfg)), 0)
+
+    def test_many_loops(self):
+        # A ring with a self-loop on every node has 2^n combinations of
+        # non-touching loops, but elimination never enumerates them.
+        n = 40
+        sfg = nx.DiGraph()
+        for i in range(n):
+            sfg.add_edge(i, (i + 1) % n, weight=sympy.Symbol('a%d' % i))
+            sfg.add_edge(i, i, weight=sympy.Symbol('b%d' % i))
+
+        actual, loop_gain = mason.elimination_transfer_function(
+            sfg, 0, n - 1, mason.Budget(seconds=10))
+
+        values = {sympy.Symbol('a%d' % i): 0.5 for i in range(n)}
+        values.update({sympy.Symbol('b%d' % i): 0.25 for i in range(n)})
+        # Every node passes on 0.5 / (1 - 0.25) of its input.
+        gain = 0.5 / 0.75
+        self.assertAlmostEqual(
+            float(actual.xreplace(values)),
+            gain ** (n - 1) / 0.75 / (1 - gain ** n))
+        self.assertAlmostEqual(float(loop_gain.xreplace(values)),
+                               1 - 0.75 ** n * (1 - gain ** n))
+
+    def test_budget(self):
+        with self.assertRaises(mason.BudgetExceeded):
+            mason.elimination_transfer_function(self.sfg, 'y1', 'y6',
+                                                mason.Budget(terms=2))
+
+    def test_bareiss_determinant(self):
+        _, a, b, c, d = ring('a b c d', ZZ)
+        self.assertEqual(mason.bareiss_determinant([[a, b], [c, d]]),
+                         a * d - b * c)
+        # A zero leading pivot requires a row swap.
+        self.assertEqual(mason.bareiss_determinant([[0, b], [c, d]]), -b * c)
+
+
+class TestTransferMatrix(unittest.TestCase):
+    def setUp(self):
+        self.sfg = example_sfg()
+        self.inputs = ['y1', 'y2']
+        self.outputs = ['y6', 'y4', 'y1']
+
+    def test_symbolic(self):
+        matrix = mason.elimination_transfer_matrix(self.sfg, self.inputs,
+                                                   self.outputs)
+        self.assertEqual(matrix.shape, (3, 2))
+
+        for j, output_node in enumerate(self.outputs):
+            for i, input_node in enumerate(self.inputs):
+                expected, _ = transfer_function(self.sfg, input_node,
+                                                output_node)
+                self.assertEqual(sympy.simplify(expected - matrix[j, i]), 0)
+
+    def test_numeric(self):
+        s = 1j * np.logspace(0, 3, 4)
+        matrix = mason.numeric_transfer_matrix(
+            self.sfg, self.inputs, self.outputs, s, EXAMPLE_PARAMETERS)
+        self.assertEqual(matrix.shape, (4, 3, 2))
+
+        for j, output_node in enumerate(self.outputs):
+            for i, input_node in enumerate(self.inputs):
+                np.testing.assert_allclose(
+                    matrix[:, j, i],
+                    mason.numeric_transfer_function(
+                        self.sfg, input_node, output_node, s,
+                        EXAMPLE_PARAMETERS))
+
+    def test_bareiss_solve(self):
+        R, x, y = ring('x,y', ZZ)
+        matrix = [[R(2), x], [y, R(1)]]
+        d, scaled = mason.bareiss_solve(matrix, [[R(1)], [R(0)]])
+
+        # The solution is [1, -y] / (2 - x*y), up to the sign of d.
+        self.assertEqual(scaled[0][0] * (2 - x * y), d)
+        self.assertEqual(scaled[1][0] * (2 - x * y), -y * d)
+
+
+class TestPlanner(unittest.TestCase):
+    def test_estimate_cost(self):
+        estimate = mason.estimate_cost(example_sfg(), 'y1', 'y6')
+
+        self.assertEqual(estimate['paths'], 2)
+        self.assertEqual(estimate['cycles'], 5)
+        self.assertEqual(estimate['components'], 1)
+        components = mason.MasonContext(example_sfg()).components
+        self.assertEqual(estimate['combinations'],
+                         len(components[0].cycle_combinations))
+        self.assertFalse(estimate['exceeded'])
+        self.assertEqual(mason.plan_engine(estimate), 'mason')
+
+    def test_combinations_multiply_across_components(self):
+        # Two cascaded stages, each with two touching self-loops.
+        graph = nx.DiGraph()
+        for node in ['a', 'b', 'c', 'd']:
+            graph.add_edge(node, node, weight=sympy.Symbol('l' + node))
+        graph.add_edge('a', 'b', weight=1)
+        graph.add_edge('b', 'c', weight=1)
+        graph.add_edge('c', 'd', weight=1)
+        graph.add_edge('b', 'a', weight=1)
+        graph.add_edge('d', 'c', weight=1)
+
+        estimate = mason.estimate_cost(graph)
+
+        self.assertEqual(estimate['components'], 2)
+        # Each stage has 3 cycles and 4 combinations; the whole SFG has
+        # (4 + 1) ** 2 - 1 combinations.
+        self.assertEqual(estimate['cycles'], 6)
+        self.assertEqual(estimate['combinations'], 24)
+
+    def test_plans_elimination_when_limit_reached(self):
+        estimate = mason.estimate_cost(example_sfg(), 'y1', 'y6', limit=3)
+
+        self.assertTrue(estimate['exceeded'])
+        self.assertEqual(mason.plan_engine(estimate), 'elimination')
+        self.assertEqual(mason.plan_engine(estimate, symbolic=False),
+                         'numeric')
+
+
+    def test_many_disjoint_loops(self):
+        # A hub with 1000 spokes, each with a self-loop. The self-loops do not
+        # touch each other, so combinations nest far deeper than the
+        # recursion limit.
+        graph = nx.DiGraph()
+        for i in range(1000):
+            node = 'n%d' % i
+            graph.add_edge('hub', node, weight=1)
+            graph.add_edge(node, 'hub', weight=1)
+            graph.add_edge(node, node, weight=sympy.Symbol('l%d' % i))
+
+        estimate = mason.estimate_cost(graph)
+
+        self.assertEqual(estimate['cycles'], 2000)
+        self.assertTrue(estimate['exceeded'])
+        # Its determinant has a factor for every spoke in each of 1000 terms,
+        # which is too large for elimination too.
+        self.assertGreater(estimate['elimination_size'],
+                           mason.ELIMINATION_SIZE_LIMIT)
+        with self.assertRaises(mason.BudgetExceeded):
+            mason.plan_engine(estimate)
+
+    def test_plans_elimination_for_many_loops(self):
+        # A ring with a self-loop on every node has 2^16 combinations of
+        # non-touching loops, but a small eliminated expression.
+        graph = nx.DiGraph()
+        for i in range(16):
+            graph.add_edge(i, (i + 1) % 16, weight=sympy.Symbol('a%d' % i))
+            graph.add_edge(i, i, weight=sympy.Symbol('b%d' % i))
+
+        estimate = mason.estimate_cost(graph, 0, 15)
+
+        self.assertTrue(estimate['exceeded'])
+        self.assertEqual(mason.plan_engine(estimate), 'elimination')
+        budget = mason.Budget()
+        mason.elimination_transfer_function(graph, 0, 15, budget,
+                                            with_loop_gain=False)
+        self.assertLess(budget.count, 100)
+
+    def test_refuses_when_both_engines_exceed(self):
+        # Every pair of nodes is connected both ways.
+        graph = nx.complete_graph(8, nx.DiGraph)
+        nx.set_edge_attributes(graph, {
+            edge: sympy.Symbol('g%d_%d' % edge) for edge in graph.edges},
+            'weight')
+
+        estimate = mason.estimate_cost(graph, 0, 7)
+
+        self.assertGreater(estimate['terms'], mason.MASON_TERM_LIMIT)
+        self.assertGreater(estimate['elimination_size'],
+                           mason.ELIMINATION_SIZE_LIMIT)
+        with self.assertRaises(mason.BudgetExceeded):
+            mason.plan_engine(estimate)
+        self.assertEqual(mason.plan_engine(estimate, symbolic=False),
+                         'numeric')
+
+    def test_prunes_before_estimating(self):
+        graph = example_sfg()
+        # An unrelated loop, which does not affect the transfer function.
+        graph.add_edge('z1', 'z2', weight=1)
+        graph.add_edge('z2', 'z1', weight=1)
+        graph.add_edge('y1', 'z1', weight=1)
+
+        estimate = mason.estimate_cost(graph, 'y1', 'y6')
+        self.assertEqual(estimate['cycles'], 5)
+
+    def test_estimate_checks_budget(self):
+        cancel = threading.Event()
+        cancel.set()
+
+        with self.assertRaises(mason.BudgetExceeded):
+            mason.estimate_cost(example_sfg(), 'y1', 'y6',
+                                budget=mason.Budget(cancel=cancel))
+
+
+class TestNumericEngine(unittest.TestCase):
+    def setUp(self):
+        self.sfg = example_sfg()
+        # Make a forward gain and a loop gain frequency dependent.
+        self.sfg.edges['y1', 'y2']['weight'] = sympy.sympify('a / (1 + s)')
+        self.sfg.edges['y5', 'y5']['weight'] = sympy.sympify('f * s / (1 + s)')
+        self.s = 1j * np.logspace(-2, 2, 9)
+
+    def evaluate(self, expr):
+        func = sympy.lambdify('s', expr.subs(EXAMPLE_PARAMETERS), 'numpy')
+        return np.broadcast_to(func(self.s), self.s.shape)
+
+    def test_transfer_function_matches_mason(self):
+        expected, _ = transfer_function(self.sfg, 'y1', 'y6')
+        actual = mason.numeric_transfer_function(
+            self.sfg, 'y1', 'y6', self.s, EXAMPLE_PARAMETERS)
+
+        np.testing.assert_allclose(actual, self.evaluate(expected))
+
+    def test_loop_gain_matches_mason(self):
+        expected = mason.loop_gain(self.sfg)
+        actual = mason.numeric_loop_gain(self.sfg, self.s, EXAMPLE_PARAMETERS)
+
+        np.testing.assert_allclose(actual, self.evaluate(expected))
+
+    def test_missing_parameter(self):
+        with self.assertRaises(ValueError):
+            mason.numeric_loop_gain(self.sfg, self.s, {'a': 1.0})
+
+    def test_invalid_node(self):
+        with self.assertRaises(ValueError):
+            mason.numeric_transfer_function(
+                self.sfg, 'y1', 'y7', self.s, EXAMPLE_PARAMETERS)
+
+    def test_reuses_compiled_weights(self):
+        first = mason.gain_matrix(self.sfg, self.s, EXAMPLE_PARAMETERS)
+        compiled = mason._edge_function(self.sfg)[1]
+
+        parameters = dict(EXAMPLE_PARAMETERS, a=2 * EXAMPLE_PARAMETERS['a'])
+        second = mason.gain_matrix(self.sfg, self.s, parameters)
+
+        self.assertIs(mason._edge_function(self.sfg)[1], compiled)
+        index = list(self.sfg).index
+        np.testing.assert_allclose(
+            second[:, index('y2'), index('y1')],
+            2 * first[:, index('y2'), index('y1')])
 
-        import sympy as sp
+    def test_concurrent_evictions(self):
+        other = self.sfg.copy()
+        other['y1']['y2']['weight'] = 2 * other['y1']['y2']['weight']
+        errors = []
 
-        expected_transfer = '(s + 3x - 2) / 23'
+        def evaluate(sfg):
+            try:
+                for _ in range(20):
+                    mason.gain_matrix(sfg, self.s, EXAMPLE_PARAMETERS)
+            except Exception as e:
+                errors.append(e)
 
+        with mock.patch.object(mason, 'EDGE_FUNCTION_LIMIT', 1):
+            threads = [threading.Thread(target=evaluate, args=(sfg,))
+                       for sfg in [self.sfg, other] * 4]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
 
+        self.assertEqual(errors, [])
 
 
 if __name__ == '__main__':
@@ -0,0 +1,170 @@
+import pickle
+import unittest
+
+import numpy as np
+import sympy
+
+from rational import (RationalFunction, bandwidth, polynomial_coefficients,
+                      polynomial_roots)
+
+
+s, a, b, c = sympy.symbols('s a b c')
+
+
+class TestPolynomialCoefficients(unittest.TestCase):
+    def test_collects_by_powers_of_s(self):
+        coefficients = polynomial_coefficients(
+            (a * s + 1) * (b * s ** 2 + c) + a)
+
+        self.assertEqual(len(coefficients), 4)
+        for actual, expected in zip(coefficients,
+                                    [c + a, a * c, b, a * b]):
+            self.assertEqual(sympy.expand(actual - expected), 0)
+
+    def test_not_polynomial(self):
+        with self.assertRaises(ValueError):
+            polynomial_coefficients(1 / (s + a))
+
+
+class TestRationalFunction(unittest.TestCase):
+    def setUp(self):
+        self.expr = a / (1 + 1 / (b * s)) + c
+        self.rational = RationalFunction.from_expr(self.expr)
+
+    def test_from_expr(self):
+        self.assertEqual(sympy.simplify(self.rational.as_expr() - self.expr),
+                         0)
+
+    def test_cancels_common_powers_of_s(self):
+        rational = RationalFunction([0, 0, a], [0, b, c])
+        self.assertEqual(rational.numerator, [0, a])
+        self.assertEqual(rational.denominator, [b, c])
+
+    def test_evaluate(self):
+        parameters = {'a': 2.0, 'b': 0.5, 'c': 3.0}
+        points = 1j * np.logspace(-2, 2, 9)
+
+        expected = sympy.lambdify(s, self.expr.subs(parameters))(points)
+        np.testing.assert_allclose(
+            self.rational.evaluate(points, parameters), expected)
+
+    def test_missing_parameters(self):
+        with self.assertRaises(ValueError):
+            self.rational.coefficients({'a': 1.0})
+
+    def test_substitute(self):
+        rational = self.rational.substitute({'a': 2.0, 'b': 0.5, 'c': 3.0})
+        self.assertEqual(rational.free_symbols(), set())
+
+    def test_formatting(self):
+        self.assertEqual(RationalFunction([1, a], [c, 0, b]).to_string(),
+                         '(a*s + 1)/(b*s**2 + c)')
+        self.assertEqual(RationalFunction([1, a + b], [1]).latex(),
+                         r'\frac{(a + b) s + 1}{1}')
+
+    def test_pickle(self):
+        self.rational.coefficients({'a': 1.0, 'b': 1.0, 'c': 1.0})
+        self.assertEqual(pickle.loads(pickle.dumps(self.rational)),
+                         self.rational)
+
+    def test_digest(self):
+        digest = self.rational.digest()
+        self.assertEqual(RationalFunction.from_expr(self.expr).digest(),
+                         digest)
+        self.assertEqual(pickle.loads(pickle.dumps(self.rational))._digest,
+                         digest)
+        self.assertNotEqual(RationalFunction([1, a], [b]).digest(), digest)
+
+
+class TestPolesZeros(unittest.TestCase):
+    def setUp(self):
+        # 1e3 * s * (s + 10) / ((s + 1) * (s + 1e6)), spanning six decades.
+        self.rational = RationalFunction.from_expr(
+            a * s * (s + 10) / ((s + 1) * (s + b)))
+        self.parameters = {'a': 1e3, 'b': 1e6}
+
+    def test_roots(self):
+        np.testing.assert_allclose(self.rational.poles(self.parameters),
+                                   [-1, -1e6])
+        np.testing.assert_allclose(self.rational.zeros(self.parameters),
+                                   [0, -10], atol=1e-9)
+
+    def test_dc_gain(self):
+        self.assertEqual(self.rational.dc_gain(self.parameters), 0)
+        self.assertTrue(np.isinf(
+            RationalFunction([1], [0, 1]).dc_gain()))
+
+    def test_dominant_pole_estimate(self):
+        self.assertAlmostEqual(
+            self.rational.dominant_pole_estimate(self.parameters), -1,
+            places=5)
+
+    def test_polynomial_roots(self):
+        # (s - 1e-3) * (s^2 + 2s + 2) * s^2, in ascending powers of s.
+        coefficients = np.polynomial.polynomial.polyfromroots(
+            [1e-3, -1 + 1j, -1 - 1j, 0, 0]).real
+        roots = polynomial_roots(coefficients)
+
+        np.testing.assert_allclose(roots[:3], [0, 0, 1e-3], atol=1e-12)
+        np.testing.assert_allclose(np.sort_complex(roots[3:]),
+                                   [-1 - 1j, -1 + 1j])
+        self.assertEqual(len(polynomial_roots([2.0])), 0)
+
+
+class TestBandwidth(unittest.TestCase):
+    def test_band_pass(self):
+        # A second order band-pass at 10 kHz with a Q of 5, whose half power
+        # corners are exactly f0 / Q apart.
+        w0, q = 2 * np.pi * 1e4, 5.0
+        result = bandwidth([0, w0 / q], [w0 ** 2, w0 / q, 1],
+                           drop=10 * np.log10(2))
+
+        offset = np.sqrt(1 + 1 / (4 * q ** 2))
+        self.assertAlmostEqual(result['lower'], 1e4 * (offset - 1 / (2 * q)),
+                               places=6)
+        self.assertAlmostEqual(result['upper'], 1e4 * (offset + 1 / (2 * q)),
+                               places=6)
+        self.assertAlmostEqual(result['bandwidth'], 1e4 / q, places=6)
+        self.assertAlmostEqual(result['peak_frequency'], 1e4, places=6)
+        self.assertAlmostEqual(result['peak_gain'], 0, places=9)
+
+    def test_low_pass_and_high_pass(self):
+        low_pass = bandwidth([1.0], [1.0, 1e-3], drop=10 * np.log10(2))
+        self.assertTrue(np.isnan(low_pass['lower']))
+        self.assertAlmostEqual(low_pass['upper'], 1e3 / (2 * np.pi))
+        self.assertAlmostEqual(low_pass['bandwidth'], 1e3 / (2 * np.pi))
+
+        high_pass = bandwidth([0, 1e-3], [1.0, 1e-3], drop=10 * np.log10(2))
+        self.assertAlmostEqual(high_pass['lower'], 1e3 / (2 * np.pi))
+        self.assertTrue(np.isnan(high_pass['upper']))
+        self.assertTrue(np.isnan(high_pass['bandwidth']))
+
+    def test_parameter_array(self):
+        r, c = sympy.symbols('R C')
+        rational = RationalFunction([1], [1, r * c])
+        resistances = np.array([1e3, 2e3, 4e3])
+
+        result = rational.bandwidth({'R': resistances, 'C': 1e-9},
+                                    drop=10 * np.log10(2))
+        np.testing.assert_allclose(result['upper'],
+                                   1 / (2 * np.pi * resistances * 1e-9))
+
+    def test_mixed_batch(self):
+        # Band-pass, low-pass, high-pass, zero, and unbounded functions
+        # of different degrees, solved together.
+        numerators = [[0, 2e4, 0], [1, 0, 0], [0, 1e-3, 0], [0, 0, 0],
+                      [1, 1, 1]]
+        denominators = [[4e10, 2e4, 1], [1, 1e-3, 1e-9], [1, 1e-3, 0],
+                        [1, 1, 0], [1, 1, 0]]
+
+        result = bandwidth(np.transpose(numerators),
+                           np.transpose(denominators))
+        for i, (numerator, denominator) in enumerate(
+                zip(numerators, denominators)):
+            expected = bandwidth(numerator, denominator)
+            for name, value in expected.items():
+                np.testing.assert_allclose(result[name][i], value)
+
+
+if __name__ == '__main__':
+    unittest.main()
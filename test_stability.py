@@ -0,0 +1,96 @@
+import unittest
+
+import numpy as np
+
+import stability
+
+
+class TestBrent(unittest.TestCase):
+    def test_many_brackets(self):
+        roots, evaluations = stability.brentq(
+            lambda x: x ** 3 - np.array([2, 3]),
+            np.array([0.0, 1.0]), np.array([2.0, 3.0]))
+
+        np.testing.assert_allclose(roots, np.cbrt([2, 3]))
+        self.assertLess(evaluations, 20)
+
+    def test_invalid_bracket(self):
+        with self.assertRaises(ValueError):
+            stability.brentq(lambda x: x ** 2 + 1, -1.0, 1.0)
+
+
+class TestStabilityMargins(unittest.TestCase):
+    def setUp(self):
+        # Three coincident poles at 100 kHz, for two DC gains.
+        self.gains = np.array([[2.0], [100.0]])
+        self.pole = 2 * np.pi * 1e5
+
+    def response(self, s):
+        return self.gains / (1 + s / self.pole) ** 3
+
+    def test_margins(self):
+        margins = stability.stability_margins(self.response)
+
+        for k, row in zip(self.gains[:, 0], range(2)):
+            crossover = self.pole * np.sqrt(k ** (2 / 3) - 1)
+            phase = -3 * np.degrees(np.arctan(crossover / self.pole))
+
+            self.assertAlmostEqual(margins['gain_crossover'][row],
+                                   crossover / (2 * np.pi), delta=1e-3)
+            self.assertAlmostEqual(margins['phase_margin'][row], 180 + phase,
+                                   places=6)
+            # The phase is -180 degrees where the frequency is sqrt(3)
+            # times the pole, and the gain is k / 8.
+            self.assertAlmostEqual(margins['phase_crossover'][row],
+                                   np.sqrt(3) * 1e5, delta=1e-3)
+            self.assertAlmostEqual(margins['gain_margin'][row],
+                                   -20 * np.log10(k / 8), places=6)
+
+        # The second response is unstable.
+        self.assertLess(margins['phase_margin'][1], 0)
+        # Far fewer evaluations than a 30 points per decade grid.
+        self.assertLess(margins['evaluations'][0], 270)
+
+    def test_no_crossover(self):
+        margins = stability.stability_margins(
+            lambda s: 0.5 / (1 + s / self.pole) + 0 * s)
+
+        self.assertTrue(np.isnan(margins['gain_crossover'][0]))
+        self.assertTrue(np.isnan(margins['phase_margin'][0]))
+        self.assertTrue(np.isnan(margins['gain_margin'][0]))
+
+
+class TestSolveTarget(unittest.TestCase):
+    def setUp(self):
+        self.pole = 2 * np.pi * 1e5
+
+    def phase_margin(self, gains):
+        return stability.stability_margins(
+            lambda s: gains[:, None] / (1 + s / self.pole) ** 3)[
+                'phase_margin']
+
+    def test_phase_margin(self):
+        # The phase margin is 45 degrees where the crossover is at the pole,
+        # which is where the gain is 2 ** 1.5.
+        solution = stability.solve_target(self.phase_margin, 45, 1.5, 8.0)
+
+        self.assertAlmostEqual(solution['value'], 2 ** 1.5, places=5)
+        self.assertAlmostEqual(solution['metric'], 45, places=4)
+        self.assertEqual(solution['history'][-1],
+                         (solution['value'], solution['metric']))
+        self.assertLess(len(solution['history']), 15)
+
+    def test_linear(self):
+        solution = stability.solve_target(lambda x: x ** 2, 2, 0, 3,
+                                          scale='linear')
+        self.assertAlmostEqual(solution['value'], np.sqrt(2), places=5)
+
+    def test_not_bracketed(self):
+        with self.assertRaises(ValueError):
+            stability.solve_target(self.phase_margin, 45, 4.0, 8.0)
+        with self.assertRaises(ValueError):
+            stability.solve_target(lambda x: x, 1, -1, 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
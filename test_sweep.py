@@ -0,0 +1,112 @@
+import unittest
+
+import numpy as np
+
+import sweep
+
+
+class TestSweepValues(unittest.TestCase):
+    def test_linear_includes_stop(self):
+        np.testing.assert_allclose(sweep.sweep_values(0.1, 0.3, 0.1),
+                                   [0.1, 0.2, 0.3])
+        np.testing.assert_allclose(sweep.sweep_values(1, 2, points=3),
+                                   [1, 1.5, 2])
+
+    def test_log(self):
+        np.testing.assert_allclose(
+            sweep.sweep_values(1e-9, 1e-6, scale='log', points=4),
+            [1e-9, 1e-8, 1e-7, 1e-6])
+
+    def test_list(self):
+        np.testing.assert_allclose(
+            sweep.sweep_values(scale='list', values=[3, 1, 2]), [3, 1, 2])
+
+    def test_invalid(self):
+        for kwargs in [{'start': 1, 'stop': 0, 'step': 1},
+                       {'start': 0, 'stop': 1, 'step': 0},
+                       {'start': 0, 'stop': 1, 'scale': 'log', 'points': 3},
+                       {'start': 0, 'stop': 1, 'scale': 'cubic'},
+                       {'scale': 'list', 'values': []}]:
+            with self.assertRaises(ValueError):
+                sweep.sweep_values(**kwargs)
+
+
+class TestAdaptiveFrequencies(unittest.TestCase):
+    def setUp(self):
+        # A resonance at 10 kHz with a Q of 100.
+        w0, q = 2 * np.pi * 1e4, 100
+        self.response = lambda f: w0 ** 2 / (
+            (2j * np.pi * f) ** 2 + 2j * np.pi * f * w0 / q + w0 ** 2)
+
+    def test_resolves_peak(self):
+        freq, output = sweep.adaptive_frequencies(self.response, 1, 1e8)
+
+        self.assertTrue(np.all(np.diff(freq) > 0))
+        np.testing.assert_allclose(output, self.response(freq))
+        # The peak gain is Q, which a uniform grid of 30 points per decade
+        # misses by more than 10 dB.
+        self.assertAlmostEqual(20 * np.log10(np.abs(output).max()), 40,
+                               places=1)
+        self.assertLess(len(freq), 8 * 30)
+
+    def test_within_tolerance(self):
+        freq, output = sweep.adaptive_frequencies(self.response, 1, 1e8,
+                                                  hints=[1e4])
+        dense = np.logspace(0, 8, 100001)
+
+        interpolated = np.interp(np.log10(dense), np.log10(freq),
+                                 20 * np.log10(np.abs(output)))
+        error = interpolated - 20 * np.log10(np.abs(self.response(dense)))
+        self.assertLess(np.abs(error).max(), 0.2)
+
+    def test_max_points(self):
+        freq, _ = sweep.adaptive_frequencies(self.response, 1, 1e8,
+                                             gain_tolerance=0,
+                                             max_points=50)
+        self.assertLessEqual(len(freq), 50)
+
+
+class TestSampleParameters(unittest.TestCase):
+    def test_grid(self):
+        shape, values = sweep.sample_parameters(
+            {'a': [1, 2, 3], 'b': {'start': 1, 'stop': 100, 'scale': 'log',
+                                   'points': 3}})
+
+        self.assertEqual(shape, (3, 3))
+        np.testing.assert_allclose(values['a'].reshape(shape)[:, 0],
+                                   [1, 2, 3])
+        np.testing.assert_allclose(values['b'].reshape(shape)[0],
+                                   [1, 10, 100])
+
+    def test_latin_hypercube(self):
+        shape, values = sweep.sample_parameters(
+            {'a': [1, 10], 'b': [1, 1e4]}, 'latin_hypercube', samples=10,
+            scale='log', seed=0)
+
+        self.assertEqual(shape, (10,))
+        # Every stratum of every dimension is sampled exactly once.
+        np.testing.assert_array_equal(
+            np.sort(np.floor(10 * np.log10(values['b']) / 4)), np.arange(10))
+        self.assertTrue(np.all((values['a'] > 1) & (values['a'] < 10)))
+
+    def test_points(self):
+        shape, values = sweep.sample_parameters({'a': [1, 2], 'b': [3, 4]},
+                                                'points')
+        self.assertEqual(shape, (2,))
+        np.testing.assert_allclose(values['b'], [3, 4])
+
+    def test_invalid(self):
+        for args in [({'a': [1, 2], 'b': [3]}, 'points'),
+                     ({'a': [0, 1]}, 'latin_hypercube'),
+                     ({'a': [1, 2]}, 'random'),
+                     ({}, 'grid')]:
+            with self.assertRaises(ValueError):
+                sweep.sample_parameters(*args)
+
+    def test_chunks(self):
+        self.assertEqual(list(sweep.chunks(5, 2)),
+                         [slice(0, 2), slice(2, 4), slice(4, 5)])
+
+
+if __name__ == '__main__':
+    unittest.main()